@@ -0,0 +1,165 @@
+import os
+import json
+import numpy as np
+
+from projection import *
+from output_files import atomic_output
+
+# Version of the saved alignment format (changing it invalidates existing alignments)
+ALIGNMENT_FORMAT_VERSION = 1
+
+
+class AlignedEmbeddings:
+    """
+    Historical embeddings and modern embeddings projected into the historical space, stored as plain NumPy arrays.
+    The alignment can be saved as a directory of .npy files plus a small JSON manifest, and later opened
+    with memory mapping, so that loading the Word2Vec models and redoing the alignment is skipped and
+    several processes reading the same files share their pages
+    """
+
+    def __init__(self, historical_words, historical_vectors, historical_vectors_norm,
+                 modern_words, modern_projected_vectors, shared_words, ortho, manifest=None):
+        self.historical_words = historical_words                # row index -> word (historical space)
+        self.historical_index = {word: i for i, word in enumerate(historical_words)}
+        self.historical_vectors = historical_vectors            # historical vectors (float32)
+        self.historical_vectors_norm = historical_vectors_norm  # unit-length historical vectors (float32)
+        self.modern_words = modern_words                        # row index -> word (modern space)
+        self.modern_index = {word: i for i, word in enumerate(modern_words)}
+        self.modern_projected_vectors = modern_projected_vectors  # modern vectors projected by ortho (float32)
+        self.shared_words = shared_words                        # vocabulary used to compute the alignment
+        self.ortho = ortho                                      # rotation matrix
+        self.manifest = manifest                                # manifest of the saved alignment (None if not saved)
+
+    @classmethod
+    def from_models(cls, historical_model_file_path, modern_model_file_path):
+        """
+        Loading the Word2Vec models and aligning the modern embeddings to the historical ones
+        :param historical_model_file_path: path to the historical (COHA) embedding model Word2Vec .bin file
+        :param modern_model_file_path: path to the modern (COCA) embedding model Word2Vec .bin file
+        :return: aligned embeddings
+        """
+        from gensim.models import Word2Vec
+
+        # Only the word vectors are kept (the full models also hold the training weights)
+        historical_wv = Word2Vec.load(historical_model_file_path).wv
+        modern_wv = Word2Vec.load(modern_model_file_path).wv
+        shared_words = intersect_vocabularies(historical_wv, modern_wv)
+        modern_projected_wv, ortho = procrustes_align_keyed_vectors(historical_wv, modern_wv, common_vocab=shared_words)
+
+        historical_vectors = historical_wv.vectors
+        # Same normalization as gensim's KeyedVectors.init_sims
+        historical_vectors_norm = \
+            (historical_vectors / np.sqrt((historical_vectors ** 2).sum(-1))[..., np.newaxis]).astype(np.float32)
+
+        return cls(list(historical_wv.index2word), historical_vectors, historical_vectors_norm,
+                   list(modern_projected_wv.index2word), modern_projected_wv.vectors, shared_words, ortho)
+
+    def save(self, alignment_dir, sources):
+        """
+        Saving the aligned embeddings as .npy arrays and word lists, with a manifest describing them
+        :param alignment_dir: directory to save the alignment to
+        :param sources: list of paths to the files the alignment was computed from
+        :return:
+        """
+        os.makedirs(alignment_dir, exist_ok=True)
+        # The manifest is removed first and written last, so an interrupted save is never mistaken for a valid one
+        if os.path.exists(f"{alignment_dir}/manifest.json"):
+            os.remove(f"{alignment_dir}/manifest.json")
+
+        arrays = {
+            "historical.vectors": self.historical_vectors,
+            "historical.vectors_norm": self.historical_vectors_norm,
+            "modern.projected_vectors": self.modern_projected_vectors,
+            "ortho": self.ortho,
+        }
+        for name, array in arrays.items():
+            with atomic_output(f"{alignment_dir}/{name}.npy", 'wb') as fout:
+                np.save(fout, np.ascontiguousarray(array))
+
+        word_lists = {
+            "historical.words": self.historical_words,
+            "modern.words": self.modern_words,
+            "shared.words": self.shared_words,
+        }
+        for name, words in word_lists.items():
+            with atomic_output(f"{alignment_dir}/{name}.txt") as fout:
+                fout.writelines(f"{word}\n" for word in words)
+
+        manifest = {
+            "version": ALIGNMENT_FORMAT_VERSION,
+            "sources": AlignedEmbeddings.fingerprint_sources(sources),
+            "arrays": {name: {"shape": list(array.shape), "dtype": str(array.dtype)}
+                       for name, array in arrays.items()},
+            "word_lists": {name: len(words) for name, words in word_lists.items()},
+        }
+        with atomic_output(f"{alignment_dir}/manifest.json") as fout:
+            json.dump(manifest, fout, indent=2)
+        self.manifest = manifest
+
+    @classmethod
+    def load(cls, alignment_dir, mmap_mode='r'):
+        """
+        Opening the aligned embeddings saved by save()
+        :param alignment_dir: directory the alignment was saved to
+        :param mmap_mode: memory mapping mode for the arrays (default = 'r', read-only memory mapping)
+        :return: aligned embeddings
+        """
+
+        def load_words(name):
+            with open(f"{alignment_dir}/{name}.txt") as fin:
+                return fin.read().split("\n")[:-1]
+
+        def load_array(name):
+            return np.load(f"{alignment_dir}/{name}.npy", mmap_mode=mmap_mode)
+
+        with open(f"{alignment_dir}/manifest.json") as fin:
+            manifest = json.load(fin)
+        return cls(load_words("historical.words"), load_array("historical.vectors"),
+                   load_array("historical.vectors_norm"), load_words("modern.words"),
+                   load_array("modern.projected_vectors"), load_words("shared.words"), load_array("ortho"), manifest)
+
+    @staticmethod
+    def fingerprint_sources(sources):
+        """
+        :param sources: list of file paths
+        :return: {path: [size, modification time]} for the given files
+        """
+        return {os.path.abspath(path): [os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in sources}
+
+    @staticmethod
+    def is_saved(alignment_dir, sources):
+        """
+        Checking whether a complete alignment computed from the current versions of the given files is saved
+        :param alignment_dir: directory the alignment was saved to
+        :param sources: list of paths to the files the alignment should be computed from
+        :return: True if the saved alignment can be reused
+        """
+        manifest_path = f"{alignment_dir}/manifest.json"
+        if not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path) as fin:
+            manifest = json.load(fin)
+        return manifest.get("version") == ALIGNMENT_FORMAT_VERSION and \
+            manifest.get("sources") == AlignedEmbeddings.fingerprint_sources(sources)
+
+    @classmethod
+    def load_or_align(cls, historical_model_file_path, modern_model_file_path, alignment_dir=None):
+        """
+        Opening a saved alignment if it is up to date, otherwise aligning the models (and saving the alignment)
+        :param historical_model_file_path: path to the historical (COHA) embedding model Word2Vec .bin file
+        :param modern_model_file_path: path to the modern (COCA) embedding model Word2Vec .bin file
+        :param alignment_dir: directory to save the alignment to / load it from (default = None, no saving)
+        :return: aligned embeddings
+        """
+        sources = [historical_model_file_path, modern_model_file_path]
+        if alignment_dir is not None and cls.is_saved(alignment_dir, sources):
+            print(f"Loading aligned embeddings from {alignment_dir}")
+            return cls.load(alignment_dir)
+
+        aligned_embeddings = cls.from_models(historical_model_file_path, modern_model_file_path)
+        if alignment_dir is not None:
+            print(f"Saving aligned embeddings to {alignment_dir}")
+            aligned_embeddings.save(alignment_dir, sources)
+            # Reopening the saved arrays with memory mapping, so that the in-memory copies can be released
+            aligned_embeddings = cls.load(alignment_dir)
+        return aligned_embeddings
@@ -0,0 +1,110 @@
+import argparse
+import time
+import numpy as np
+
+from utils import *
+from aligned_embeddings import AlignedEmbeddings
+from extract_neighborhood_stats import NEIGHBOR_QUERY_BLOCK_SIZE
+from neighbor_index import NeighborIndex
+from neighbor_search import *
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--historical_model", type=str, default="models/historical.w2v.bin",
+                        help="Path to the historical (COHA) Word2Vec model (default = 'models/historical.w2v.bin')")
+    parser.add_argument("--modern_model", type=str, default="models/modern.w2v.bin",
+                        help="Path to the modern (COCA) Word2Vec model (default = 'models/modern.w2v.bin')")
+    parser.add_argument("--alignment_dir", type=str, default="models/aligned",
+                        help="Directory with the saved aligned embeddings (default = 'models/aligned')")
+    parser.add_argument("--vocabulary", type=str, default="files/vocabulary.txt",
+                        help="Path to the vocabulary of nouns (default = 'files/vocabulary.txt')")
+    parser.add_argument("--num_queries", type=int, default=1000,
+                        help="Number of vocabulary words used as queries (default = 1000)")
+    parser.add_argument("--topn", type=int, default=100,
+                        help="Number of nearest neighbors retrieved per query (default = 100)")
+    parser.add_argument("--ivf_lists", type=int, nargs='+', default=None,
+                        help="Numbers of IVF clusters to benchmark (default = square root of the vocabulary size)")
+    parser.add_argument("--ivf_probes", type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help="Numbers of IVF clusters searched per query to benchmark (default = 1 2 4 8 16 32)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for sampling the queries (default = 0)")
+    return parser.parse_args()
+
+
+def run_queries(neighbor_index, query_words, topn, min_similarity):
+    """
+    Retrieving the top-n neighbors and the neighbors within the radius for every query word
+    (a historical vocabulary word, queried the same way as control words)
+    :param neighbor_index: neighbor index with the backend to benchmark
+    :param query_words: list of query words
+    :param topn: number of nearest neighbors retrieved per query
+    :param min_similarity: minimum cosine similarity of the neighbors retrieved by the range search
+    :return: top-n neighbor rows, range search neighbor rows (lists of arrays, one per query),
+    top-n search time and range search time in seconds
+    """
+    vectors = neighbor_index.vectors_norm[[neighbor_index.word_index[word] for word in query_words]]
+
+    start_time = time.time()
+    topn_rows = []
+    for block_start in range(0, len(query_words), NEIGHBOR_QUERY_BLOCK_SIZE):
+        block = slice(block_start, block_start + NEIGHBOR_QUERY_BLOCK_SIZE)
+        rows, _ = neighbor_index.search(vectors[block], topn, exclude_words=query_words[block])
+        topn_rows.extend(rows)
+    topn_time = time.time() - start_time
+
+    start_time = time.time()
+    range_rows = []
+    for block_start in range(0, len(query_words), NEIGHBOR_QUERY_BLOCK_SIZE):
+        block = slice(block_start, block_start + NEIGHBOR_QUERY_BLOCK_SIZE)
+        range_rows.extend(rows for rows, _ in
+                          neighbor_index.range_search(vectors[block], min_similarity, exclude_words=query_words[block]))
+    range_time = time.time() - start_time
+
+    return topn_rows, range_rows, topn_time, range_time
+
+
+def recall(retrieved_rows, true_rows):
+    """
+    :return: fraction of the true neighbors that were retrieved, over all queries
+    """
+    num_true = sum(len(rows) for rows in true_rows)
+    num_found = sum(len(np.intersect1d(retrieved, rows)) for retrieved, rows in zip(retrieved_rows, true_rows))
+    return num_found / num_true if num_true > 0 else 1.0
+
+
+def main(params):
+    embeddings = AlignedEmbeddings.load_or_align(params.historical_model, params.modern_model,
+                                                 alignment_dir=params.alignment_dir)
+    vocab = Utils.read_vocabulary(params.vocabulary)
+    exact_index = NeighborIndex.build(embeddings, vocab, {})
+    print(f"Neighbor index over {len(exact_index.words)} historical vocabulary words")
+
+    rng = np.random.RandomState(params.seed)
+    query_words = [exact_index.words[i] for i in
+                   rng.choice(len(exact_index.words), min(params.num_queries, len(exact_index.words)), replace=False)]
+    min_similarity = min(COSINE_RADIUS_RANGE)
+
+    true_topn_rows, true_range_rows, exact_topn_time, exact_range_time = \
+        run_queries(exact_index, query_words, params.topn, min_similarity)
+    print(f"{'backend':<30}{'build (s)':>10}{'top-n (s)':>12}{'recall':>8}{'range (s)':>12}{'recall':>8}")
+    print(f"{'exact':<30}{0:>10.2f}{exact_topn_time:>12.3f}{1:>8.4f}{exact_range_time:>12.3f}{1:>8.4f}")
+
+    for num_lists in params.ivf_lists or [None]:
+        for num_probes in params.ivf_probes:
+            backend = IVFSearch(num_lists=num_lists, num_probes=num_probes)
+            start_time = time.time()
+            # Building the index fits the backend (clusters the vectors)
+            ivf_index = NeighborIndex(exact_index.words, exact_index.vectors_norm, exact_index.growth, backend)
+            build_time = time.time() - start_time
+
+            topn_rows, range_rows, topn_time, range_time = \
+                run_queries(ivf_index, query_words, params.topn, min_similarity)
+            print(f"{str(backend):<30}{build_time:>10.2f}{topn_time:>12.3f}"
+                  f"{recall(topn_rows, true_topn_rows):>8.4f}{range_time:>12.3f}"
+                  f"{recall(range_rows, true_range_rows):>8.4f}")
+
+
+# -----------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,284 @@
+import os
+import copy
+import time
+import string
+import argparse
+import tempfile
+import tracemalloc
+import types
+import numpy as np
+
+from utils import *
+from extract_word_stats import WordStatsExtractor
+from extract_neighborhood_stats import NeighborhoodStatsExtractor
+from aligned_embeddings import AlignedEmbeddings
+from output_files import atomic_output
+from projection import smart_procrustes_align_gensim, procrustes_align_keyed_vectors
+
+# Fraction of the vocabulary words that are (nearly) absent from the historical corpus
+NEOLOGISM_FRACTION = 0.02
+# Number of embedding clusters per word, so that the words have neighbors within the cosine radii
+WORDS_PER_CLUSTER = 50
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Multipliers of the vocabulary and corpus sizes to benchmark (default = 1 2 4 8)")
+    parser.add_argument("--vocabulary_size", type=int, default=5000,
+                        help="Number of vocabulary words at scale 1 (default = 5000)")
+    parser.add_argument("--files_per_dir", type=int, default=4,
+                        help="Number of files in each decade / genre directory at scale 1 (default = 4)")
+    parser.add_argument("--tokens_per_file", type=int, default=5000,
+                        help="Number of tokens in each corpus file (default = 5000)")
+    parser.add_argument("--dimension", type=int, default=100,
+                        help="Dimensionality of the synthetic embeddings (default = 100)")
+    parser.add_argument("--no_memory", action='store_true',
+                        help="Skip measuring the peak memory (which runs every benchmarked step a second time "
+                             "with memory tracing)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save the scaling table to as a tab-separated file "
+                             "(default = None, printing only)")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Scaling table saved by an earlier run, to report the time ratios against")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generating the synthetic data (default = 0)")
+    return parser.parse_args()
+
+
+def generate_vocabulary(size, rng):
+    """
+    :param size: number of words
+    :param rng: random generator
+    :return: list of distinct random lowercase words
+    """
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(list(string.ascii_lowercase), size=rng.integers(3, 11))))
+    return sorted(words)
+
+
+def generate_corpus(corpus_dir, subdirs, words, data_split, files_per_dir, tokens_per_file, rng):
+    """
+    Writing a synthetic corpus with the directory layout and file format of COHA (decade directories, with the
+    text on the third line of each file) or COCA (genre directories, with one header line per file).
+    Word frequencies follow a Zipf distribution, with a random growth trend over the decades for every word;
+    the first words of the vocabulary are neologisms, which are a thousand times rarer in the historical corpus
+    :param corpus_dir: directory to write the corpus to
+    :param subdirs: decade / genre subdirectories
+    :param words: vocabulary
+    :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+    :param files_per_dir: number of files in each decade / genre directory
+    :param tokens_per_file: number of tokens in each file
+    :param rng: random generator
+    :return: number of tokens written
+    """
+    zipf = 1 / np.arange(1, len(words) + 1) ** 1.1
+    trend = rng.normal(0, 1, len(words))
+    num_neologisms = int(len(words) * NEOLOGISM_FRACTION)
+    capitalized = [word.capitalize() for word in words]
+
+    num_tokens = 0
+    for subdir_index, subdir in enumerate(subdirs):
+        os.makedirs(f"{corpus_dir}/{subdir}", exist_ok=True)
+        time_step = subdir_index / len(subdirs) if data_split == "historical" else 1.0
+        p = zipf * np.exp(trend * time_step)
+        if data_split == "historical":
+            p[:num_neologisms] *= 0.001
+        p /= p.sum()
+
+        for file_index in range(files_per_dir):
+            tokens = rng.choice(len(words), size=tokens_per_file, p=p)
+            is_capitalized = rng.random(tokens_per_file) < 0.2
+            text = " ".join(capitalized[t] if c else words[t] for t, c in zip(tokens.tolist(), is_capitalized.tolist()))
+            with open(f"{corpus_dir}/{subdir}/{subdir}_{file_index}.txt", 'w') as fout:
+                if data_split == "historical":
+                    fout.write(f"@@{file_index}\n\n{text}\n")
+                else:
+                    fout.write(f"##{file_index}\n{text}\n")
+            num_tokens += tokens_per_file
+    return num_tokens
+
+
+def make_keyed_vectors(words, vectors):
+    """
+    :param words: words, in the order of the rows
+    :param vectors: embedding matrix
+    :return: gensim KeyedVectors with the given vectors (counts decreasing with the row index), wrapped
+    in an object with a 'wv' attribute like a Word2Vec model
+    """
+    from gensim.models.keyedvectors import KeyedVectors, Vocab
+
+    wv = KeyedVectors(vectors.shape[1])
+    wv.vectors = vectors
+    wv.index2word = list(words)
+    wv.vocab = {word: Vocab(index=i, count=len(words) - i) for i, word in enumerate(words)}
+    return types.SimpleNamespace(wv=wv)
+
+
+def generate_embeddings(words, dimension, rng):
+    """
+    Generating clustered historical embeddings and modern embeddings that are a rotated, noisy copy of them
+    :param words: vocabulary
+    :param dimension: dimensionality of the embeddings
+    :param rng: random generator
+    :return: historical and modern embedding matrices (float32)
+    """
+    centers = rng.normal(size=(max(1, len(words) // WORDS_PER_CLUSTER), dimension))
+    historical = centers[rng.integers(len(centers), size=len(words))] + 0.7 * rng.normal(size=(len(words), dimension))
+    rotation, _ = np.linalg.qr(rng.normal(size=(dimension, dimension)))
+    modern = historical.dot(rotation) + 0.3 * rng.normal(size=(len(words), dimension))
+    return historical.astype(np.float32), modern.astype(np.float32)
+
+
+def measure(function, memory=True, reset=None):
+    """
+    Timing a step, then measuring its peak memory by running it again with memory tracing
+    (NumPy arrays are traced as well)
+    :param function: step to run, without arguments
+    :param memory: whether to measure the peak memory (default = True)
+    :param reset: function restoring the state the step starts from, called before each run of the step
+    outside of the measurements (default = None, for steps that do not change any state)
+    :return: result of the step, time in seconds and peak traced memory in MB (None if not measured)
+    """
+    if reset is not None:
+        reset()
+    start_time = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start_time
+
+    peak_mb = None
+    if memory:
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        function()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result, elapsed, peak_mb
+
+
+def run_scale(work_dir, scale, params):
+    """
+    Generating the synthetic data of one scale and benchmarking every step of the analysis on it
+    :param work_dir: directory for the synthetic corpus, models and outputs
+    :param scale: multiplier of the vocabulary and corpus sizes
+    :param params: command line arguments
+    :return: list of table rows (step, time in seconds, peak memory in MB) for this scale,
+    vocabulary size and corpus size in tokens
+    """
+    rng = np.random.default_rng(params.seed)
+    memory = not params.no_memory
+    scale_dir = f"{work_dir}/scale{scale}"
+    os.makedirs(scale_dir)
+
+    words = generate_vocabulary(params.vocabulary_size * scale, rng)
+    vocab_path = f"{scale_dir}/vocabulary.txt"
+    with open(vocab_path, 'w') as fout:
+        fout.write("".join(f"{word}\n" for word in words))
+    vocab = Utils.read_vocabulary(vocab_path)
+
+    ws = WordStatsExtractor(f"{scale_dir}/historical", f"{scale_dir}/modern")
+    print(f"Scale {scale}: generating a corpus for {len(words)} words...")
+    num_tokens = 0
+    for data_split in ["historical", "modern"]:
+        data_dir, subdirs = ws.get_data_subdirs(data_split)
+        num_tokens += generate_corpus(data_dir, subdirs, words, data_split, params.files_per_dir * scale,
+                                      params.tokens_per_file, rng)
+
+    rows = []
+    # Counting adds to the capitalization counts of the previous split, so both runs start from a copy of them
+    for data_split in ["historical", "modern"]:
+        capitalization_counts = copy.deepcopy(ws.capitalization_counter_dict)
+        _, elapsed, peak_mb = measure(
+            lambda: ws.extract_frequencies(vocab, data_split=data_split), memory,
+            reset=lambda: setattr(ws, "capitalization_counter_dict", copy.deepcopy(capitalization_counts)))
+        rows.append((f"extract_frequencies.{data_split}", elapsed, peak_mb))
+
+    neologism_list = ws.extract_neologisms(f"{scale_dir}/neologisms.txt")
+    frequency_growth_dict, elapsed, peak_mb = \
+        measure(lambda: ws.extract_frequency_growth(vocab, f"{scale_dir}/freq_growth.tsv"), memory)
+    rows.append(("extract_frequency_growth", elapsed, peak_mb))
+
+    word_pair_dict, elapsed, peak_mb = measure(lambda: ws.pair_neologisms_with_controls(
+        frequency_growth_dict, neologism_list, f"{scale_dir}/pairs.tsv", stability_constraint=False,
+        seed=params.seed), memory)
+    rows.append(("pair_neologisms_with_controls", elapsed, peak_mb))
+
+    # The embeddings are rotated on copies, so that every run aligns the same vectors
+    historical_vectors, modern_vectors = generate_embeddings(words, params.dimension, rng)
+    historical_model = make_keyed_vectors(words, historical_vectors)
+    modern_model = make_keyed_vectors(words, modern_vectors)
+    _, elapsed, peak_mb = measure(lambda: smart_procrustes_align_gensim(
+        historical_model, types.SimpleNamespace(wv=copy.copy(modern_model.wv))), memory)
+    rows.append(("smart_procrustes_align_gensim", elapsed, peak_mb))
+    (modern_projected_wv, ortho), elapsed, peak_mb = measure(lambda: procrustes_align_keyed_vectors(
+        historical_model.wv, copy.copy(modern_model.wv)), memory)
+    rows.append(("procrustes_align_keyed_vectors", elapsed, peak_mb))
+
+    # The aligned embeddings are saved next to placeholder model files, from which the extractor loads them
+    model_paths = [f"{scale_dir}/historical.w2v.bin", f"{scale_dir}/modern.w2v.bin"]
+    for path in model_paths:
+        with open(path, 'w') as fout:
+            fout.write("synthetic\n")
+    historical_vectors_norm = \
+        (historical_vectors / np.sqrt((historical_vectors ** 2).sum(-1))[..., np.newaxis]).astype(np.float32)
+    AlignedEmbeddings(words, historical_vectors, historical_vectors_norm, words, modern_projected_wv.vectors,
+                      words, ortho).save(f"{scale_dir}/aligned", model_paths)
+    ns = NeighborhoodStatsExtractor(model_paths[0], model_paths[1], vocab, frequency_growth_dict,
+                                    alignment_dir=f"{scale_dir}/aligned")
+
+    density_filename = f"{scale_dir}/density.tsv"
+    growth_filename = f"{scale_dir}/growth.tsv"
+    stats, elapsed, peak_mb = measure(lambda: ns.compute_neighborhood_stats_cosine(word_pair_dict, density_filename,
+                                                                                   growth_filename), memory)
+    rows.append(("compute_neighborhood_stats_cosine", elapsed, peak_mb))
+
+    _, elapsed, peak_mb = measure(lambda: Utils.reformat_feats_for_glm(stats.words, stats.is_neologism, stats.density,
+                                                                       stats.growth, stats.radius_range,
+                                                                       f"{scale_dir}/glm.csv"), memory)
+    rows.append(("reformat_feats_for_glm", elapsed, peak_mb))
+    return rows, len(words), num_tokens
+
+
+def read_table(infile):
+    """
+    :param infile: path to a scaling table saved by an earlier run
+    :return: (scale, step) - time in seconds dictionary
+    """
+    times = {}
+    with open(infile) as fin:
+        next(fin)
+        for line in fin:
+            scale, _, _, step, elapsed, _ = line.rstrip("\n").split("\t")
+            times[(int(scale), step)] = float(elapsed)
+    return times
+
+
+def main(params):
+    baseline = read_table(params.baseline) if params.baseline is not None else {}
+
+    table = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in params.scales:
+            rows, vocabulary_size, num_tokens = run_scale(work_dir, scale, params)
+            table += [(scale, vocabulary_size, num_tokens, step, elapsed, peak_mb) for step, elapsed, peak_mb in rows]
+
+    print(f"{'scale':>6}{'vocabulary':>12}{'tokens':>12}  {'step':<36}{'time (s)':>10}{'memory (MB)':>13}"
+          f"{'vs baseline':>13}")
+    for scale, vocabulary_size, num_tokens, step, elapsed, peak_mb in table:
+        memory = f"{peak_mb:.1f}" if peak_mb is not None else "-"
+        ratio = f"{elapsed / baseline[(scale, step)]:.2f}x" if (scale, step) in baseline else "-"
+        print(f"{scale:>6}{vocabulary_size:>12}{num_tokens:>12}  {step:<36}{elapsed:>10.3f}{memory:>13}{ratio:>13}")
+
+    if params.output is not None:
+        with atomic_output(params.output) as fout:
+            fout.write("Scale\tVocabulary\tTokens\tStep\tTime\tMemory\n")
+            for row in table:
+                fout.write("\t".join("NaN" if value is None else str(value) for value in row) + "\n")
+        print(f"Scaling table saved to {params.output}")
+
+
+# -----------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,135 @@
+import math
+from collections import defaultdict
+
+from utils import *
+
+
+class ControlCandidateIndex:
+    """
+    Index over candidate control words, used to pair neologisms with controls without scanning the whole
+    candidate list for every neologism. Candidates are bucketed by word length and sorted by historical frequency
+    within each bucket, so that the candidates satisfying the frequency ratio constraint form a contiguous range
+    that is found by binary search. A min segment tree over candidate positions in each bucket then returns
+    the earliest (in the original candidate order) candidate of the range that has not been taken yet
+    """
+
+    def __init__(self, candidate_controls, frequencies_historical):
+        """
+        Building the index
+        :param candidate_controls: list of candidate control words, in the order of pairing preference
+        :param frequencies_historical: word - historical frequency dictionary
+        """
+        self.candidate_controls = candidate_controls
+
+        bucket_entries = defaultdict(list)
+        for position, control in enumerate(candidate_controls):
+            control_freq = frequencies_historical.get(control, 0)
+            # Words that do not occur in the historical data can never be paired
+            if control_freq == 0:
+                continue
+            bucket_entries[len(control)].append((control_freq, position))
+
+        self.buckets = {}   # {word length : (sorted frequencies, min segment tree over candidate positions)}
+        for control_len, entries in bucket_entries.items():
+            entries.sort()
+            self.buckets[control_len] = ([freq for freq, _ in entries],
+                                         _MinSegmentTree([position for _, position in entries]))
+
+    def pop_control(self, neologism_len, neologism_freq):
+        """
+        Finding the earliest candidate control word within the length and frequency ratio constraints
+        and removing it from the index
+        :param neologism_len: length of the neologism
+        :param neologism_freq: modern frequency of the neologism
+        :return: matched control word or None if there is no such candidate left
+        """
+        best = None     # (candidate position, segment tree, leaf index)
+        for control_len in range(neologism_len - MAX_CONTROL_LENGTH_DIFFERENCE + 1,
+                                 neologism_len + MAX_CONTROL_LENGTH_DIFFERENCE):
+            if control_len not in self.buckets:
+                continue
+            frequencies, tree = self.buckets[control_len]
+
+            # The ratio neologism_freq / control_freq does not increase with control_freq, so the candidates
+            # with the ratio strictly inside the allowed range form a contiguous range of sorted frequencies
+            lo = _first_true(frequencies, lambda control_freq:
+                             neologism_freq / control_freq < MAX_CONTROL_FREQUENCY_RATIO)
+            hi = _first_true(frequencies, lambda control_freq:
+                             neologism_freq / control_freq <= MIN_CONTROL_FREQUENCY_RATIO)
+            if lo >= hi:
+                continue
+
+            position, leaf = tree.query(lo, hi)
+            if position != math.inf and (best is None or position < best[0]):
+                best = (position, tree, leaf)
+
+        if best is None:
+            return None
+        position, tree, leaf = best
+        tree.remove(leaf)
+        return self.candidate_controls[position]
+
+
+def _first_true(values, predicate):
+    """
+    Binary search for the first element of the list for which a monotone (False, ..., False, True, ..., True)
+    predicate holds
+    :return: index of the first such element, or len(values) if there is none
+    """
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(values[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class _MinSegmentTree:
+    """
+    Segment tree over a list of values supporting range minimum queries and removal of elements
+    """
+
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        self.tree = [math.inf] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def query(self, lo, hi):
+        """
+        :return: minimum value in the range [lo, hi) and its index (math.inf and None if all values were removed)
+        """
+        best_value, best_node = math.inf, None
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                if self.tree[lo] < best_value:
+                    best_value, best_node = self.tree[lo], lo
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if self.tree[hi] < best_value:
+                    best_value, best_node = self.tree[hi], hi
+            lo //= 2
+            hi //= 2
+
+        if best_node is None:
+            return math.inf, None
+        # Descending from the covering node to the leaf holding the minimum
+        while best_node < self.size:
+            best_node = 2 * best_node if self.tree[2 * best_node] == best_value else 2 * best_node + 1
+        return best_value, best_node - self.size
+
+    def remove(self, idx):
+        node = idx + self.size
+        self.tree[node] = math.inf
+        node //= 2
+        while node >= 1:
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
@@ -1,27 +1,171 @@
-from sklearn.manifold import TSNE
-from gensim.models import Word2Vec
-from scipy.spatial.distance import cdist
+import os
+import json
+import multiprocessing
 
 from utils import *
-from projection import *
+from aligned_embeddings import AlignedEmbeddings
+from neighbor_index import NeighborIndex
+from neighbor_search import euclidean_neighborhood_profiles, EUCLIDEAN_MEMORY_BUDGET
+from profiling import profiler
+from output_files import atomic_output, ProgressReporter, OUTPUT_BUFFER_SIZE
+
+# Number of query words scored against the historical embeddings with one matrix product
+NEIGHBOR_QUERY_BLOCK_SIZE = 64
+
+# Extractor used by the forked worker processes computing neighborhood statistics, inherited instead of being pickled
+_stats_state = {}
+
+
+def _compute_pair_block_stats_cosine_task(word_pairs):
+    return _stats_state["ns"].compute_pair_block_stats_cosine(word_pairs)
 
 
 class NeighborhoodStatsExtractor:
-    def __init__(self, historical_model_file_path, modern_model_file_path, vocabulary, spearmanr_dict):
+    def __init__(self, historical_model_file_path, modern_model_file_path, vocabulary, spearmanr_dict,
+                 alignment_dir=None, max_neighbors=None, neighbor_search=None, memory_budget=EUCLIDEAN_MEMORY_BUDGET):
         """
         Loading and aligning the embedding models
         :param historical_model_file_path: path to the historical (COHA) embedding model Word2Vec .bin file
         :param modern_model_file_path: path to the modern (COCA) embedding model Word2Vec .bin file
         :param vocabulary: vocabulary of nouns for analysis
         :param spearmanr_dict: word - frequency growth rate dictionary
+        :param alignment_dir: directory to save the aligned embeddings to, or to load them from if they were
+        already computed from the same models (default = None, aligning the models in memory)
+        :param max_neighbors: if set, neighborhood statistics are computed from at most this many nearest neighbors
+        of each word, as in the original analysis, which capped them at 5000 (default = None, all neighbors
+        within the largest radius are used)
+        :param neighbor_search: neighbor search backend from neighbor_search.py
+        (default = None, exact brute force search)
+        :param memory_budget: approximate memory used for the distance blocks of the Euclidean neighborhood
+        computation, in bytes (default = EUCLIDEAN_MEMORY_BUDGET)
         """
         self._word_pairs = {}
         self.vocabulary = vocabulary
         self.spearmanr_dict = spearmanr_dict
+        self.max_neighbors = max_neighbors
+        self.memory_budget = memory_budget
+
+        self.embeddings = AlignedEmbeddings.load_or_align(historical_model_file_path, modern_model_file_path,
+                                                          alignment_dir=alignment_dir)
+        # Neighbors are only ever searched for among the vocabulary words
+        self.neighbor_index = NeighborIndex.load_or_build(
+            self.embeddings, vocabulary, spearmanr_dict,
+            index_dir=f"{alignment_dir}/neighbor_index" if alignment_dir is not None else None,
+            backend=neighbor_search)
+
+    def get_vector(self, word, use_modern_projected):
+        """
+        :param word: word to look up
+        :param use_modern_projected: toggles between projected modern embeddings and historical embeddings
+        :return: embedding of the word
+        """
+        if use_modern_projected:
+            return self.embeddings.modern_projected_vectors[self.embeddings.modern_index[word]]
+        return self.embeddings.historical_vectors[self.embeddings.historical_index[word]]
 
-        self.model_historical = Word2Vec.load(historical_model_file_path)
-        self.model_modern = Word2Vec.load(modern_model_file_path)
-        self.model_modern_projected = smart_procrustes_align_gensim(self.model_historical, self.model_modern)
+    def fetch_neighbors_cosine_batch(self, words, num_neighbors, use_modern_projected,
+                                     block_size=NEIGHBOR_QUERY_BLOCK_SIZE):
+        """
+        Retrieving sets of nearest neighbors for a list of words using cosine similarity metric,
+        among historical vocabulary words other than the words themselves.
+        Queries are scored in blocks of block_size words, one matrix product per block
+        :param words: words to center the neighborhoods around
+        :param num_neighbors: number of nearest neighbors to retrieve for each word
+        :param use_modern_projected: toggles between projected modern embeddings (used if the words are neologisms)
+        and historical embeddings (used if the words are control words)
+        :param block_size: number of words scored together (default = NEIGHBOR_QUERY_BLOCK_SIZE)
+        :return: list of neighbor lists of (word, cosine similarity) tuples, aligned with the words
+        (None for the words missing from the embeddings)
+        """
+        results = []
+        with profiler.loop("fetch_neighbors_cosine") as counter:
+            for neighbors in self.query_neighbor_index(words, num_neighbors, use_modern_projected, block_size):
+                if neighbors is None:
+                    results.append(None)
+                    continue
+                neighbor_rows, neighbor_similarities = neighbors
+                results.append([(self.neighbor_index.words[row], similarity)
+                                for row, similarity in zip(neighbor_rows.tolist(), neighbor_similarities.tolist())])
+            counter.add(queries=len(words))
+        return results
+
+    def iter_query_blocks(self, words, use_modern_projected, block_size=NEIGHBOR_QUERY_BLOCK_SIZE):
+        """
+        Splitting the words found in the embeddings into blocks of block_size words
+        :param words: words to center the neighborhoods around
+        :param use_modern_projected: toggles between projected modern embeddings (used if the words are neologisms)
+        and historical embeddings (used if the words are control words)
+        :param block_size: number of words per block (default = NEIGHBOR_QUERY_BLOCK_SIZE)
+        :return: iterator over (positions in the word list, words, embeddings) of each block
+        """
+        if use_modern_projected:
+            index = self.embeddings.modern_index
+            vectors = self.embeddings.modern_projected_vectors
+        else:
+            index = self.embeddings.historical_index
+            vectors = self.embeddings.historical_vectors_norm
+        found = [i for i, word in enumerate(words) if word in index]
+
+        for block_start in range(0, len(found), block_size):
+            block = found[block_start:block_start + block_size]
+            block_words = [words[i] for i in block]
+            yield block, block_words, vectors[[index[word] for word in block_words]]
+
+    def query_neighbor_index(self, words, num_neighbors, use_modern_projected, block_size=NEIGHBOR_QUERY_BLOCK_SIZE):
+        """
+        Querying the vocabulary neighbor index for the nearest neighbors of a list of words,
+        in blocks of block_size words
+        :param words: words to center the neighborhoods around
+        :param num_neighbors: number of nearest neighbors to retrieve for each word
+        :param use_modern_projected: toggles between projected modern embeddings (used if the words are neologisms)
+        and historical embeddings (used if the words are control words)
+        :param block_size: number of words scored together (default = NEIGHBOR_QUERY_BLOCK_SIZE)
+        :return: list of (neighbor index rows, cosine similarities) array pairs sorted by decreasing similarity,
+        aligned with the words (None for the words missing from the embeddings)
+        """
+        results = [None] * len(words)
+        for block, block_words, vectors in self.iter_query_blocks(words, use_modern_projected, block_size):
+            neighbor_rows, neighbor_similarities = \
+                self.neighbor_index.search(vectors, num_neighbors, exclude_words=block_words)
+            for i, rows, similarities in zip(block, neighbor_rows, neighbor_similarities):
+                if len(rows) < num_neighbors:
+                    print(f"Could only find {len(rows)} neighbors out of {num_neighbors}")
+                results[i] = (rows, similarities)
+        return results
+
+    def range_query_neighbor_index(self, words, min_similarity, use_modern_projected,
+                                   block_size=NEIGHBOR_QUERY_BLOCK_SIZE):
+        """
+        Querying the vocabulary neighbor index for all neighbors of a list of words within a cosine similarity radius,
+        in blocks of block_size words
+        :param words: words to center the neighborhoods around
+        :param min_similarity: minimum cosine similarity of the neighbors
+        :param use_modern_projected: toggles between projected modern embeddings (used if the words are neologisms)
+        and historical embeddings (used if the words are control words)
+        :param block_size: number of words scored together (default = NEIGHBOR_QUERY_BLOCK_SIZE)
+        :return: list of (neighbor index rows, cosine similarities) array pairs sorted by decreasing similarity,
+        aligned with the words (None for the words missing from the embeddings)
+        """
+        results = [None] * len(words)
+        for block, block_words, vectors in self.iter_query_blocks(words, use_modern_projected, block_size):
+            neighbors = self.neighbor_index.range_search(vectors, min_similarity, exclude_words=block_words)
+            for i, word_neighbors in zip(block, neighbors):
+                results[i] = word_neighbors
+        return results
+
+    def query_neighborhoods(self, words, use_modern_projected):
+        """
+        Retrieving the neighbors of a list of words that neighborhood statistics are computed from:
+        all neighbors within the largest radius of COSINE_RADIUS_RANGE, or only the max_neighbors nearest ones
+        :param words: words to center the neighborhoods around
+        :param use_modern_projected: toggles between projected modern embeddings (used if the words are neologisms)
+        and historical embeddings (used if the words are control words)
+        :return: list of (neighbor index rows, cosine similarities) array pairs sorted by decreasing similarity,
+        aligned with the words (None for the words missing from the embeddings)
+        """
+        if self.max_neighbors is not None:
+            return self.query_neighbor_index(words, self.max_neighbors, use_modern_projected)
+        return self.range_query_neighbor_index(words, min(COSINE_RADIUS_RANGE), use_modern_projected)
 
     def fetch_neighbors_cosine(self, word, num_neighbors, use_modern_projected):
         """
@@ -33,186 +177,176 @@ class NeighborhoodStatsExtractor:
         and historical embeddings (used if 'word' is a control word)
         :return:
         """
-        if use_modern_projected:
-            neighbors = self.model_historical.similar_by_vector(self.model_modern_projected.wv[word],
-                                                                topn=max(5000, num_neighbors * 20))
-        else:
-            neighbors = self.model_historical.most_similar(word, topn=max(5000, num_neighbors * 20))
-
-        neighbor_list = []
-        for neighbor_word, neighbor_distance in neighbors:
-            if neighbor_word in self.vocabulary and neighbor_word != word:
-                neighbor_list.append((neighbor_word, neighbor_distance))
-            if len(neighbor_list) == num_neighbors:
-                return neighbor_list
-        print(f"Could only find {len(neighbor_list)} neighbors out of {num_neighbors}")
+        neighbor_list = self.fetch_neighbors_cosine_batch([word], num_neighbors, use_modern_projected)[0]
+        if neighbor_list is None:
+            raise KeyError(word)
         return neighbor_list
 
-    def compute_neighborhood_stats_cosine(self, word_pair_dict, outfile_density, outfile_growth):
+    def compute_pair_block_stats_cosine(self, word_pairs):
         """
-        Computing density and average frequency growth rate for a range of neighborhoods
-        of each neologism and control word
-        :param word_pair_dict: neologism - control pair dictionary
-        :param outfile_density: file path to output neighborhood densities for each word
-        :param outfile_growth: file path to output neighborhood frequency growth rate for each word
-        :return:
+        Computing density and average frequency growth rate for a range of neighborhoods of the neologisms
+        and control words of a block of pairs, retrieving the neighbors of the whole block at once
+        :param word_pairs: list of (neologism, control) pairs
+        :return: list of (neologism density, neologism growth, control density, control growth) arrays
+        for each pair (None for the pairs with a word missing from the embeddings)
         """
-        mean_neologism_density = [0] * len(COSINE_RADIUS_RANGE)
-        mean_control_density = [0] * len(COSINE_RADIUS_RANGE)
-        mean_neologism_growth = [0] * len(COSINE_RADIUS_RANGE)
-        mean_control_growth = [0] * len(COSINE_RADIUS_RANGE)
-
-        # Counting non-empty neighborhoods for proper averaging of frequency growth
-        neologism_nonempty_neighborhood_counts = [0] * len(COSINE_RADIUS_RANGE)
-        control_nonempty_neighborhood_counts = [0] * len(COSINE_RADIUS_RANGE)
-
-        d_fout = open(outfile_density, 'w')
-        g_fout = open(outfile_growth, 'w')
-
-        for neologism, control in word_pair_dict.items():
-            neologism_density = [0] * len(COSINE_RADIUS_RANGE)
-            control_density = [0] * len(COSINE_RADIUS_RANGE)
-            neologism_growth = [0] * len(COSINE_RADIUS_RANGE)
-            control_growth = [0] * len(COSINE_RADIUS_RANGE)
-
-            try:
-                neologism_neighbors_5000 = self.fetch_neighbors_cosine(neologism, 5000, use_modern_projected=True)
-            except KeyError:
+        neologism_neighbors_block = self.query_neighborhoods([neologism for neologism, _ in word_pairs],
+                                                             use_modern_projected=True)
+        control_neighbors_block = self.query_neighborhoods([control for _, control in word_pairs],
+                                                           use_modern_projected=False)
+
+        results = []
+        for (neologism, control), neologism_neighbors, control_neighbors in \
+                zip(word_pairs, neologism_neighbors_block, control_neighbors_block):
+            if neologism_neighbors is None:
                 print(f"{neologism} not found in the modern embedding space vocabulary")
+                results.append(None)
                 continue
 
-            try:
-                control_neighbors_5000 = self.fetch_neighbors_cosine(control, 5000, use_modern_projected=False)
-            except KeyError:
+            if control_neighbors is None:
                 print(f"{control} not found in the historical embedding space vocabulary")
+                results.append(None)
                 continue
 
-            for i, r in enumerate(COSINE_RADIUS_RANGE):
-                neologism_neighbors = [w for w, d in neologism_neighbors_5000 if float(d) >= r]
-                control_neighbors = [w for w, d in control_neighbors_5000 if float(d) >= r]
-
-                neologism_density[i] = len(neologism_neighbors)
-                control_density[i] = len(control_neighbors)
-                mean_neologism_density[i] += 1.0 * neologism_density[i] / len(word_pair_dict)
-                mean_control_density[i] += 1.0 * control_density[i] / len(word_pair_dict)
-
-                neologism_neighbors_filtered = [w for w in neologism_neighbors if w in self.spearmanr_dict]
-                control_neighbors_filtered = [w for w in control_neighbors if w in self.spearmanr_dict]
-
-                if len(neologism_neighbors_filtered) > 0:
-                    neologism_growth[i] = np.mean([self.spearmanr_dict[w] for w in neologism_neighbors_filtered])
-                    mean_neologism_growth[i] += neologism_growth[i]
-                    neologism_nonempty_neighborhood_counts[i] += 1
-                else:
-                    neologism_growth[i] = "NaN"
-                if len(control_neighbors_filtered) > 0:
-                    control_growth[i] = np.mean([self.spearmanr_dict[w] for w in control_neighbors_filtered])
-                    mean_control_growth[i] += control_growth[i]
-                    control_nonempty_neighborhood_counts[i] += 1
-                else:
-                    control_growth[i] = "NaN"
-
-            d_fout.write("\t".join([neologism] + list(map(str, neologism_density)) +
-                                   [control] +list(map(str, control_density))))
-            d_fout.write("\n")
-            d_fout.flush()
-            g_fout.write("\t".join([neologism] + list(map(str, neologism_growth)) +
-                                   [control] +list(map(str, control_growth))))
-            g_fout.write("\n")
-            g_fout.flush()
-
-        for i, r in enumerate(COSINE_RADIUS_RANGE):
-            mean_neologism_growth[i] /= neologism_nonempty_neighborhood_counts[i]
-            mean_control_growth[i] /= control_nonempty_neighborhood_counts[i]
-
-        print("Neologism neighborhood density: " + "\t".join(["{0:.3f}".format(x) for x in mean_neologism_density]))
-        print("Control neighborhood density: ", "\t".join(["{0:.3f}".format(x) for x in mean_control_density]))
-        Utils.plot_neighborhood_stats(mean_neologism_density, mean_control_density, "cosine", "density")
-
-        print("Neologism neighborhood frequency growth: " +
-              "\t".join(["{0:.3f}".format(x) for x in mean_neologism_growth]))
-        print("Control neighborhood frequency growth: " +
-              "\t".join(["{0:.3f}".format(x) for x in mean_control_growth]))
-        Utils.plot_neighborhood_stats(mean_neologism_growth, mean_control_growth, "cosine", "growth")
+            neologism_rows, neologism_similarities = neologism_neighbors
+            control_rows, control_similarities = control_neighbors
+            # Capped neighborhoods reproduce the original analysis, so their means are taken as it took them
+            neologism_density, neologism_growth = Utils.neighborhood_profile(
+                neologism_similarities, self.neighbor_index.growth[neologism_rows], COSINE_RADIUS_RANGE,
+                exact_means=self.max_neighbors is not None)
+            control_density, control_growth = Utils.neighborhood_profile(
+                control_similarities, self.neighbor_index.growth[control_rows], COSINE_RADIUS_RANGE,
+                exact_means=self.max_neighbors is not None)
+            results.append((neologism_density, neologism_growth, control_density, control_growth))
+        return results
+
+    def compute_neighborhood_stats_cosine(self, word_pair_dict, outfile_density, outfile_growth, workers=1,
+                                          checkpoint_key=None):
+        """
+        Computing density and average frequency growth rate for a range of neighborhoods
+        of each neologism and control word
+        :param word_pair_dict: neologism - control pair dictionary
+        :param outfile_density: file path to output neighborhood densities for each word
+        :param outfile_growth: file path to output neighborhood frequency growth rate for each word
+        :param workers: number of processes computing the statistics for blocks of pairs (default = 1, serial);
+        the output is the same regardless of the number of processes
+        :param checkpoint_key: if set, progress is checkpointed after every block of pairs, and an interrupted
+        computation with the same key is resumed from its last checkpoint; the key must identify the pairs
+        and the options of the computation (default = None, no checkpointing)
+        :return: neighborhood statistics table
+        """
+        # (neologism, density, growth, control, density, growth) of every pair found in the embeddings
+        pair_stats = []
+
+        # Neighbors are retrieved for blocks of pairs at once, with one matrix product per block
+        word_pairs = list(word_pair_dict.items())
+        blocks = [word_pairs[block_start:block_start + NEIGHBOR_QUERY_BLOCK_SIZE]
+                  for block_start in range(0, len(word_pairs), NEIGHBOR_QUERY_BLOCK_SIZE)]
+
+        checkpoint = None
+        num_done_blocks = 0
+        if checkpoint_key is not None:
+            # Statistics are written to partial files, which replace the output files once all pairs are done
+            checkpoint = StatsCheckpoint(outfile_density, outfile_growth, checkpoint_key)
+            num_done_blocks, pair_stats = checkpoint.restore()
+            if num_done_blocks > 0:
+                print(f"Resuming from checkpoint: {num_done_blocks * NEIGHBOR_QUERY_BLOCK_SIZE} pairs already done")
+        progress = ProgressReporter("Neighborhood statistics of pairs", len(word_pairs))
+        progress.update(min(num_done_blocks * NEIGHBOR_QUERY_BLOCK_SIZE, len(word_pairs)))
+        blocks = blocks[num_done_blocks:]
+
+        pool = None
+        if workers > 1 and len(blocks) > 1:
+            # Worker processes are forked, so they share the (memory-mapped) embeddings and index with the parent
+            _stats_state["ns"] = self
+            pool = multiprocessing.get_context("fork").Pool(min(workers, len(blocks)))
+            block_results = pool.imap(_compute_pair_block_stats_cosine_task, blocks)
+        else:
+            block_results = map(self.compute_pair_block_stats_cosine, blocks)
 
-        d_fout.close()
-        g_fout.close()
+        try:
+            # Results are merged in the order of the pairs, so the output does not depend on the number of workers.
+            # The loop is timed here rather than in the workers, so it includes waiting for their results
+            with profiler.loop("compute_neighborhood_stats_cosine") as counter:
+                for block_number, (block, results) in enumerate(zip(blocks, block_results), num_done_blocks + 1):
+                    block_stats = []
+                    for (neologism, control), stats in zip(block, results):
+                        if stats is None:
+                            continue
+                        neologism_density, neologism_growth, control_density, control_growth = stats
+                        block_stats.append((neologism, neologism_density, neologism_growth,
+                                            control, control_density, control_growth))
+                    pair_stats += block_stats
+                    if checkpoint is not None:
+                        checkpoint.save(block_number, block_stats)
+                    counter.add(pairs=len(block), queries=2 * len(block))
+                    progress.update(len(block))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+                _stats_state.clear()
+            if checkpoint is not None:
+                checkpoint.close()
+
+        stats = NeighborhoodStats.from_pairs("cosine", len(word_pair_dict), pair_stats)
+        if checkpoint is not None:
+            checkpoint.finish()
+        else:
+            stats.write_text(outfile_density, outfile_growth)
+        stats.summarize().report()
+        return stats
 
     # The following are supporting methods that could be used for additional experiments and visualization
     # They are not integrated in the current verstion of the code
 
-    def compute_neighborhood_stats_euclidean(self, word_pair_dict):
+    def compute_neighborhood_stats_euclidean(self, word_pair_dict, outfile_density, outfile_growth):
         """
-        Computing and plotting mean neighborhood density and frequency growth rate across
-        all neologisms and all control words, using Euclidean distance metric instead of cosine similarity
+        Computing density and average frequency growth rate for a range of neighborhoods
+        of each neologism and control word, using Euclidean distance metric instead of cosine similarity.
+        Neighborhoods are taken over the whole historical vocabulary, and all pairs are processed
+        in one streaming pass over the historical embeddings with bounded memory (see euclidean_neighborhood_profiles)
         :param word_pair_dict: neologism - control pair dictionary
-        :return:
+        :param outfile_density: file path to output neighborhood densities for each word
+        :param outfile_growth: file path to output neighborhood frequency growth rate for each word
+        :return: neighborhood statistics table
         """
-        historical_vocab = []
-        historical_vocab_vectors = np.zeros([len(self.model_historical.wv.vocab), 300], dtype=float)
-        for i, word in enumerate(self.model_historical.wv.vocab):
-            historical_vocab.append(word)
-            historical_vocab_vectors[i, :] = self.model_historical.wv[word]
-
-        neologism_vectors = np.zeros([len(word_pair_dict), 300], dtype=float)
-        control_vectors = np.zeros([len(word_pair_dict), 300], dtype=float)
-
-        for i, neologism in enumerate(word_pair_dict.keys()):
-            control = word_pair_dict[neologism]
-            neologism_vectors[i, :] = self.model_modern_projected.wv[neologism]
-            control_vectors[i, :] = self.model_historical.wv[control]
-
-        print("Computing distance matrix for neologisms")
-        neologism_dist_matrix = cdist(neologism_vectors, historical_vocab_vectors)
-        print("Computing distance matrix for control words...")
-        control_dist_matrix = cdist(control_vectors, historical_vocab_vectors)
-
-        mean_neologism_density = [0] * len(EUCLIDEAN_RADIUS_RANGE)
-        mean_control_density = [0] * len(EUCLIDEAN_RADIUS_RANGE)
-        mean_neologism_growth = [0] * len(EUCLIDEAN_RADIUS_RANGE)
-        mean_control_growth = [0] * len(EUCLIDEAN_RADIUS_RANGE)
-
-        for i, r in enumerate(EUCLIDEAN_RADIUS_RANGE):
-            # Counting non-empty neighborhoods for proper averaging of frequency growth
-            neologism_nonempty_neighborhood_count = 0
-            control_nonempty_neighborhood_count = 0
-
-            print(f"Iteration: {i}")
-            for j, neologism in enumerate(word_pair_dict.keys()):
-                control = word_pair_dict[neologism]
-                neologism_neighbors = [historical_vocab[idx] for idx in np.where(neologism_dist_matrix[j] < r)[0]]
-                control_neighbors = [historical_vocab[idx] for idx in np.where(control_dist_matrix[j] < r)[0]]
-
-                # Removing the word itself from the list of neighbors
-                if neologism in neologism_neighbors:
-                    del neologism_neighbors[neologism_neighbors.index(neologism)]
-                del control_neighbors[control_neighbors.index(control)]
-
-                mean_neologism_density[i] += 1.0 * len(neologism_neighbors) / len(word_pair_dict)
-                mean_control_density[i] += 1.0 * len(control_neighbors) / len(word_pair_dict)
-
-                neologism_neighbors_filtered = [w for w in neologism_neighbors if w in self.spearmanr_dict]
-                control_neighbors_filtered = [w for w in control_neighbors if w in self.spearmanr_dict]
-
-                if len(neologism_neighbors_filtered) > 0:
-                    mean_neologism_growth[i] += np.mean([self.spearmanr_dict[w] for w in neologism_neighbors_filtered])
-                    neologism_nonempty_neighborhood_count += 1
-                if len(control_neighbors_filtered) > 0:
-                    mean_control_growth[i] += np.mean([self.spearmanr_dict[w] for w in control_neighbors_filtered])
-                    control_nonempty_neighborhood_count += 1
-
-            if neologism_nonempty_neighborhood_count > 0:
-                mean_neologism_growth[i] /= neologism_nonempty_neighborhood_count
-            if control_nonempty_neighborhood_count > 0:
-                mean_control_growth[i] /= control_nonempty_neighborhood_count
-
-        print("Neologism neighborhood density: " + '\t'.join([str(d) for d in mean_neologism_density]))
-        print("Control neighborhood density: ", '\t'.join([str(x) for x in mean_control_density]))
-        Utils.plot_neighborhood_stats(mean_neologism_density, mean_control_density, "euclidean", "density")
-
-        print("Neologism neighborhood frequency growth: " + '\t'.join([str(x) for x in mean_neologism_growth]))
-        print("Control neighborhood frequency growth:   " + '\t'.join([str(x) for x in mean_control_growth]))
-        Utils.plot_neighborhood_stats(mean_neologism_growth, mean_control_growth, "euclidean", "growth")
+        historical_index = self.embeddings.historical_index
+        modern_index = self.embeddings.modern_index
+
+        word_pairs = []
+        for neologism, control in word_pair_dict.items():
+            if neologism not in modern_index:
+                print(f"{neologism} not found in the modern embedding space vocabulary")
+            elif control not in historical_index:
+                print(f"{control} not found in the historical embedding space vocabulary")
+            else:
+                word_pairs.append((neologism, control))
+
+        # Neologisms and controls are queried together, so that the historical embeddings are only read once
+        vectors = np.concatenate([
+            self.embeddings.modern_projected_vectors[[modern_index[neologism] for neologism, _ in word_pairs]],
+            self.embeddings.historical_vectors[[historical_index[control] for _, control in word_pairs]]])
+        # Removing the words themselves from their neighborhoods
+        exclude_rows = [historical_index.get(neologism, -1) for neologism, _ in word_pairs] + \
+                       [historical_index[control] for _, control in word_pairs]
+        historical_growth = np.array([self.spearmanr_dict.get(word, np.nan)
+                                      for word in self.embeddings.historical_words], dtype=np.float64)
+
+        print("Computing Euclidean neighborhoods...")
+        with profiler.loop("euclidean_neighborhood_profiles") as counter:
+            density, growth = euclidean_neighborhood_profiles(vectors, self.embeddings.historical_vectors,
+                                                              EUCLIDEAN_RADIUS_RANGE, historical_growth, exclude_rows,
+                                                              memory_budget=self.memory_budget)
+            counter.add(queries=len(vectors), distances=len(vectors) * len(self.embeddings.historical_vectors))
+
+        # The rows of the neologisms and of the controls are already in the order of the statistics table
+        stats = NeighborhoodStats("euclidean", len(word_pair_dict),
+                                  [neologism for neologism, _ in word_pairs] + [control for _, control in word_pairs],
+                                  np.arange(len(vectors)) < len(word_pairs), density, growth)
+        stats.write_text(outfile_density, outfile_growth)
+        stats.summarize().report()
+        return stats
 
     def get_neighborhood_tsne(self, word, radius, use_modern_projected):
         """
@@ -234,11 +368,14 @@ class NeighborhoodStatsExtractor:
 
         vectors = np.zeros([num_neighbors+1, 300], dtype=float)
         if use_modern_projected:
-            vectors[0, :] = self.model_modern_projected.wv[word]
+            vectors[0, :] = self.get_vector(word, use_modern_projected=True)
         else:
-            vectors[0, :] = self.model_historical.wv[word]
+            vectors[0, :] = self.get_vector(word, use_modern_projected=False)
         for i, neighbor_word in enumerate(neighbor_words):
-            vectors[i+1, :] = self.model_historical.wv[neighbor_word]
+            vectors[i+1, :] = self.get_vector(neighbor_word, use_modern_projected=False)
+
+        # Imported here so that sklearn is only loaded for visualization
+        from sklearn.manifold import TSNE
 
         tsne_matrix = TSNE(n_components=2).fit_transform(vectors)
         return neighbor_words, tsne_matrix
@@ -259,3 +396,356 @@ class NeighborhoodStatsExtractor:
 
             print("{0:20}\t{1:10}\t{2:10}\t{3:10}\t{4:10}".format(neologism,
                                                                   *[neighbors[i][1] for i in range(num_neighbors)]))
+
+
+def format_stats_line(neologism, neologism_statistic, control, control_statistic):
+    """
+    :param neologism: neologism
+    :param neologism_statistic: values of the neighborhood statistic of the neologism for all radii
+    :param control: control word paired with the neologism
+    :param control_statistic: values of the neighborhood statistic of the control word for all radii
+    :return: tab-separated line of the density or growth output file (NaN values written as 'NaN')
+    """
+    def format_value(x):
+        return "NaN" if np.isnan(x) else str(x)
+
+    return "\t".join([neologism] + list(map(format_value, neologism_statistic)) +
+                     [control] + list(map(format_value, control_statistic))) + "\n"
+
+
+def write_stats_lines(d_fout, g_fout, pair_stats):
+    """
+    Writing the lines of the density and growth output files of a list of pairs, with one write per file
+    :param d_fout: density output file
+    :param g_fout: growth output file
+    :param pair_stats: list of (neologism, density, growth, control, density, growth) of the pairs
+    :return:
+    """
+    density_lines = []
+    growth_lines = []
+    for neologism, neologism_density, neologism_growth, control, control_density, control_growth in pair_stats:
+        density_lines.append(format_stats_line(neologism, neologism_density, control, control_density))
+        growth_lines.append(format_stats_line(neologism, neologism_growth, control, control_growth))
+    d_fout.write("".join(density_lines))
+    g_fout.write("".join(growth_lines))
+
+
+def read_stats_file(infile, num_radii):
+    """
+    Reading a density or growth output file
+    :param infile: path to the file
+    :param num_radii: number of radii the statistic was computed for
+    :return: neologisms, their statistics (pairs x radii array), control words and their statistics
+    """
+    neologisms = []
+    controls = []
+    values = []
+    with open(infile) as fin:
+        for line in fin:
+            fields = line.rstrip("\n").split("\t")
+            neologisms.append(fields[0])
+            controls.append(fields[num_radii + 1])
+            values.append(fields[1:num_radii + 1] + fields[num_radii + 2:])
+    values = np.array(values, dtype=np.float64).reshape(len(values), 2 * num_radii)
+    return neologisms, values[:, :num_radii], controls, values[:, num_radii:]
+
+
+class NeighborhoodStats:
+    """
+    Neighborhood statistics of the paired words as a columnar table with one row per word: the word, its role
+    (neologism or control word), and its neighborhood density and mean frequency growth rate for each radius.
+    The neologisms come first and their control words follow in the same order. The table is saved to a binary
+    .npz file that the later steps read, and the density and growth text files are only written for export
+    """
+
+    def __init__(self, distance, num_pairs, words, is_neologism, density, growth):
+        """
+        :param distance: distance metric the neighborhoods are defined with ('cosine' or 'euclidean')
+        :param num_pairs: number of neologism-control pairs the statistics were computed for, including the pairs
+        with a word missing from the embeddings (which have no rows)
+        :param words: neologisms followed by their control words
+        :param is_neologism: role of each word (True for the neologisms, False for the control words)
+        :param density: neighborhood densities of each word for all radii (words x radii)
+        :param growth: mean neighborhood frequency growth rates of each word for all radii (words x radii,
+        NaN if the neighborhood is empty)
+        """
+        self.distance = distance
+        self.radius_range = COSINE_RADIUS_RANGE if distance == "cosine" else EUCLIDEAN_RADIUS_RANGE
+        self.num_pairs = num_pairs
+        self.words = np.asarray(words, dtype=str)
+        self.is_neologism = np.asarray(is_neologism, dtype=bool)
+        self.density = np.asarray(density, dtype=np.int64).reshape(len(self.words), len(self.radius_range))
+        self.growth = np.asarray(growth, dtype=np.float64).reshape(len(self.words), len(self.radius_range))
+
+    @classmethod
+    def from_pairs(cls, distance, num_pairs, pair_stats):
+        """
+        :param distance: distance metric the neighborhoods are defined with ('cosine' or 'euclidean')
+        :param num_pairs: number of neologism-control pairs the statistics were computed for
+        :param pair_stats: list of (neologism, density, growth, control, density, growth) of the pairs
+        found in the embeddings
+        :return: neighborhood statistics table
+        """
+        neologisms, neologism_density, neologism_growth, controls, control_density, control_growth = \
+            zip(*pair_stats) if pair_stats else [()] * 6
+        return cls(distance, num_pairs, neologisms + controls, [True] * len(neologisms) + [False] * len(controls),
+                   neologism_density + control_density, neologism_growth + control_growth)
+
+    @classmethod
+    def read_text(cls, distance, num_pairs, density_filename, growth_filename):
+        """
+        Reading the statistics from density and frequency growth text files
+        :param distance: distance metric the neighborhoods are defined with ('cosine' or 'euclidean')
+        :param num_pairs: number of neologism-control pairs the statistics were computed for
+        :param density_filename: path to the file storing the neighborhood densities
+        :param growth_filename: path to the file storing the neighborhood frequency growth rates
+        :return: neighborhood statistics table
+        """
+        num_radii = len(COSINE_RADIUS_RANGE if distance == "cosine" else EUCLIDEAN_RADIUS_RANGE)
+        neologisms, neologism_density, controls, control_density = read_stats_file(density_filename, num_radii)
+        _, neologism_growth, _, control_growth = read_stats_file(growth_filename, num_radii)
+        return cls(distance, num_pairs, neologisms + controls, [True] * len(neologisms) + [False] * len(controls),
+                   np.concatenate([neologism_density, control_density]),
+                   np.concatenate([neologism_growth, control_growth]))
+
+    def iter_pairs(self):
+        """
+        :return: iterator over (neologism, density, growth, control, density, growth) of the pairs in the table
+        """
+        num_rows = len(self.words) // 2
+        for i in range(num_rows):
+            j = num_rows + i
+            yield self.words[i], self.density[i], self.growth[i], self.words[j], self.density[j], self.growth[j]
+
+    def summarize(self):
+        """
+        :return: mean neighborhood statistics
+        """
+        summary = NeighborhoodStatsSummary(self.distance, self.num_pairs)
+        summary.add_stats(self)
+        return summary
+
+    def save(self, outfile):
+        """
+        Saving the table to an uncompressed .npz file, one array per column
+        :param outfile: file path to save the table to
+        :return:
+        """
+        with atomic_output(outfile, 'wb') as fout:
+            np.savez(fout, distance=self.distance, num_pairs=self.num_pairs, words=self.words,
+                     is_neologism=self.is_neologism, density=self.density, growth=self.growth)
+
+    @classmethod
+    def load(cls, infile):
+        """
+        Reading a table saved by save()
+        :param infile: path to the .npz file
+        :return: neighborhood statistics table
+        """
+        with np.load(infile) as data:
+            return cls(str(data["distance"]), int(data["num_pairs"]), data["words"], data["is_neologism"],
+                       data["density"], data["growth"])
+
+    def write_text(self, outfile_density, outfile_growth):
+        """
+        Exporting the statistics to density and frequency growth text files, one line per pair
+        :param outfile_density: file path to output neighborhood densities for each word
+        :param outfile_growth: file path to output neighborhood frequency growth rate for each word
+        :return:
+        """
+        with atomic_output(outfile_density) as d_fout, atomic_output(outfile_growth) as g_fout:
+            write_stats_lines(d_fout, g_fout, self.iter_pairs())
+
+
+class StatsCheckpoint:
+    """
+    Progress of a neighborhood statistics computation: the statistics are written to partial output files,
+    and after every block of pairs the block is written and flushed to them at once, and the number of blocks
+    done and the sizes of the partial files are recorded in a JSON checkpoint file next to the density output
+    """
+
+    def __init__(self, outfile_density, outfile_growth, key):
+        """
+        :param outfile_density: file path to output neighborhood densities for each word
+        :param outfile_growth: file path to output neighborhood frequency growth rate for each word
+        :param key: key identifying the computation, a checkpoint with a different key is discarded
+        """
+        self.outfile_density = outfile_density
+        self.outfile_growth = outfile_growth
+        self.partial_density = outfile_density + ".partial"
+        self.partial_growth = outfile_growth + ".partial"
+        self.path = outfile_density + ".checkpoint"
+        self.key = key
+        self.d_fout = None
+        self.g_fout = None
+
+    def restore(self):
+        """
+        Truncating the partial files to their size at the last checkpoint (dropping the lines written after it)
+        and reading the statistics they contain, or emptying them if there is no valid checkpoint,
+        then opening them to append the next blocks
+        :return: number of blocks of pairs done, and list of (neologism, density, growth, control, density, growth)
+        of the pairs done
+        """
+        state = None
+        if os.path.exists(self.path):
+            with open(self.path) as fin:
+                state = json.load(fin)
+            if state.get("key") != self.key or state.get("block_size") != NEIGHBOR_QUERY_BLOCK_SIZE or \
+                    not all(os.path.exists(path) and os.path.getsize(path) >= size
+                            for path, size in zip([self.partial_density, self.partial_growth], state["sizes"])):
+                state = None
+
+        if state is None:
+            num_blocks = 0
+            pair_stats = []
+            for path in [self.partial_density, self.partial_growth]:
+                open(path, 'w').close()
+        else:
+            num_blocks = state["num_blocks"]
+            for path, size in zip([self.partial_density, self.partial_growth], state["sizes"]):
+                with open(path, 'r+') as fout:
+                    fout.truncate(size)
+            pair_stats = list(NeighborhoodStats.read_text("cosine", 0, self.partial_density,
+                                                          self.partial_growth).iter_pairs())
+
+        self.d_fout = open(self.partial_density, 'a', buffering=OUTPUT_BUFFER_SIZE)
+        self.g_fout = open(self.partial_growth, 'a', buffering=OUTPUT_BUFFER_SIZE)
+        return num_blocks, pair_stats
+
+    def save(self, num_blocks, pair_stats):
+        """
+        Writing a block of pairs to the partial files and recording the progress (the checkpoint is replaced
+        atomically, so an interrupted write never corrupts it)
+        :param num_blocks: number of blocks of pairs done, including this one
+        :param pair_stats: list of (neologism, density, growth, control, density, growth) of the pairs of the block
+        :return:
+        """
+        write_stats_lines(self.d_fout, self.g_fout, pair_stats)
+        # The partial files must be on the disk before the checkpoint records their sizes
+        for fout in [self.d_fout, self.g_fout]:
+            fout.flush()
+            os.fsync(fout.fileno())
+        with atomic_output(self.path) as fout:
+            json.dump({"key": self.key, "block_size": NEIGHBOR_QUERY_BLOCK_SIZE, "num_blocks": num_blocks,
+                       "sizes": [self.d_fout.tell(), self.g_fout.tell()]}, fout)
+
+    def close(self):
+        """
+        Closing the partial files
+        :return:
+        """
+        for fout in [self.d_fout, self.g_fout]:
+            if fout is not None:
+                fout.close()
+
+    def finish(self):
+        """
+        Moving the complete partial files to the output files and removing the checkpoint
+        :return:
+        """
+        self.close()
+        os.replace(self.partial_density, self.outfile_density)
+        os.replace(self.partial_growth, self.outfile_growth)
+        os.remove(self.path)
+
+
+class NeighborhoodStatsSummary:
+    """
+    Neighborhood statistics averaged over all neologisms and all control words, for each radius
+    """
+
+    def __init__(self, distance, num_pairs):
+        """
+        :param distance: distance metric the neighborhoods are defined with ('cosine' or 'euclidean')
+        :param num_pairs: number of neologism-control pairs, by which the densities are averaged
+        """
+        self.distance = distance
+        self.radius_range = COSINE_RADIUS_RANGE if distance == "cosine" else EUCLIDEAN_RADIUS_RANGE
+        self.num_pairs = num_pairs
+        self.mean_neologism_density = np.zeros(len(self.radius_range))
+        self.mean_control_density = np.zeros(len(self.radius_range))
+        self.neologism_growth_sums = np.zeros(len(self.radius_range))
+        self.control_growth_sums = np.zeros(len(self.radius_range))
+
+        # Counting non-empty neighborhoods for proper averaging of frequency growth
+        self.neologism_nonempty_neighborhood_counts = np.zeros(len(self.radius_range), dtype=int)
+        self.control_nonempty_neighborhood_counts = np.zeros(len(self.radius_range), dtype=int)
+
+    def add(self, neologism_density, neologism_growth, control_density, control_growth):
+        """
+        Adding the statistics of one neologism-control pair
+        :param neologism_density: neighborhood densities of the neologism for all radii
+        :param neologism_growth: mean neighborhood frequency growth rates of the neologism (NaN if empty)
+        :param control_density: neighborhood densities of the control word for all radii
+        :param control_growth: mean neighborhood frequency growth rates of the control word (NaN if empty)
+        :return:
+        """
+        self.mean_neologism_density += neologism_density / self.num_pairs
+        self.mean_control_density += control_density / self.num_pairs
+
+        neologism_nonempty = ~np.isnan(neologism_growth)
+        self.neologism_growth_sums[neologism_nonempty] += neologism_growth[neologism_nonempty]
+        self.neologism_nonempty_neighborhood_counts += neologism_nonempty
+        control_nonempty = ~np.isnan(control_growth)
+        self.control_growth_sums[control_nonempty] += control_growth[control_nonempty]
+        self.control_nonempty_neighborhood_counts += control_nonempty
+
+    def add_stats(self, stats):
+        """
+        Adding the statistics of all pairs of a neighborhood statistics table
+        :param stats: neighborhood statistics table
+        :return:
+        """
+        for _, neologism_density, neologism_growth, _, control_density, control_growth in stats.iter_pairs():
+            self.add(neologism_density, neologism_growth, control_density, control_growth)
+
+    def mean_growth(self):
+        """
+        :return: mean neighborhood frequency growth rates of neologisms and of control words
+        (averaged over the non-empty neighborhoods)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.neologism_growth_sums / self.neologism_nonempty_neighborhood_counts, \
+                self.control_growth_sums / self.control_nonempty_neighborhood_counts
+
+    def report(self):
+        """
+        Printing the mean neighborhood statistics
+        :return:
+        """
+        mean_neologism_growth, mean_control_growth = self.mean_growth()
+
+        print("Neologism neighborhood density: " +
+              "\t".join(["{0:.3f}".format(x) for x in self.mean_neologism_density]))
+        print("Control neighborhood density: ", "\t".join(["{0:.3f}".format(x) for x in self.mean_control_density]))
+        print("Neologism neighborhood frequency growth: " +
+              "\t".join(["{0:.3f}".format(x) for x in mean_neologism_growth]))
+        print("Control neighborhood frequency growth: " +
+              "\t".join(["{0:.3f}".format(x) for x in mean_control_growth]))
+
+    def save(self, outfile):
+        """
+        Saving the mean neighborhood statistics for each radius to a tab-separated file
+        :param outfile: file path to output the statistics
+        :return:
+        """
+        mean_neologism_growth, mean_control_growth = self.mean_growth()
+        with atomic_output(outfile) as fout:
+            fout.write("Radius\tNeologismDensity\tControlDensity\tNeologismGrowth\tControlGrowth\n")
+            for row in zip(self.radius_range, self.mean_neologism_density, self.mean_control_density,
+                           mean_neologism_growth, mean_control_growth):
+                fout.write("\t".join(map(str, row)) + "\n")
+
+    def plot(self, outfile_density, outfile_growth):
+        """
+        Saving bar charts of the mean neighborhood density and frequency growth rate to image files
+        :param outfile_density: file path to save the density chart to
+        :param outfile_growth: file path to save the frequency growth chart to
+        :return:
+        """
+        mean_neologism_growth, mean_control_growth = self.mean_growth()
+        Utils.plot_neighborhood_stats(self.mean_neologism_density, self.mean_control_density, self.distance,
+                                      "density", outfile_density)
+        Utils.plot_neighborhood_stats(mean_neologism_growth, mean_control_growth, self.distance,
+                                      "growth", outfile_growth)
@@ -1,35 +1,93 @@
 import os
 import glob
 import math
+import time
 import random
+import hashlib
+import multiprocessing
+import numpy as np
 from collections import Counter, defaultdict
-from scipy import stats
 
 from utils import *
+from frequency_table import FrequencyTable
+from control_index import ControlCandidateIndex
+from profiling import profiler
+from output_files import atomic_output
+
+
+# Version of the frequency cache format (changing it invalidates existing caches)
+FREQUENCY_CACHE_VERSION = 2
+
+# Vocabulary and counting mode shared by the worker processes (set once per worker by the pool initializer)
+_worker_vocabulary = None
+_worker_count_capitalization = False
+
+
+def _init_count_worker(vocabulary, count_capitalization):
+    global _worker_vocabulary, _worker_count_capitalization
+    _worker_vocabulary = vocabulary
+    _worker_count_capitalization = count_capitalization
+
+
+def _count_file_in_worker(filename):
+    return _count_file(filename, _worker_vocabulary, _worker_count_capitalization)
+
+
+def _count_file(filename, vocabulary, count_capitalization):
+    """
+    Counting vocabulary word occurrences in a single corpus file
+    :param filename: path to the corpus text file
+    :param vocabulary: vocabulary of nouns for analysis
+    :param count_capitalization: whether to also count occurrences of different capitalization forms
+    :return: number of tokens in the file, word counts and capitalization form counts ({word : {form: count}})
+    """
+    num_tokens = 0
+    counts = Counter()
+    capitalization_counts = defaultdict(Counter)
+    with open(filename, 'r') as fin:
+        for line in fin:
+            tokens = line.strip().split()
+            num_tokens += len(tokens)
+            for token in tokens:
+                word = token.lower()
+                if word in vocabulary:
+                    counts[word] += 1
+                    # For each word, we also count its occurrences in different capitalization forms
+                    if count_capitalization:
+                        capitalization_counts[word][token] += 1
+    return num_tokens, counts, dict(capitalization_counts)
 
 
 class WordStatsExtractor:
-    def __init__(self, coha_path, coca_path):
+    def __init__(self, coha_path, coca_path, workers=1, cache_dir=None):
         self.data_path_historical = coha_path   # path to COHA text directory (containing decade subdirs)
         self.data_path_modern = coca_path       # path to COCA text directory (containing genre subdirs)
+        self.workers = workers                  # number of processes used for counting (1 = serial)
+        self.cache_dir = cache_dir              # directory for the frequency cache (None = no caching)
 
-        self.frequency_dict_historical = {}     # {"total" : {word: frequency}, "1810s" : {word: frequency}, ...}
-        self.frequency_dict_modern = {}         # {"total" : {word: frequency}}
+        self.frequency_table_historical = FrequencyTable()  # word x ["1810s", ..., "1980s", "total"] frequencies
+        self.frequency_table_modern = FrequencyTable()      # word x [genre, ..., "total"] frequencies
         self.capitalization_counter_dict = defaultdict(lambda: Counter())  # {word : {form: count}}
 
-    def extract_frequencies(self, vocabulary, data_split):
+    @property
+    def frequency_dict_historical(self):
+        # Dictionary-style view {"total" : {word: frequency}, "1810s" : {word: frequency}, ...}
+        return self.frequency_table_historical
+
+    @property
+    def frequency_dict_modern(self):
+        # Dictionary-style view {"total" : {word: frequency}, "text_academic_rpe" : {word: frequency}, ...}
+        return self.frequency_table_modern
+
+    def get_data_subdirs(self, data_split):
         """
-        Collecting word frequencies for the specified split ('historical' or 'modern')
-        :param vocabulary: vocabulary of nouns for analysis
+        Listing the corpus directory and its subdirectories for the specified split
         :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
-        :return
+        :return: path to the corpus text directory and a list of decade / genre subdirectories
         """
 
         assert data_split == "historical" or data_split == "modern"
 
-        num_tokens_total = 0
-        counts_total = Counter()
-
         if data_split == "historical":
             data_dir = self.data_path_historical
             # Historical data is COHA corpus up to 1989
@@ -43,39 +101,184 @@ class WordStatsExtractor:
             subdirs = ["text_academic_rpe", "text_fiction_awq",
                        "text_magazine_qch", "text_newspaper_lsp",
                        "text_spoken_kde"]
+        return data_dir, subdirs
+
+    def extract_frequencies(self, vocabulary, data_split, vocabulary_path=None):
+        """
+        Collecting word frequencies for the specified split ('historical' or 'modern')
+        :param vocabulary: vocabulary of nouns for analysis
+        :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+        :param vocabulary_path: path to the vocabulary file, required to use the frequency cache (default = None)
+        :return
+        """
+
+        assert data_split == "historical" or data_split == "modern"
+
+        cache_path = None
+        if self.cache_dir is not None and vocabulary_path is not None:
+            cache_path = self.get_frequency_cache_path(data_split, vocabulary_path)
+            if os.path.exists(cache_path):
+                print(f"Loading {data_split} frequencies from cache {cache_path}")
+                self.load_frequency_cache(data_split, cache_path)
+                return
+
+        num_tokens_total = 0
+        counts_total = Counter()
+        counts_dict = {}
+        num_tokens_dict = {}
+
+        data_dir, subdirs = self.get_data_subdirs(data_split)
+
+        pool = None
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers, initializer=_init_count_worker,
+                                        initargs=(vocabulary, data_split == "modern"))
 
+        try:
+            for subdir in subdirs:
+                current_dir = f"{data_dir}/{subdir}/"
+                if not os.path.exists(current_dir):
+                    print(f"Missing subdirectory: {subdir}")
+                    continue
+
+                print(f"Processing {current_dir}")
+                num_tokens_subdir = 0
+                counts_in_subdir = Counter()
+
+                # Files are counted independently and merged in the original file order,
+                # so that the merged counters are identical to the serial ones (including key order)
+                filenames = glob.glob(current_dir + "*.txt")
+                with profiler.loop(f"extract_frequencies.{data_split}") as counter:
+                    if pool is None:
+                        file_counts = (_count_file(filename, vocabulary, data_split == "modern")
+                                       for filename in filenames)
+                    else:
+                        file_counts = pool.imap(_count_file_in_worker, filenames,
+                                                chunksize=max(1, len(filenames) // (4 * self.workers)))
+
+                    for num_tokens_file, counts_in_file, capitalization_counts in file_counts:
+                        num_tokens_subdir += num_tokens_file
+                        counts_in_subdir.update(counts_in_file)
+                        for word, form_counts in capitalization_counts.items():
+                            self.capitalization_counter_dict[word].update(form_counts)
+                    counter.add(files=len(filenames), tokens=num_tokens_subdir)
+
+                counts_dict[subdir] = counts_in_subdir
+                num_tokens_dict[subdir] = num_tokens_subdir
+                num_tokens_total += num_tokens_subdir
+                counts_total += counts_in_subdir
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        counts_dict["total"] = counts_total
+        num_tokens_dict["total"] = num_tokens_total
+        # Rows are ordered by first occurrence in the corpus, same as the keys of the total counter
+        frequency_table = FrequencyTable.from_counts(counts_dict, num_tokens_dict, list(counts_total))
+        if data_split == "historical":
+            self.frequency_table_historical = frequency_table
+        else:
+            self.frequency_table_modern = frequency_table
+
+        if cache_path is not None:
+            self.save_frequency_cache(data_split, cache_path)
+
+    def get_frequency_cache_path(self, data_split, vocabulary_path):
+        """
+        Computing the frequency cache file path for the specified split. The file name contains a fingerprint
+        of the corpus files and of the vocabulary file, so that changing any of the inputs automatically
+        invalidates the cache
+        :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+        :param vocabulary_path: path to the vocabulary file
+        :return: path to the cache file
+        """
+
+        fingerprint = self.get_corpus_fingerprint(data_split, vocabulary_path)
+        return f"{self.cache_dir}/frequencies.{data_split}.{fingerprint[:16]}.npz"
+
+    def get_corpus_fingerprint(self, data_split, vocabulary_path):
+        """
+        Fingerprinting the inputs of the frequency extraction for the specified split
+        :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+        :param vocabulary_path: path to the vocabulary file
+        :return: hash of the corpus files (paths, sizes and modification times) and of the vocabulary file contents
+        """
+
+        fingerprint = hashlib.sha1()
+        fingerprint.update(f"{FREQUENCY_CACHE_VERSION}\t{data_split}\n".encode())
+        with open(vocabulary_path, 'rb') as fin:
+            fingerprint.update(hashlib.sha1(fin.read()).hexdigest().encode())
+
+        data_dir, subdirs = self.get_data_subdirs(data_split)
         for subdir in subdirs:
-            current_dir = f"{data_dir}/{subdir}/"
-            if not os.path.exists(current_dir):
-                print(f"Missing subdirectory: {subdir}")
-                continue
+            for filename in sorted(glob.glob(f"{data_dir}/{subdir}/*.txt")):
+                stat = os.stat(filename)
+                fingerprint.update(f"{os.path.abspath(filename)}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
 
-            print(f"Processing {current_dir}")
-            num_tokens_subdir = 0
-            counts_in_subdir = Counter()
-
-            for filename in glob.glob(current_dir + "*.txt"):
-                with open(filename, 'r') as fin:
-                    for line in fin:
-                        tokens = line.strip().split()
-                        num_tokens_subdir += len(tokens)
-                        for token in tokens:
-                            word = token.lower()
-                            if word in vocabulary:
-                                counts_in_subdir[word] += 1
-                                # For each word, we also count its occurrences in different capitalization forms
-                                if data_split == "modern":
-                                    self.capitalization_counter_dict[word][token] += 1
+        return fingerprint.hexdigest()
 
-            if data_split == "historical":
-                self.frequency_dict_historical[subdir] = Utils.normalize(counts_in_subdir, num_tokens_subdir)
-            num_tokens_total += num_tokens_subdir
-            counts_total += counts_in_subdir
+    def save_frequency_cache(self, data_split, cache_path):
+        """
+        Saving the frequency table (and capitalization counts for the modern split) as NumPy arrays
+        :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+        :param cache_path: path to the cache file
+        :return:
+        """
+
+        frequency_table = self.frequency_table_historical if data_split == "historical" \
+            else self.frequency_table_modern
+
+        word_index = dict(frequency_table.word_index)
+        arrays = {
+            "columns": np.array(frequency_table.columns, dtype=str),
+            "matrix": frequency_table.matrix,
+        }
+
+        if data_split == "modern":
+            form_word_indices = []
+            forms = []
+            form_counts = []
+            for word, counter in self.capitalization_counter_dict.items():
+                for form, count in counter.items():
+                    form_word_indices.append(word_index.setdefault(word, len(word_index)))
+                    forms.append(form)
+                    form_counts.append(count)
+            arrays["form_word_indices"] = np.array(form_word_indices, dtype=np.int32)
+            arrays["forms"] = np.array(forms, dtype=str)
+            arrays["form_counts"] = np.array(form_counts, dtype=np.int64)
+
+        # Capitalization forms may refer to words beyond the table rows, so these are appended to the word list
+        arrays["words"] = np.array(list(word_index), dtype=str)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Removing stale caches of the same split before writing the new one
+        for stale_path in glob.glob(f"{self.cache_dir}/frequencies.{data_split}.*.npz"):
+            os.remove(stale_path)
+        with atomic_output(cache_path, 'wb') as fout:
+            np.savez(fout, **arrays)
+
+    def load_frequency_cache(self, data_split, cache_path):
+        """
+        Loading the frequency table (and capitalization counts for the modern split) saved by save_frequency_cache
+        :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+        :param cache_path: path to the cache file
+        :return:
+        """
 
+        with np.load(cache_path) as cache:
+            words = cache["words"].tolist()
+            matrix = cache["matrix"]
+            frequency_table = FrequencyTable(words[:matrix.shape[0]], cache["columns"].tolist(), matrix)
             if data_split == "historical":
-                self.frequency_dict_historical["total"] = Utils.normalize(counts_total, num_tokens_total)
+                self.frequency_table_historical = frequency_table
             else:
-                self.frequency_dict_modern["total"] = Utils.normalize(counts_total, num_tokens_total)
+                self.frequency_table_modern = frequency_table
+
+            if data_split == "modern":
+                for idx, form, count in zip(cache["form_word_indices"].tolist(), cache["forms"].tolist(),
+                                            cache["form_counts"].tolist()):
+                    self.capitalization_counter_dict[words[idx]][form] += count
 
     def extract_neologisms(self, outfile):
         """
@@ -100,40 +303,120 @@ class WordStatsExtractor:
 
         # We filter out words shorter than MIN_WORD_LEN characters, and only leave the first 1000
         neologism_list = [n[0] for n in neologism_counter.most_common() if len(n[0]) >= MIN_WORD_LEN][:1000]
-        with open(outfile, 'w') as fout:
-            for word in neologism_list:
-                fout.write(f"{word}\n")
-                fout.flush()
+        with atomic_output(outfile) as fout:
+            fout.writelines(f"{word}\n" for word in neologism_list)
 
         return neologism_list
 
-    def extract_frequency_growth(self, vocabulary, outfile):
+    @staticmethod
+    def read_neologisms(infile):
+        """
+        Reading the list of neologisms saved by extract_neologisms
+        :param infile: path to the neologism file
+        :return: list of neologisms
+        """
+        with open(infile) as fin:
+            return [line.rstrip("\n") for line in fin]
+
+    def get_frequency_series(self, vocabulary):
+        """
+        Collecting the historical frequency time series (by decade) of all vocabulary words that occur
+        in the historical data
+        :param vocabulary: vocabulary of nouns for analysis
+        :return: list of words, time steps and a word x decade frequency matrix aligned with the word list
+        """
+
+        # Decade columns of the historical frequency table, from 1810s to 1980s
+        table = self.frequency_table_historical
+        decade_columns = [column for column in table.columns if column != "total"]
+        decade_matrix = table.matrix[:, [table.column_index[column] for column in decade_columns]]
+
+        # Words that never occur in the historical data have a zero frequency series and are skipped
+        words = [word for word in vocabulary if word in table.word_index]
+        word_frequency_matrix = decade_matrix[[table.word_index[word] for word in words]]
+        nonzero = word_frequency_matrix.sum(axis=1) > 0
+        words = [word for word, keep in zip(words, nonzero) if keep]
+
+        # Time steps enumerate decades from 1810s to 1980s
+        time_steps = list(range(1, len(decade_columns) + 1))
+        return words, time_steps, word_frequency_matrix[nonzero]
+
+    def extract_frequency_growth(self, vocabulary, outfile, batched=True):
         """
         For all words in the vocabulary, compute their frequency growth rate (Spearman correlation
         between the decade time series and frequency time series by decade in the historical data)
         :param vocabulary: vocabulary of nouns for analysis
         :param outfile: file path to output words and their frequency growth rates
+        :param batched: toggles between computing all correlations at once and calling SciPy for each word
+        (default = True)
         :return: word - frequency growth rate dictionary
         """
 
-        # Time steps enumerate decades from 1810s to 1880s
-        time_steps = list(range(1, 19))
-        fout = open(outfile, 'w')
-        frequency_growth_dict = {}
+        words, time_steps, word_frequency_matrix = self.get_frequency_series(vocabulary)
+
+        with profiler.loop("extract_frequency_growth") as counter:
+            if batched:
+                correlations, pvalues = Utils.batch_spearmanr(time_steps, word_frequency_matrix)
+            else:
+                from scipy import stats
+
+                correlations = []
+                pvalues = []
+                for word_frequency_series in word_frequency_matrix:
+                    corr, pval = stats.spearmanr(time_steps, word_frequency_series)
+                    correlations.append(corr)
+                    pvalues.append(pval)
+            counter.add(words=len(words))
+
+        frequency_growth_dict = dict(zip(words, correlations))
+        with atomic_output(outfile) as fout:
+            fout.writelines(f"{word}\t{corr}\t{pval}\n" for word, corr, pval in zip(words, correlations, pvalues))
 
-        for word in vocabulary:
-            word_frequency_series = []
-            for key in sorted(self.frequency_dict_historical.keys())[:18]:
-                frequency = self.frequency_dict_historical[key].get(word, 0)
-                word_frequency_series.append(frequency)
-            if sum(word_frequency_series) > 0:
-                corr, pval = stats.spearmanr(time_steps, word_frequency_series)
-                fout.write(f"{word}\t{corr}\t{pval}\n")
-                frequency_growth_dict[word] = corr
-
-        fout.close()
         return frequency_growth_dict
 
+    @staticmethod
+    def read_frequency_growth(infile):
+        """
+        Reading the frequency growth rates saved by extract_frequency_growth
+        :param infile: path to the frequency growth file
+        :return: word - frequency growth rate dictionary (in the order of the file)
+        """
+        frequency_growth_dict = {}
+        with open(infile) as fin:
+            for line in fin:
+                word, corr, _ = line.rstrip("\n").split("\t")
+                frequency_growth_dict[word] = float(corr)
+        return frequency_growth_dict
+
+    def benchmark_frequency_growth(self, vocabulary):
+        """
+        Timing the batched and the per-word frequency growth computation and checking that they agree
+        :param vocabulary: vocabulary of nouns for analysis
+        :return: batched and per-word computation time in seconds
+        """
+
+        words, time_steps, word_frequency_matrix = self.get_frequency_series(vocabulary)
+
+        start_time = time.perf_counter()
+        batched_correlations, batched_pvalues = Utils.batch_spearmanr(time_steps, word_frequency_matrix)
+        batched_time = time.perf_counter() - start_time
+
+        from scipy import stats
+
+        start_time = time.perf_counter()
+        per_word_results = [stats.spearmanr(time_steps, word_frequency_series)
+                            for word_frequency_series in word_frequency_matrix]
+        per_word_time = time.perf_counter() - start_time
+
+        num_mismatches = sum(1 for (corr, pval), batched_corr, batched_pval in
+                             zip(per_word_results, batched_correlations, batched_pvalues)
+                             if f"{corr}\t{pval}" != f"{batched_corr}\t{batched_pval}")
+
+        print(f"Frequency growth for {len(words)} words: batched {batched_time:.3f}s, "
+              f"per-word {per_word_time:.3f}s ({per_word_time / max(batched_time, 1e-9):.1f}x speedup), "
+              f"{num_mismatches} mismatching outputs")
+        return batched_time, per_word_time
+
     def pair_neologisms_with_controls(self, frequency_growth_dict, neologism_list, outfile,
                                       stability_constraint=True, seed=None):
         """
@@ -151,9 +434,10 @@ class WordStatsExtractor:
         candidate_controls = []
         frequencies_historical = self.frequency_dict_historical['total']
         frequencies_modern = self.frequency_dict_modern['total']
+        neologism_set = set(neologism_list)
 
         for word, frequency_growth in frequency_growth_dict.items():
-            if word not in neologism_list:
+            if word not in neologism_set:
                 if not stability_constraint:
                     candidate_controls.append(word)
                 if stability_constraint and math.fabs(float(frequency_growth)) < MAX_SPEARMANS_CORRELATION:
@@ -165,33 +449,34 @@ class WordStatsExtractor:
             random.seed(seed)
             random.shuffle(candidate_controls)
 
-        for neologism in neologism_list:
-            neologism_len = len(neologism)
-            neologism_freq = frequencies_modern.get(neologism, 0)
-
-            matched_flag = False
-            for control in candidate_controls:
-                control_len = len(control)
-                control_freq = frequencies_historical.get(control, 0)
-                if control_freq == 0:
-                    continue
-                freq_ratio = neologism_freq / control_freq
-
-                # To replicate our results, one needs to restrict the frequency ratio to fall within (0.75, 1.33),
-                # rather than (0.75, 1.25) as reported in the paper
-
-                if abs(neologism_len - control_len) < 2 and 0.75 < freq_ratio < 1.33:
+        # Each neologism is paired with the first remaining candidate (in the candidate list order)
+        # of similar length and overall frequency
+        with profiler.loop("pair_neologisms_with_controls") as counter:
+            candidate_index = ControlCandidateIndex(candidate_controls, frequencies_historical)
+            for neologism in neologism_list:
+                control = candidate_index.pop_control(len(neologism), frequencies_modern.get(neologism, 0))
+                if control is None:
+                    print(f"Failed to pair with a control: {neologism}")
+                else:
                     pairs_dict[neologism] = control
-                    candidate_controls.remove(control)
-                    matched_flag = True
-                    break
-
-            if not matched_flag:
-                print(f"Failed to pair with a control: {neologism}")
+            counter.add(neologisms=len(neologism_list))
 
         print(f"Created {len(pairs_dict)} neologism-control pairs")
-        with open(outfile, 'w') as fout:
-            for neologism in pairs_dict.keys():
-                 fout.write("\t".join([neologism, pairs_dict[neologism]]) + "\n")
+        with atomic_output(outfile) as fout:
+            fout.writelines(f"{neologism}\t{control}\n" for neologism, control in pairs_dict.items())
 
         return pairs_dict
+
+    @staticmethod
+    def read_pairs(infile):
+        """
+        Reading the neologism - control word pairs saved by pair_neologisms_with_controls
+        :param infile: path to the pair file
+        :return: neologism - control word pair dictionary (in the order of the file)
+        """
+        pairs_dict = {}
+        with open(infile) as fin:
+            for line in fin:
+                neologism, control = line.rstrip("\n").split("\t")
+                pairs_dict[neologism] = control
+        return pairs_dict
@@ -0,0 +1,92 @@
+import numpy as np
+from collections.abc import Mapping
+
+
+class FrequencyTable(Mapping):
+    """
+    Word frequencies for a set of corpus slices (decades or genres and their total), stored as a dense
+    (num_words x num_columns) matrix. Rows follow the order in which the words were first encountered in the corpus.
+    The table can also be used as a read-only dictionary {column : {word: frequency}},
+    which is how the frequencies used to be stored
+    """
+
+    def __init__(self, words=(), columns=(), matrix=None):
+        self.words = list(words)                                    # row index -> word
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+        self.columns = list(columns)                                # column index -> column name
+        self.column_index = {column: j for j, column in enumerate(self.columns)}
+        if matrix is None:
+            matrix = np.zeros([len(self.words), len(self.columns)], dtype=np.float64)
+        self.matrix = matrix                                        # word x column frequency matrix
+
+    @classmethod
+    def from_counts(cls, counts_dict, num_tokens_dict, words):
+        """
+        Building the frequency table from raw counts
+        :param counts_dict: {column : {word: count}}
+        :param num_tokens_dict: {column : number of tokens}, normalization constant for each column
+        :param words: list of all words in the counts, in the order they should appear in the table
+        :return: frequency table
+        """
+
+        table = cls(words, counts_dict.keys())
+        counts = np.zeros(table.matrix.shape, dtype=np.int64)
+        for j, column_counts in enumerate(counts_dict.values()):
+            if column_counts:
+                counts[[table.word_index[word] for word in column_counts], j] = list(column_counts.values())
+        num_tokens = np.array([num_tokens_dict[column] for column in table.columns], dtype=np.float64)
+        # Same element-wise division as Utils.normalize, so the values are identical to the dictionary version.
+        # Columns without tokens (e.g. a directory of empty files) keep zero frequencies, as the empty dictionaries did
+        table.matrix = np.divide(counts, num_tokens, out=np.zeros(counts.shape, dtype=np.float64),
+                                 where=num_tokens > 0)
+        return table
+
+    def column(self, column):
+        """
+        :param column: column name (decade, genre or 'total')
+        :return: frequencies of all words in the given column, aligned with self.words
+        """
+        return self.matrix[:, self.column_index[column]]
+
+    def __getitem__(self, column):
+        return FrequencyColumnView(self, self.column_index[column])
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+
+class FrequencyColumnView(Mapping):
+    """
+    Dictionary-style view {word: frequency} of one column of a frequency table. Only words with non-zero
+    frequency are listed as keys; as with the Counter objects this view replaces, missing words have frequency 0
+    """
+
+    def __init__(self, table, column_idx):
+        self._table = table
+        self._values = table.matrix[:, column_idx]
+
+    def __getitem__(self, word):
+        idx = self._table.word_index.get(word)
+        if idx is None:
+            return 0
+        return self._values[idx]
+
+    def get(self, word, default=None):
+        idx = self._table.word_index.get(word)
+        if idx is None or self._values[idx] == 0:
+            return default
+        return self._values[idx]
+
+    def __contains__(self, word):
+        idx = self._table.word_index.get(word)
+        return idx is not None and self._values[idx] != 0
+
+    def __iter__(self):
+        words = self._table.words
+        return (words[idx] for idx in np.flatnonzero(self._values))
+
+    def __len__(self):
+        return int(np.count_nonzero(self._values))
@@ -0,0 +1,184 @@
+import numpy as np
+from scipy import special
+
+from profiling import profiler
+from output_files import atomic_output
+
+# Iteration limit and convergence criterion of the IRLS fit (the defaults of MATLAB's glmfit)
+GLM_MAX_ITERATIONS = 100
+GLM_CONVERGENCE_CRITERION = 1e-6
+
+
+class LogisticGLMFits:
+    """
+    Binomial GLMs with the logit link (logistic regressions) fitted by IRLS, all at once: each model has its own
+    design matrix and response, padded to the same number of rows, and its own mask of the rows used for the fit
+    (e.g. excluding the rows with missing values). Results are arrays with one row per model
+    """
+
+    def __init__(self, predictors, response, mask, max_iterations=GLM_MAX_ITERATIONS,
+                 convergence_criterion=GLM_CONVERGENCE_CRITERION):
+        """
+        Fitting the models
+        :param predictors: design matrices without the intercept column (models x rows x predictors)
+        :param response: binary responses (models x rows, or rows if shared by all models)
+        :param mask: rows used for each fit (models x rows, boolean)
+        :param max_iterations: maximum number of IRLS iterations (default = GLM_MAX_ITERATIONS)
+        :param convergence_criterion: relative change of the coefficients below which a fit has converged
+        (default = GLM_CONVERGENCE_CRITERION)
+        """
+        num_models, num_rows, _ = predictors.shape
+        self.mask = mask
+        self.num_observations = mask.sum(axis=1)
+        # The intercept comes first, as in the MATLAB coefficient tables
+        x = np.concatenate([np.ones((num_models, num_rows, 1)), predictors], axis=2)
+        x[~mask] = 0
+        y = np.broadcast_to(response, (num_models, num_rows)).astype(np.float64) * mask
+        self.num_coefficients = x.shape[2]
+
+        # Starting point and bounds of the linear predictor as in glmfit (the maximum likelihood estimates do not
+        # depend on the starting point, only the number of iterations does)
+        eta_bound = -np.log(np.finfo(np.float64).eps)
+        mu = (y + 0.5) / 2
+        eta = np.log(mu / (1 - mu))
+        coefficients = np.zeros((num_models, self.num_coefficients))
+        converged = np.zeros(num_models, dtype=bool)
+        self.num_iterations = np.zeros(num_models, dtype=int)
+        for _ in range(max_iterations):
+            # Working weights and response of the logit link (variance = mu (1 - mu) = d mu / d eta)
+            weights = mu * (1 - mu) * mask
+            z = eta + np.where(mask, (y - mu) / np.where(weights > 0, mu * (1 - mu), 1), 0)
+            xtw = x.transpose(0, 2, 1) * weights[:, np.newaxis, :]
+            new_coefficients = np.einsum('mij,mj->mi', np.linalg.pinv(xtw @ x), np.einsum('mij,mj->mi', xtw, z))
+
+            # Converged fits are kept as they are, the others take another step
+            new_coefficients[converged] = coefficients[converged]
+            self.num_iterations += ~converged
+            converged |= np.all(np.abs(new_coefficients - coefficients) <=
+                                convergence_criterion * np.maximum(np.sqrt(np.finfo(np.float64).eps),
+                                                                   np.abs(coefficients)), axis=1)
+            coefficients = new_coefficients
+            eta = np.clip(np.einsum('mrj,mj->mr', x, coefficients), -eta_bound, eta_bound)
+            mu = special.expit(eta)
+            if converged.all():
+                break
+        self.converged = converged
+
+        weights = mu * (1 - mu) * mask
+        covariance = np.linalg.pinv((x.transpose(0, 2, 1) * weights[:, np.newaxis, :]) @ x)
+        # Models with no more rows than coefficients cannot be fitted
+        unfitted = self.num_observations <= self.num_coefficients
+        coefficients[unfitted] = np.nan
+        self.coefficients = coefficients
+        self.fitted = mu
+        # The dispersion of the binomial distribution is fixed, so the statistics are normally distributed
+        self.standard_errors = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+        self.standard_errors[unfitted] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.z_statistics = coefficients / self.standard_errors
+        self.p_values = special.erfc(np.abs(self.z_statistics) / np.sqrt(2))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_likelihood_terms = np.where(y > 0, y * np.log(y / mu), 0) + \
+                np.where(y < 1, (1 - y) * np.log((1 - y) / (1 - mu)), 0)
+        self.deviance = 2 * (log_likelihood_terms * mask).sum(axis=1)
+
+        # R-squared as MATLAB defines it for GLMs (from the raw residuals, as for linear models)
+        sse = (((y - mu) * mask) ** 2).sum(axis=1)
+        y_mean = y.sum(axis=1) / self.num_observations
+        sst = (((y - y_mean[:, np.newaxis]) * mask) ** 2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.r_squared = 1 - sse / sst
+            self.adjusted_r_squared = 1 - (sse / (self.num_observations - self.num_coefficients)) / \
+                (sst / (self.num_observations - 1))
+        self.deviance[unfitted] = np.nan
+        self.r_squared[unfitted] = np.nan
+        self.adjusted_r_squared[unfitted] = np.nan
+
+
+class NeighborhoodGLMs:
+    """
+    Logistic GLMs predicting whether a word is a neologism from its neighborhood density and frequency growth
+    at a single radius, as in glm.m: one model per radius and per control set setting, fitted all at once.
+    Words with an undefined frequency growth at the radius (empty neighborhoods) are left out of the model.
+    On files/{density,growth}.stable.tsv, the estimates and standard errors are within about 1% of the published
+    ones (files/Supplementary.xlsx), which were fitted on slightly different statistics: the differences are the
+    same at the largest radius, where no word is left out
+    """
+
+    def __init__(self, settings, radius_range):
+        """
+        Fitting the models
+        :param settings: list of (name, is_neologism, density, growth) tuples, one per control set setting, where
+        is_neologism is a boolean array over the words and density and growth are words x radii arrays
+        :param radius_range: radii of the columns of the density and growth arrays
+        """
+        self.names = [name for name, _, _, _ in settings]
+        self.radius_range = radius_range
+        # Radii are listed from the largest neighborhoods to the smallest ones, in the order of glm.m
+        # (ascending cosine similarity thresholds, descending Euclidean distances)
+        self.radius_order = np.argsort(radius_range) if radius_range[0] > radius_range[-1] \
+            else np.argsort(radius_range)[::-1]
+
+        num_radii = len(radius_range)
+        num_rows = max(len(is_neologism) for _, is_neologism, _, _ in settings)
+        predictors = np.zeros((len(settings), num_radii, num_rows, 2))
+        response = np.zeros((len(settings), num_radii, num_rows))
+        mask = np.zeros((len(settings), num_radii, num_rows), dtype=bool)
+        for i, (_, is_neologism, density, growth) in enumerate(settings):
+            num_words = len(is_neologism)
+            predictors[i, :, :num_words, 0] = density.T
+            predictors[i, :, :num_words, 1] = np.nan_to_num(growth.T)
+            response[i, :, :num_words] = is_neologism
+            mask[i, :, :num_words] = ~np.isnan(growth.T) & ~np.isnan(density.T)
+
+        with profiler.loop("fit_logistic_glms") as counter:
+            self.fits = LogisticGLMFits(predictors.reshape(-1, num_rows, 2), response.reshape(-1, num_rows),
+                                        mask.reshape(-1, num_rows))
+            counter.add(models=len(settings) * num_radii, rows=int(mask.sum()))
+
+        if not self.fits.converged.all():
+            print(f"Warning: {np.sum(~self.fits.converged)} GLM fits did not converge "
+                  f"in {GLM_MAX_ITERATIONS} iterations")
+
+    def get_results(self, setting_index):
+        """
+        :param setting_index: index of the control set setting
+        :return: list of (radius, adjusted R-squared, coefficient table) for each radius, in the order of glm.m,
+        where the coefficient table is a list of (term, estimate, standard error, z statistic, p-value)
+        """
+        results = []
+        for radius_index in self.radius_order:
+            model = setting_index * len(self.radius_range) + radius_index
+            radius = self.radius_range[radius_index]
+            terms = ["(Intercept)", f"DensityAtRadius{radius:.3f}", f"SpearmanAtRadius{radius:.3f}"]
+            coefficient_table = list(zip(terms, self.fits.coefficients[model], self.fits.standard_errors[model],
+                                         self.fits.z_statistics[model], self.fits.p_values[model]))
+            results.append((radius, self.fits.adjusted_r_squared[model], coefficient_table))
+        return results
+
+    def report(self, setting_index):
+        """
+        :param setting_index: index of the control set setting
+        :return: text report of the fits of one setting, in the format printed by glm.m
+        """
+        lines = [f"Output for {self.names[setting_index]}\n"]
+        for radius, adjusted_r_squared, coefficient_table in self.get_results(setting_index):
+            lines.append(f"R^2 = {adjusted_r_squared:g}\n\n\n")
+            for term, estimate, standard_error, z_statistic, p_value in coefficient_table:
+                lines.append(f"{term}\t{estimate:g}\t{standard_error:g}\t{z_statistic:g}\t{p_value:g}\n")
+            lines.append("\n")
+        return "".join(lines)
+
+    def save(self, setting_index, outfile):
+        """
+        Saving the fits of one setting to a tab-separated file, one line per radius and coefficient
+        :param setting_index: index of the control set setting
+        :param outfile: file path to output the fits
+        :return:
+        """
+        with atomic_output(outfile) as fout:
+            fout.write("Radius\tAdjustedRSquared\tTerm\tEstimate\tSE\tzStat\tpValue\n")
+            for radius, adjusted_r_squared, coefficient_table in self.get_results(setting_index):
+                for row in coefficient_table:
+                    fout.write("\t".join(map(str, (radius, adjusted_r_squared) + row)) + "\n")
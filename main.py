@@ -1,9 +1,20 @@
 from extract_word_stats import WordStatsExtractor
-from extract_neighborhood_stats import NeighborhoodStatsExtractor
+from extract_neighborhood_stats import NeighborhoodStatsExtractor, NeighborhoodStats
+from aligned_embeddings import AlignedEmbeddings
+from neighbor_search import IVF_DEFAULT_PROBES, EUCLIDEAN_MEMORY_BUDGET, make_neighbor_search
+from glm import NeighborhoodGLMs
+from pipeline import Stage, Pipeline
+from profiling import profiler
+from output_files import atomic_output
+import time
 import argparse
+import multiprocessing
 
 from utils import *
 
+# File recording the state of the pipeline stages, used to skip the stages that are up to date
+PIPELINE_STATE_PATH = "files/pipeline_state.json"
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -13,77 +24,421 @@ def parse_args():
                         help="Path to the COCA text directory (containing the genre subdirectories)")
     parser.add_argument("--seed", type=int, default=None, help="Seed for randomizing control sets")
     parser.add_argument("--stable", action='store_true', help="Turn on stability constraint for the control set words")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used for counting corpus word frequencies, for computing "
+                             "neighborhood statistics and for running the control set sweep (default = 1, serial)")
+    parser.add_argument("--cache_dir", type=str, default="cache",
+                        help="Directory to cache corpus word frequencies in (default = 'cache')")
+    parser.add_argument("--no_cache", action='store_true', help="Always recount corpus word frequencies")
+    parser.add_argument("--benchmark_growth", action='store_true',
+                        help="Report the time of the batched frequency growth computation against the per-word one")
+    parser.add_argument("--sweep_seeds", type=int, nargs='+', default=None,
+                        help="Run the control set analysis for each of these seeds with both stable and relaxed "
+                             "control sets, sharing the word statistics and the aligned embeddings between runs")
+    parser.add_argument("--alignment_dir", type=str, default="models/aligned",
+                        help="Directory to save the aligned embeddings to and reuse them from "
+                             "(default = 'models/aligned')")
+    parser.add_argument("--max_neighbors", type=int, default=None,
+                        help="Compute neighborhood statistics from at most this many nearest neighbors of each word "
+                             "(5000 reproduces the original analysis; by default all neighbors within the largest "
+                             "radius are used)")
+    parser.add_argument("--neighbor_search", choices=["exact", "ivf"], default="exact",
+                        help="Nearest neighbor search backend: exact brute force search, or an approximate "
+                             "inverted file (IVF) index for large vocabularies (default = 'exact')")
+    parser.add_argument("--ivf_lists", type=int, default=None,
+                        help="Number of clusters of the IVF index (default = square root of the vocabulary size)")
+    parser.add_argument("--ivf_probes", type=int, default=IVF_DEFAULT_PROBES,
+                        help=f"Number of IVF clusters searched for each query (default = {IVF_DEFAULT_PROBES})")
+    parser.add_argument("--distance", choices=["cosine", "euclidean"], default="cosine",
+                        help="Distance metric defining the neighborhoods (default = 'cosine')")
+    parser.add_argument("--memory_budget", type=int, default=EUCLIDEAN_MEMORY_BUDGET // 2 ** 20,
+                        help="Memory used for the distance blocks of the Euclidean neighborhood computation, in MB "
+                             f"(default = {EUCLIDEAN_MEMORY_BUDGET // 2 ** 20})")
+    parser.add_argument("--no_plots", action='store_true',
+                        help="Skip saving the charts of the mean neighborhood statistics")
+    parser.add_argument("--from_stage", "--from-stage", type=str, default=None,
+                        help="Rerun the pipeline from this stage, reusing the earlier stages if they are up to date "
+                             "(stages: frequencies, neologisms, growth, alignment, then pairs, neighborhood_stats, "
+                             "summary, glm, glm_fit, or sweep and glm_fit with --sweep_seeds); by default only "
+                             "the stages whose inputs changed are run")
+    parser.add_argument("--only_stage", "--only-stage", type=str, default=None,
+                        help="Run only this stage, reusing the results of the earlier stages")
+    parser.add_argument("--profile", type=str, nargs='?', const="", default=None,
+                        help="Record the time, CPU time, peak memory and throughput of the stages and hot loops, "
+                             "and save them to this JSON file (default = 'files/profile.<date>-<time>.json')")
     return parser.parse_args()
 
 
-def main(params):
-    seed = params.seed
-    stability_constraint = params.stable
+def get_output_filename(name, stability_constraint, seed, extension):
+    """
+    Composing the output file path for a given control set setting
+    :param name: type of the output ('pairs', 'stats', 'density', 'growth', 'summary', 'glm' or 'glm_fit',
+    with a '.euclidean' suffix for the outputs of the Euclidean neighborhood analysis)
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed used to randomize the control set (None if not randomized)
+    :param extension: file extension
+    :return: file path, e.g. 'files/pairs.stable.seed1.tsv'
+    """
+    return f"files/{name}.{'stable' if stability_constraint else 'relaxed'}" \
+           f"{'.seed' + str(seed) if seed is not None else ''}.{extension}"
 
-    ws = WordStatsExtractor(params.coha_path, params.coca_path)
 
-    # Collecting vocabulary
+def get_analysis_filenames(stability_constraint, seed, distance="cosine"):
+    """
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed used to randomize the control set (None if not randomized)
+    :param distance: distance metric defining the neighborhoods, 'cosine' or 'euclidean' (default = 'cosine')
+    :return: dictionary of the output file paths of the control set analysis
+    """
+    suffix = "" if distance == "cosine" else f".{distance}"
+    return {
+        "pairs": get_output_filename("pairs", stability_constraint, seed, "tsv"),
+        "stats": get_output_filename("stats" + suffix, stability_constraint, seed, "npz"),
+        "density": get_output_filename("density" + suffix, stability_constraint, seed, "tsv"),
+        "growth": get_output_filename("growth" + suffix, stability_constraint, seed, "tsv"),
+        "summary": get_output_filename("summary" + suffix, stability_constraint, seed, "tsv"),
+        "density_chart": get_output_filename("density" + suffix, stability_constraint, seed, "png"),
+        "growth_chart": get_output_filename("growth" + suffix, stability_constraint, seed, "png"),
+        "glm": get_output_filename("glm" + suffix, stability_constraint, seed, "csv"),
+        "glm_fit": get_output_filename("glm_fit" + suffix, stability_constraint, seed, "tsv"),
+        "glm_report": get_output_filename("glm_fit" + suffix, stability_constraint, seed, "txt"),
+    }
 
-    vocab_path = "files/vocabulary.txt"
-    vocab = Utils.read_vocabulary(vocab_path)
-    print(f"Loaded Wikicorpus vocabulary with {len(vocab)} nouns")
 
-    # Extracting word frequencies
+def pair_control_set(ws, frequency_growth_dict, neologism_list, stability_constraint, seed):
+    """
+    Pairing neologisms with a control set
+    :param ws: word statistics extractor with the extracted word frequencies
+    :param frequency_growth_dict: word - frequency growth rate dictionary
+    :param neologism_list: list of neologisms
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed to randomize the control set (None if not randomized)
+    :return: neologism - control word pair dictionary
+    """
+    pair_filename = get_output_filename("pairs", stability_constraint, seed, "tsv")
+    print(f"Pairing neologisms with {'stable' if stability_constraint else 'relaxed'} control words...")
+    neologism_control_pairs = ws.pair_neologisms_with_controls(frequency_growth_dict, neologism_list, pair_filename,
+                                                               stability_constraint=stability_constraint, seed=seed)
+    print("Done.")
+    return neologism_control_pairs
+
 
-    print("Extracting historical and modern word frequencies...")
-    ws.extract_frequencies(vocab, data_split="historical")
-    ws.extract_frequencies(vocab, data_split="modern")
+def compute_neighborhood_stats(ns, neologism_control_pairs, stability_constraint, seed, distance="cosine", workers=1,
+                               checkpoint_key=None):
+    """
+    Computing the neighborhood density and average frequency growth rate of the paired words, and saving them
+    as a statistics table (and as density and growth text files)
+    :param ns: neighborhood statistics extractor with the aligned embeddings
+    :param neologism_control_pairs: neologism - control word pair dictionary
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed used to randomize the control set (None if not randomized)
+    :param distance: distance metric defining the neighborhoods, 'cosine' or 'euclidean' (default = 'cosine')
+    :param workers: number of processes computing the cosine neighborhood statistics (default = 1, serial)
+    :param checkpoint_key: key of the per-pair checkpoint of the cosine neighborhood statistics
+    (default = None, no checkpointing)
+    :return: neighborhood statistics table
+    """
+    filenames = get_analysis_filenames(stability_constraint, seed, distance)
+    print("Estimating neighborhood density and average frequency growth rates...")
+    if distance == "cosine":
+        stats = ns.compute_neighborhood_stats_cosine(neologism_control_pairs, filenames["density"],
+                                                     filenames["growth"], workers=workers,
+                                                     checkpoint_key=checkpoint_key)
+    else:
+        stats = ns.compute_neighborhood_stats_euclidean(neologism_control_pairs, filenames["density"],
+                                                        filenames["growth"])
+    stats.save(filenames["stats"])
     print("Done.")
+    return stats
 
-    # Extracting neologisms
 
-    print("Extracting a list of neologisms...")
-    neologism_filename = "files/neologisms.txt"
-    neologism_list = ws.extract_neologisms(neologism_filename)
+def save_summary(stats, stability_constraint, seed, plot=True):
+    """
+    Saving the mean neighborhood statistics (and their charts)
+    :param stats: neighborhood statistics table
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed used to randomize the control set (None if not randomized)
+    :param plot: whether to save charts of the mean neighborhood statistics (default = True)
+    :return:
+    """
+    filenames = get_analysis_filenames(stability_constraint, seed, stats.distance)
+    print("Saving the summary of neighborhood statistics...")
+    summary = stats.summarize()
+    summary.save(filenames["summary"])
+    if plot:
+        summary.plot(filenames["density_chart"], filenames["growth_chart"])
     print("Done.")
 
-    # Estimating frequency growth trends for all nouns in the vocabulary
 
-    growth_filename = "files/freq_growth.tsv"
-    print("Estimating word frequency growth trends...")
-    frequency_growth_dict = ws.extract_frequency_growth(vocab, growth_filename)
+def reformat_for_glm(stats, stability_constraint, seed):
+    """
+    Reformatting the neighborhood statistics to use in the GLM script
+    :param stats: neighborhood statistics table
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed used to randomize the control set (None if not randomized)
+    :return:
+    """
+    filenames = get_analysis_filenames(stability_constraint, seed, stats.distance)
+    print("Reformatting feature files for inputting to GLM script...")
+    Utils.reformat_feats_for_glm(stats.words, stats.is_neologism, stats.density, stats.growth, stats.radius_range,
+                                 filenames["glm"])
     print("Done.")
 
-    # Pairing neologisms with control
 
-    pair_filename = \
-        f"files/pairs.{'stable' if stability_constraint else 'relaxed'}" \
-        f"{'.seed' + str(seed) if seed is not None else ''}.tsv"
-    print(f"Pairing neologisms with {'stable' if stability_constraint else 'relaxed'} control words...")
-    neologism_control_pairs = ws.pair_neologisms_with_controls(frequency_growth_dict, neologism_list, pair_filename,
-                                     stability_constraint=stability_constraint, seed=None)
+def fit_glms(settings, distance="cosine"):
+    """
+    Fitting the logistic GLMs of glm.m (predicting whether a word is a neologism from its neighborhood density
+    and frequency growth rate at each radius) for all the given control set settings at once, and saving them
+    :param settings: list of (stability constraint, seed) control set settings
+    :param distance: distance metric defining the neighborhoods, 'cosine' or 'euclidean' (default = 'cosine')
+    :return:
+    """
+    radius_range = COSINE_RADIUS_RANGE if distance == "cosine" else EUCLIDEAN_RADIUS_RANGE
+    glm_inputs = []
+    for stability_constraint, seed in settings:
+        stats = NeighborhoodStats.load(get_analysis_filenames(stability_constraint, seed, distance)["stats"])
+        name = f"{'stable' if stability_constraint else 'relaxed'} pairing" + \
+               (f" with seed {seed}" if seed is not None else "")
+        glm_inputs.append((name, stats.is_neologism, stats.density, stats.growth))
+
+    print("Fitting GLMs...")
+    glms = NeighborhoodGLMs(glm_inputs, radius_range)
+    for i, (stability_constraint, seed) in enumerate(settings):
+        filenames = get_analysis_filenames(stability_constraint, seed, distance)
+        report = glms.report(i)
+        print(report)
+        with atomic_output(filenames["glm_report"]) as fout:
+            fout.write(report)
+        glms.save(i, filenames["glm_fit"])
     print("Done.")
 
-    print("Loading and aligning embedding models...")
+
+def run_control_set_analysis(ws, ns, frequency_growth_dict, neologism_list, stability_constraint, seed, plot=True,
+                             distance="cosine", workers=1, checkpoint_key=None):
+    """
+    Pairing neologisms with a control set and computing the neighborhood statistics for the pairs
+    :param ws: word statistics extractor with the extracted word frequencies
+    :param ns: neighborhood statistics extractor with the aligned embeddings
+    :param frequency_growth_dict: word - frequency growth rate dictionary
+    :param neologism_list: list of neologisms
+    :param stability_constraint: toggles between 'stable' and 'relaxed' control sets
+    :param seed: seed to randomize the control set (None if not randomized)
+    :param plot: whether to save charts of the mean neighborhood statistics (default = True)
+    :param distance: distance metric defining the neighborhoods, 'cosine' or 'euclidean' (default = 'cosine')
+    :param workers: number of processes computing the cosine neighborhood statistics (default = 1, serial)
+    :param checkpoint_key: key of the per-pair checkpoint of the cosine neighborhood statistics
+    (default = None, no checkpointing)
+    :return:
+    """
+    neologism_control_pairs = pair_control_set(ws, frequency_growth_dict, neologism_list, stability_constraint, seed)
+    stats = compute_neighborhood_stats(ns, neologism_control_pairs, stability_constraint, seed, distance=distance,
+                                       workers=workers, checkpoint_key=checkpoint_key)
+    save_summary(stats, stability_constraint, seed, plot=plot)
+    reformat_for_glm(stats, stability_constraint, seed)
+
+
+# Shared state of the sweep, inherited by the forked worker processes instead of being pickled for each task
+_sweep_state = {}
+
+
+def _run_sweep_task(setting):
+    stability_constraint, seed = setting
+    run_control_set_analysis(_sweep_state["ws"], _sweep_state["ns"], _sweep_state["frequency_growth_dict"],
+                             _sweep_state["neologism_list"], stability_constraint, seed, plot=_sweep_state["plot"],
+                             distance=_sweep_state["distance"], checkpoint_key=_sweep_state["checkpoint_key"])
+    return setting
+
+
+def get_sweep_settings(seeds):
+    """
+    :param seeds: list of seeds to randomize the control sets
+    :return: list of (stability constraint, seed) settings of the sweep
+    """
+    return [(stability_constraint, seed) for seed in seeds for stability_constraint in [True, False]]
+
+
+def run_sweep(ws, ns, frequency_growth_dict, neologism_list, seeds, workers, plot=True, distance="cosine",
+              checkpoint_key=None):
+    """
+    Running the control set analysis for every seed with both stable and relaxed control sets,
+    in parallel worker processes
+    :param ws: word statistics extractor with the extracted word frequencies
+    :param ns: neighborhood statistics extractor with the aligned embeddings
+    :param frequency_growth_dict: word - frequency growth rate dictionary
+    :param neologism_list: list of neologisms
+    :param seeds: list of seeds to randomize the control sets
+    :param workers: number of worker processes
+    :param plot: whether to save charts of the mean neighborhood statistics (default = True)
+    :param distance: distance metric defining the neighborhoods, 'cosine' or 'euclidean' (default = 'cosine')
+    :param checkpoint_key: key of the per-pair checkpoints of the cosine neighborhood statistics
+    (default = None, no checkpointing)
+    :return:
+    """
+
+    settings = get_sweep_settings(seeds)
+    _sweep_state.update(ws=ws, ns=ns, frequency_growth_dict=frequency_growth_dict, neologism_list=neologism_list,
+                        plot=plot, distance=distance, checkpoint_key=checkpoint_key)
+
+    if workers <= 1:
+        for setting in settings:
+            _run_sweep_task(setting)
+        return
+
+    # Worker processes are forked so that they share the word statistics and embeddings with the parent
+    with multiprocessing.get_context("fork").Pool(min(workers, len(settings))) as pool:
+        for stability_constraint, seed in pool.imap_unordered(_run_sweep_task, settings):
+            print(f"Finished {'stable' if stability_constraint else 'relaxed'} control set with seed {seed}")
+
+
+def build_pipeline(params):
+    """
+    Defining the stages of the analysis: word frequencies, neologisms, frequency growth rates, aligned embeddings,
+    and either the stages of the control set analysis (pairing, neighborhood statistics, summary, GLM input)
+    or a single stage running the control set sweep
+    :param params: command line arguments
+    :return: pipeline
+    """
+    vocab_path = "files/vocabulary.txt"
+    neologism_filename = "files/neologisms.txt"
+    growth_filename = "files/freq_growth.tsv"
     historical_model_file_path = "models/historical.w2v.bin"
     modern_model_file_path = "models/modern.w2v.bin"
-    ns = NeighborhoodStatsExtractor(historical_model_file_path, modern_model_file_path, vocab, frequency_growth_dict)
-    print("Done.")
+    plot = not params.no_plots
 
-    # Computing neighborhood density and average frequency growth rate
+    ws = WordStatsExtractor(params.coha_path, params.coca_path, workers=params.workers,
+                            cache_dir=None if params.no_cache else params.cache_dir)
 
-    density_filename = f"files/density.{'stable' if stability_constraint else 'relaxed'}" \
-                       f"{'.seed' + str(seed) if seed is not None else ''}.tsv"
-    growth_filename = f"files/growth.{'stable' if stability_constraint else 'relaxed'}" \
-                      f"{'.seed' + str(seed) if seed is not None else ''}.tsv"
+    # Collecting vocabulary
 
-    print("Estimating neighborhood density and average frequency growth rates...")
-    ns.compute_neighborhood_stats_cosine(neologism_control_pairs, density_filename, growth_filename)
-    print("Done.")
+    vocab = Utils.read_vocabulary(vocab_path)
+    print(f"Loaded Wikicorpus vocabulary with {len(vocab)} nouns")
 
-    # Reformatting output to use in GLM
+    # Extracting word frequencies (reused from the frequency cache rather than from the pipeline state)
 
-    glm_filename = f"files/glm.{'stable' if stability_constraint else 'relaxed'}" \
-                   f"{'.seed' + str(seed) if seed is not None else ''}.csv"
+    def frequencies():
+        print("Extracting historical and modern word frequencies...")
+        ws.extract_frequencies(vocab, data_split="historical", vocabulary_path=vocab_path)
+        ws.extract_frequencies(vocab, data_split="modern", vocabulary_path=vocab_path)
+        print("Done.")
+        return ws
 
-    print("Reformatting feature files for inputting to GLM script...")
-    Utils.reformat_feats_for_glm(density_filename, growth_filename, COSINE_RADIUS_RANGE, glm_filename)
-    print("Done.")
+    # Extracting neologisms
+
+    def neologisms(frequencies):
+        print("Extracting a list of neologisms...")
+        neologism_list = frequencies.extract_neologisms(neologism_filename)
+        print("Done.")
+        return neologism_list
+
+    # Estimating frequency growth trends for all nouns in the vocabulary
+
+    def growth(frequencies):
+        print("Estimating word frequency growth trends...")
+        frequency_growth_dict = frequencies.extract_frequency_growth(vocab, growth_filename)
+        if params.benchmark_growth:
+            frequencies.benchmark_frequency_growth(vocab)
+        print("Done.")
+        return frequency_growth_dict
+
+    def alignment(growth):
+        print("Loading and aligning embedding models...")
+        ns = NeighborhoodStatsExtractor(historical_model_file_path, modern_model_file_path, vocab, growth,
+                                        alignment_dir=params.alignment_dir, max_neighbors=params.max_neighbors,
+                                        neighbor_search=make_neighbor_search(params.neighbor_search,
+                                                                             num_lists=params.ivf_lists,
+                                                                             num_probes=params.ivf_probes),
+                                        memory_budget=params.memory_budget * 2 ** 20)
+        print("Done.")
+        return ns
+
+    stages = [
+        Stage("frequencies", frequencies, inputs=[vocab_path],
+              params=[ws.get_corpus_fingerprint(data_split, vocab_path) for data_split in ["historical", "modern"]]),
+        Stage("neologisms", neologisms, deps=["frequencies"], outputs=[neologism_filename],
+              load=lambda: WordStatsExtractor.read_neologisms(neologism_filename)),
+        Stage("growth", growth, deps=["frequencies"], params={"benchmark_growth": params.benchmark_growth},
+              outputs=[growth_filename], load=lambda: WordStatsExtractor.read_frequency_growth(growth_filename)),
+        # The stage is cheap to rerun when the alignment is saved to the alignment directory
+        Stage("alignment", alignment, deps=["growth"], inputs=[vocab_path],
+              params={"models": AlignedEmbeddings.fingerprint_sources([historical_model_file_path,
+                                                                       modern_model_file_path]),
+                      "alignment_dir": params.alignment_dir}),
+    ]
+    neighborhood_params = {"distance": params.distance, "max_neighbors": params.max_neighbors,
+                           "neighbor_search": params.neighbor_search, "ivf_lists": params.ivf_lists,
+                           "ivf_probes": params.ivf_probes}
+
+    if params.sweep_seeds is not None:
+        def sweep(frequencies, neologisms, growth, alignment, stage_key):
+            run_sweep(frequencies, alignment, growth, neologisms, params.sweep_seeds, params.workers, plot=plot,
+                      distance=params.distance, checkpoint_key=stage_key)
+
+        def glm_fit():
+            fit_glms(get_sweep_settings(params.sweep_seeds), distance=params.distance)
+
+        outputs = []
+        glm_fit_outputs = []
+        for stability_constraint, seed in get_sweep_settings(params.sweep_seeds):
+            filenames = get_analysis_filenames(stability_constraint, seed, params.distance)
+            outputs += [path for name, path in filenames.items()
+                        if not name.startswith("glm_") and (plot or not name.endswith("_chart"))]
+            glm_fit_outputs += [filenames["glm_fit"], filenames["glm_report"]]
+        stages += [
+            Stage("sweep", sweep, deps=["frequencies", "neologisms", "growth", "alignment"],
+                  params=dict(neighborhood_params, seeds=params.sweep_seeds, plot=plot), outputs=outputs,
+                  load=lambda: None),
+            Stage("glm_fit", glm_fit, deps=["sweep"], outputs=glm_fit_outputs, load=lambda: None),
+        ]
+        return Pipeline(stages, PIPELINE_STATE_PATH)
+
+    stability_constraint = params.stable
+    seed = params.seed
+    filenames = get_analysis_filenames(stability_constraint, seed, params.distance)
+
+    def pairs(frequencies, growth, neologisms):
+        return pair_control_set(frequencies, growth, neologisms, stability_constraint, seed)
+
+    def neighborhood_stats(alignment, pairs, stage_key):
+        return compute_neighborhood_stats(alignment, pairs, stability_constraint, seed, distance=params.distance,
+                                          workers=params.workers, checkpoint_key=stage_key)
+
+    def summary(neighborhood_stats):
+        save_summary(neighborhood_stats, stability_constraint, seed, plot=plot)
+
+    def glm(neighborhood_stats):
+        reformat_for_glm(neighborhood_stats, stability_constraint, seed)
+
+    def glm_fit():
+        fit_glms([(stability_constraint, seed)], distance=params.distance)
+
+    charts = [filenames["density_chart"], filenames["growth_chart"]] if plot else []
+
+    stages += [
+        Stage("pairs", pairs, deps=["frequencies", "growth", "neologisms"],
+              params={"stable": stability_constraint, "seed": seed}, outputs=[filenames["pairs"]],
+              load=lambda: WordStatsExtractor.read_pairs(filenames["pairs"])),
+        Stage("neighborhood_stats", neighborhood_stats, deps=["alignment", "pairs"], params=neighborhood_params,
+              outputs=[filenames["stats"], filenames["density"], filenames["growth"]],
+              load=lambda: NeighborhoodStats.load(filenames["stats"])),
+        Stage("summary", summary, deps=["neighborhood_stats"], params={"plot": plot},
+              outputs=[filenames["summary"]] + charts, load=lambda: None),
+        Stage("glm", glm, deps=["neighborhood_stats"], outputs=[filenames["glm"]], load=lambda: None),
+        Stage("glm_fit", glm_fit, deps=["neighborhood_stats"], outputs=[filenames["glm_fit"], filenames["glm_report"]],
+              load=lambda: None),
+    ]
+    return Pipeline(stages, PIPELINE_STATE_PATH)
+
+
+def main(params):
+    if params.profile is not None:
+        profiler.enable()
+    try:
+        pipeline = build_pipeline(params)
+        pipeline.run(from_stage=params.from_stage, only_stage=params.only_stage)
+    finally:
+        # The report is also saved when a stage fails, with the stages that ran until then
+        if params.profile is not None:
+            profiler.save(params.profile or f"files/profile.{time.strftime('%Y%m%d-%H%M%S')}.json")
 
 # ----------------------------------------------------------------
 if __name__ == '__main__':
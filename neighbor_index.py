@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from neighbor_search import *
+from output_files import atomic_output
+
+# Version of the saved neighbor index format (changing it invalidates existing indices)
+NEIGHBOR_INDEX_FORMAT_VERSION = 1
+
+
+class NeighborIndex:
+    """
+    Cosine nearest neighbor index over the historical embeddings of the vocabulary words only,
+    with the frequency growth rate of every indexed word attached (NaN for words without one).
+    Since every indexed word is a valid neighbor, queries return exactly the requested number of neighbors
+    without over-fetching from the full historical vocabulary and filtering the results.
+    The search itself is done by a pluggable backend (see neighbor_search.py), exact brute force by default
+    """
+
+    def __init__(self, words, vectors_norm, growth, backend=None):
+        self.words = words                  # row index -> word
+        self.word_index = {word: i for i, word in enumerate(words)}
+        self.vectors_norm = vectors_norm    # unit-length historical vectors of the indexed words (float32)
+        self.growth = growth                # frequency growth rates of the indexed words (float64, NaN if missing)
+        self.backend = (backend if backend is not None else ExactSearch()).fit(vectors_norm)
+
+    @classmethod
+    def build(cls, embeddings, vocabulary, spearmanr_dict, backend=None):
+        """
+        Building the index over the historical words that are in the vocabulary
+        :param embeddings: aligned embeddings
+        :param vocabulary: vocabulary of nouns for analysis
+        :param spearmanr_dict: word - frequency growth rate dictionary
+        :param backend: neighbor search backend (default = None, exact search)
+        :return: neighbor index
+        """
+        # Rows keep the order of the historical embeddings
+        rows = [i for i, word in enumerate(embeddings.historical_words) if word in vocabulary]
+        words = [embeddings.historical_words[i] for i in rows]
+        vectors_norm = np.ascontiguousarray(embeddings.historical_vectors_norm[rows])
+        growth = np.array([spearmanr_dict.get(word, np.nan) for word in words], dtype=np.float64)
+        return cls(words, vectors_norm, growth, backend)
+
+    def search(self, vectors, topn, exclude_words=None):
+        """
+        Retrieving the indexed words most similar to each of the query vectors
+        :param vectors: query vectors (one per row)
+        :param topn: number of neighbors to retrieve for each query
+        :param exclude_words: word to exclude from the results of each query, e.g. the query word itself
+        (default = None)
+        :return: index rows and cosine similarities (one array per query, most similar first)
+        """
+        exclude_rows = None
+        if exclude_words is not None:
+            exclude_rows = [self.word_index.get(word, -1) for word in exclude_words]
+        return self.backend.search(vectors, topn, exclude_rows)
+
+    def range_search(self, vectors, min_similarity, exclude_words=None):
+        """
+        Retrieving all indexed words with cosine similarity of at least min_similarity to each of the query vectors
+        :param vectors: query vectors (one per row)
+        :param min_similarity: minimum cosine similarity of the retrieved words
+        :param exclude_words: word to exclude from the results of each query, e.g. the query word itself
+        (default = None)
+        :return: list of (index rows, cosine similarities) array pairs, one per query, most similar first
+        """
+        exclude_rows = None
+        if exclude_words is not None:
+            exclude_rows = [self.word_index.get(word, -1) for word in exclude_words]
+        return self.backend.range_search(vectors, min_similarity, exclude_rows)
+
+    def save(self, index_dir, fingerprint):
+        """
+        Saving the index as .npy arrays and a word list, with a manifest describing them
+        :param index_dir: directory to save the index to
+        :param fingerprint: fingerprint of the inputs the index was built from
+        :return:
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        # The manifest is removed first and written last, so an interrupted save is never mistaken for a valid one
+        if os.path.exists(f"{index_dir}/manifest.json"):
+            os.remove(f"{index_dir}/manifest.json")
+
+        with atomic_output(f"{index_dir}/vectors_norm.npy", 'wb') as fout:
+            np.save(fout, self.vectors_norm)
+        with atomic_output(f"{index_dir}/growth.npy", 'wb') as fout:
+            np.save(fout, self.growth)
+        with atomic_output(f"{index_dir}/words.txt") as fout:
+            fout.writelines(f"{word}\n" for word in self.words)
+
+        with atomic_output(f"{index_dir}/manifest.json") as fout:
+            json.dump({"version": NEIGHBOR_INDEX_FORMAT_VERSION, "fingerprint": fingerprint,
+                       "num_words": len(self.words)}, fout, indent=2)
+
+    @classmethod
+    def load(cls, index_dir, mmap_mode='r', backend=None):
+        """
+        Opening the index saved by save()
+        :param index_dir: directory the index was saved to
+        :param mmap_mode: memory mapping mode for the arrays (default = 'r', read-only memory mapping)
+        :param backend: neighbor search backend (default = None, exact search)
+        :return: neighbor index
+        """
+        with open(f"{index_dir}/words.txt") as fin:
+            words = fin.read().split("\n")[:-1]
+        return cls(words, np.load(f"{index_dir}/vectors_norm.npy", mmap_mode=mmap_mode),
+                   np.load(f"{index_dir}/growth.npy", mmap_mode=mmap_mode), backend)
+
+    @staticmethod
+    def fingerprint(embeddings, vocabulary, spearmanr_dict):
+        """
+        :param embeddings: aligned embeddings saved to disk
+        :param vocabulary: vocabulary of nouns for analysis
+        :param spearmanr_dict: word - frequency growth rate dictionary
+        :return: hash of the inputs the index is built from (the alignment, vocabulary and frequency growth rates)
+        """
+        fingerprint = hashlib.sha1()
+        fingerprint.update(f"{NEIGHBOR_INDEX_FORMAT_VERSION}\n".encode())
+        # The manifest of the alignment identifies the embeddings (the models they were computed from and the
+        # shapes of the arrays), so the memory-mapped vectors are not read
+        fingerprint.update(json.dumps(embeddings.manifest, sort_keys=True).encode())
+        fingerprint.update("\n".join(sorted(vocabulary)).encode())
+        fingerprint.update("\n".join(f"{word}\t{float(growth)!r}" for word, growth in sorted(spearmanr_dict.items()))
+                           .encode())
+        return fingerprint.hexdigest()
+
+    @classmethod
+    def load_or_build(cls, embeddings, vocabulary, spearmanr_dict, index_dir=None, backend=None):
+        """
+        Opening a saved index if it was built from the same inputs, otherwise building it (and saving it).
+        Indices are only saved for embeddings that are saved too, since their manifest identifies them
+        :param embeddings: aligned embeddings
+        :param vocabulary: vocabulary of nouns for analysis
+        :param spearmanr_dict: word - frequency growth rate dictionary
+        :param index_dir: directory to save the index to / load it from (default = None, no saving)
+        :param backend: neighbor search backend (default = None, exact search)
+        :return: neighbor index
+        """
+        if index_dir is None or embeddings.manifest is None:
+            return cls.build(embeddings, vocabulary, spearmanr_dict, backend)
+
+        fingerprint = cls.fingerprint(embeddings, vocabulary, spearmanr_dict)
+        manifest_path = f"{index_dir}/manifest.json"
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fin:
+                manifest = json.load(fin)
+            if manifest.get("version") == NEIGHBOR_INDEX_FORMAT_VERSION and manifest.get("fingerprint") == fingerprint:
+                print(f"Loading neighbor index from {index_dir}")
+                return cls.load(index_dir, backend=backend)
+
+        neighbor_index = cls.build(embeddings, vocabulary, spearmanr_dict)
+        print(f"Saving neighbor index to {index_dir}")
+        neighbor_index.save(index_dir, fingerprint)
+        return cls.load(index_dir, backend=backend)
@@ -0,0 +1,341 @@
+import numpy as np
+
+# Number of index rows scored at once by a range search, which bounds the size of the similarity matrix
+RANGE_SEARCH_BLOCK_SIZE = 16384
+# Default memory budget of the distance blocks of a Euclidean neighborhood computation (in bytes)
+EUCLIDEAN_MEMORY_BUDGET = 256 * 2 ** 20
+# Approximate number of bytes used per query-row distance by the Euclidean neighborhood computation
+# (distances, their radius bins and the bincount inputs)
+EUCLIDEAN_BYTES_PER_DISTANCE = 48
+# Number of IVF clusters scored for each query by default
+IVF_DEFAULT_PROBES = 8
+# Number of spherical k-means iterations used to cluster the IVF index
+IVF_KMEANS_ITERATIONS = 10
+# Number of rows sampled per IVF cluster to train the cluster centroids
+IVF_TRAINING_ROWS_PER_LIST = 256
+
+
+def normalize_rows(vectors):
+    """
+    :param vectors: vectors (one per row)
+    :return: unit-length float32 copies of the vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def float32_threshold(min_similarity):
+    """
+    :param min_similarity: minimum similarity (in double precision)
+    :return: smallest float32 value that is not below min_similarity, so that comparing float32 similarities with it
+    selects exactly the similarities that are >= min_similarity in double precision
+    """
+    threshold = np.float32(min_similarity)
+    if np.float64(threshold) < min_similarity:
+        threshold = np.nextafter(threshold, np.float32(np.inf))
+    return threshold
+
+
+def cosine_top_k(vectors, matrix_norm, topn, exclude_rows=None):
+    """
+    Retrieving the rows of a normalized embedding matrix most similar to each of the query vectors
+    by cosine similarity, scoring all queries with a single matrix product
+    :param vectors: query vectors (one per row)
+    :param matrix_norm: unit-length embedding matrix to search
+    :param topn: number of rows to retrieve for each query
+    :param exclude_rows: row of the matrix to exclude from the results of each query (-1 for none),
+    e.g. the query word itself (default = None)
+    :return: arrays of matrix rows and cosine similarities (one row per query, most similar first)
+    """
+    vectors = normalize_rows(vectors)
+    similarities = vectors.dot(matrix_norm.T)
+
+    queries = np.arange(len(vectors))
+    num_candidates = similarities.shape[1]
+    if exclude_rows is not None:
+        exclude_rows = np.asarray(exclude_rows)
+        excluded = exclude_rows >= 0
+        similarities[queries[excluded], exclude_rows[excluded]] = -np.inf
+        if excluded.any():
+            num_candidates -= 1
+
+    topn = min(topn, num_candidates)
+    if topn <= 0:
+        return np.zeros([len(vectors), 0], dtype=np.int64), np.zeros([len(vectors), 0], dtype=np.float32)
+    best = np.argpartition(-similarities, topn - 1, axis=1)[:, :topn]
+    best_similarities = similarities[queries[:, np.newaxis], best]
+    order = np.argsort(-best_similarities, axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_similarities, order, axis=1)
+
+
+def cosine_range_search(vectors, matrix_norm, min_similarity, exclude_rows=None, block_size=RANGE_SEARCH_BLOCK_SIZE):
+    """
+    Retrieving all rows of a normalized embedding matrix with cosine similarity of at least min_similarity
+    to each of the query vectors. The matrix is scored in blocks of block_size rows, so the memory used
+    does not depend on its size, and the neighborhoods are not truncated
+    :param vectors: query vectors (one per row)
+    :param matrix_norm: unit-length embedding matrix to search
+    :param min_similarity: minimum cosine similarity of the retrieved rows
+    :param exclude_rows: row of the matrix to exclude from the results of each query (-1 for none),
+    e.g. the query word itself (default = None)
+    :param block_size: number of matrix rows scored at once (default = RANGE_SEARCH_BLOCK_SIZE)
+    :return: list of (matrix rows, cosine similarities) array pairs, one per query, most similar first
+    """
+    vectors = normalize_rows(vectors)
+    threshold = float32_threshold(min_similarity)
+
+    hit_rows = [[] for _ in range(len(vectors))]
+    hit_similarities = [[] for _ in range(len(vectors))]
+    for block_start in range(0, len(matrix_norm), block_size):
+        similarities = vectors.dot(matrix_norm[block_start:block_start + block_size].T)
+        queries, rows = np.nonzero(similarities >= threshold)
+        # np.nonzero lists the hits query by query, so each query's hits form a contiguous range
+        bounds = np.searchsorted(queries, np.arange(len(vectors) + 1))
+        for query in range(len(vectors)):
+            query_rows = rows[bounds[query]:bounds[query + 1]]
+            hit_rows[query].append(query_rows + block_start)
+            hit_similarities[query].append(similarities[query, query_rows])
+
+    results = []
+    for query in range(len(vectors)):
+        rows = np.concatenate(hit_rows[query]) if hit_rows[query] else np.zeros(0, dtype=np.int64)
+        similarities = np.concatenate(hit_similarities[query]) if hit_similarities[query] \
+            else np.zeros(0, dtype=np.float32)
+        if exclude_rows is not None and exclude_rows[query] >= 0:
+            kept = rows != exclude_rows[query]
+            rows, similarities = rows[kept], similarities[kept]
+        order = np.argsort(-similarities, kind='stable')
+        results.append((rows[order], similarities[order]))
+    return results
+
+
+class ExactSearch:
+    """
+    Exact (brute force) cosine neighbor search, scoring the queries against every row of the matrix
+    """
+
+    def fit(self, matrix_norm):
+        """
+        :param matrix_norm: unit-length embedding matrix to search
+        :return: self
+        """
+        self.matrix_norm = matrix_norm
+        return self
+
+    def search(self, vectors, topn, exclude_rows=None):
+        """
+        Same as cosine_top_k over the fitted matrix
+        """
+        return cosine_top_k(vectors, self.matrix_norm, topn, exclude_rows)
+
+    def range_search(self, vectors, min_similarity, exclude_rows=None):
+        """
+        Same as cosine_range_search over the fitted matrix
+        """
+        return cosine_range_search(vectors, self.matrix_norm, min_similarity, exclude_rows)
+
+    def __str__(self):
+        return "exact"
+
+
+class IVFSearch:
+    """
+    Approximate cosine neighbor search with an inverted file index: the rows of the matrix are clustered
+    with spherical k-means, and each query is only scored against the rows of the num_probes clusters whose
+    centroids are the most similar to it. Probing more clusters trades speed for recall
+    (probing all of them gives the exact results)
+    """
+
+    def __init__(self, num_lists=None, num_probes=IVF_DEFAULT_PROBES, num_iterations=IVF_KMEANS_ITERATIONS, seed=0):
+        """
+        :param num_lists: number of clusters (default = None, square root of the number of rows)
+        :param num_probes: number of clusters scored for each query (default = IVF_DEFAULT_PROBES)
+        :param num_iterations: number of k-means iterations (default = IVF_KMEANS_ITERATIONS)
+        :param seed: seed for sampling the k-means training rows and initial centroids
+        """
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.num_iterations = num_iterations
+        self.seed = seed
+
+    def fit(self, matrix_norm):
+        """
+        Clustering the rows of the matrix and building the inverted lists
+        :param matrix_norm: unit-length embedding matrix to search
+        :return: self
+        """
+        self.matrix_norm = matrix_norm
+        num_rows = len(matrix_norm)
+        num_lists = self.num_lists if self.num_lists is not None else int(round(np.sqrt(num_rows)))
+        num_lists = max(1, min(num_lists, num_rows))
+
+        # The centroids are trained on a sample of the rows, which is enough for a good partition
+        rng = np.random.RandomState(self.seed)
+        sample_size = min(num_rows, IVF_TRAINING_ROWS_PER_LIST * num_lists)
+        sample = np.asarray(matrix_norm[np.sort(rng.choice(num_rows, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+        for _ in range(self.num_iterations):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=num_lists)
+            nonempty = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros(centroids.shape, dtype=np.float32)
+            sums[nonempty] = np.add.reduceat(sample[np.argsort(assignment, kind='stable')], starts[nonempty], axis=0)
+            norms = np.linalg.norm(sums, axis=1)
+            # Empty clusters keep their previous centroid
+            updated = norms > 0
+            centroids[updated] = sums[updated] / norms[updated, np.newaxis]
+        self.centroids = centroids
+
+        assignment = np.concatenate([self._assign(matrix_norm[block_start:block_start + RANGE_SEARCH_BLOCK_SIZE],
+                                                  centroids)
+                                     for block_start in range(0, num_rows, RANGE_SEARCH_BLOCK_SIZE)])
+        # Rows of all lists concatenated, the rows of list l being list_rows[list_offsets[l]:list_offsets[l + 1]]
+        self.list_rows = np.argsort(assignment, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=num_lists))])
+        return self
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        """
+        :return: index of the most similar centroid for each of the vectors
+        """
+        return np.argmax(np.asarray(vectors, dtype=np.float32).dot(centroids.T), axis=1)
+
+    def _candidates(self, vectors):
+        """
+        :param vectors: unit-length query vectors
+        :return: iterator over the sorted matrix rows to score for each query
+        """
+        num_probes = min(self.num_probes, len(self.centroids))
+        probes = np.argpartition(-vectors.dot(self.centroids.T), num_probes - 1, axis=1)[:, :num_probes]
+        for query_probes in probes:
+            yield np.sort(np.concatenate([self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]]
+                                          for l in query_probes]))
+
+    def search(self, vectors, topn, exclude_rows=None):
+        """
+        Approximate counterpart of cosine_top_k
+        :return: lists of matrix rows and cosine similarities (one array per query, most similar first)
+        """
+        vectors = normalize_rows(vectors)
+        all_rows, all_similarities = [], []
+        for query, candidates in enumerate(self._candidates(vectors)):
+            if exclude_rows is not None and exclude_rows[query] >= 0:
+                candidates = candidates[candidates != exclude_rows[query]]
+            similarities = self.matrix_norm[candidates].dot(vectors[query])
+            query_topn = min(topn, len(candidates))
+            best = np.argpartition(-similarities, query_topn - 1)[:query_topn] if query_topn > 0 \
+                else np.zeros(0, dtype=np.int64)
+            best = best[np.argsort(-similarities[best], kind='stable')]
+            all_rows.append(candidates[best])
+            all_similarities.append(similarities[best])
+        return all_rows, all_similarities
+
+    def range_search(self, vectors, min_similarity, exclude_rows=None):
+        """
+        Approximate counterpart of cosine_range_search
+        :return: list of (matrix rows, cosine similarities) array pairs, one per query, most similar first
+        """
+        vectors = normalize_rows(vectors)
+        threshold = float32_threshold(min_similarity)
+        results = []
+        for query, candidates in enumerate(self._candidates(vectors)):
+            if exclude_rows is not None and exclude_rows[query] >= 0:
+                candidates = candidates[candidates != exclude_rows[query]]
+            similarities = self.matrix_norm[candidates].dot(vectors[query])
+            hits = np.flatnonzero(similarities >= threshold)
+            hits = hits[np.argsort(-similarities[hits], kind='stable')]
+            results.append((candidates[hits], similarities[hits]))
+        return results
+
+    def __str__(self):
+        return f"ivf(lists={len(self.centroids)}, probes={self.num_probes})"
+
+
+def make_neighbor_search(name, num_lists=None, num_probes=IVF_DEFAULT_PROBES):
+    """
+    :param name: 'exact' or 'ivf'
+    :param num_lists: number of clusters of the IVF index (default = None, square root of the number of rows)
+    :param num_probes: number of IVF clusters scored for each query (default = IVF_DEFAULT_PROBES)
+    :return: neighbor search backend (not fitted yet)
+    """
+    if name == 'exact':
+        return ExactSearch()
+    if name == 'ivf':
+        return IVFSearch(num_lists=num_lists, num_probes=num_probes)
+    raise ValueError(f"Unknown neighbor search backend: {name}")
+
+
+def euclidean_neighborhood_profiles(vectors, matrix, radius_range, growth, exclude_rows=None,
+                                    memory_budget=EUCLIDEAN_MEMORY_BUDGET):
+    """
+    Computing the density and mean frequency growth rate of the Euclidean neighborhoods of the query vectors
+    for a range of radii, in a single streaming pass over the rows of the embedding matrix.
+    Squared distances are computed in float32 as |a|^2 + |b|^2 - 2ab for blocks of rows small enough
+    for the distance block to fit in memory_budget bytes, and binned by radius, so that the statistics
+    for all radii are accumulated at once
+    :param vectors: query vectors (one per row)
+    :param matrix: embedding matrix to search
+    :param radius_range: radii (maximum distances, exclusive) to compute the statistics for, in any order
+    :param growth: frequency growth rates aligned with the rows of the matrix (NaN if unknown)
+    :param exclude_rows: row of the matrix to exclude from the neighborhood of each query (-1 for none),
+    e.g. the query word itself (default = None)
+    :param memory_budget: approximate memory used for the distance blocks, in bytes
+    (default = EUCLIDEAN_MEMORY_BUDGET)
+    :return: (num_queries x num_radii) arrays of neighborhood densities and mean frequency growth rates
+    (NaN growth for neighborhoods without any neighbor with a known growth rate)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    num_queries = len(vectors)
+    num_radii = len(radius_range)
+    radius_order = np.argsort(radius_range)
+    squared_radii = np.asarray(radius_range, dtype=np.float64)[radius_order] ** 2
+
+    growth = np.asarray(growth, dtype=np.float64)
+    known = ~np.isnan(growth)
+    growth = np.where(known, growth, 0.0)
+    query_squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+    if exclude_rows is not None:
+        exclude_rows = np.asarray(exclude_rows)
+
+    # Bin k of a neighbor is the number of squared radii not exceeding its squared distance, so that
+    # the neighbors within the k-th smallest radius are the ones in bins 0..k; bin num_radii is outside all radii
+    num_bins = num_radii + 1
+    bin_offsets = np.arange(num_queries)[:, np.newaxis] * num_bins
+    counts = np.zeros(num_queries * num_bins, dtype=np.int64)
+    growth_sums = np.zeros(num_queries * num_bins, dtype=np.float64)
+    growth_counts = np.zeros(num_queries * num_bins, dtype=np.float64)
+
+    block_size = max(1, memory_budget // (EUCLIDEAN_BYTES_PER_DISTANCE * max(num_queries, 1)))
+    for block_start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[block_start:block_start + block_size], dtype=np.float32)
+        squared_distances = query_squared_norms[:, np.newaxis] + np.einsum('ij,ij->i', block, block)[np.newaxis, :] \
+            - 2 * vectors.dot(block.T)
+        bins = np.searchsorted(squared_radii, squared_distances, side='right')
+        if exclude_rows is not None:
+            excluded = (exclude_rows >= block_start) & (exclude_rows < block_start + len(block))
+            bins[np.flatnonzero(excluded), exclude_rows[excluded] - block_start] = num_radii
+
+        flat_bins = (bins + bin_offsets).ravel()
+        block_growth = growth[block_start:block_start + len(block)]
+        block_known = known[block_start:block_start + len(block)]
+        counts += np.bincount(flat_bins, minlength=len(counts))
+        growth_sums += np.bincount(flat_bins, weights=np.broadcast_to(block_growth, bins.shape).ravel(),
+                                   minlength=len(growth_sums))
+        growth_counts += np.bincount(flat_bins, weights=np.broadcast_to(block_known, bins.shape).ravel(),
+                                     minlength=len(growth_counts))
+
+    density = np.cumsum(counts.reshape(num_queries, num_bins)[:, :num_radii], axis=1)
+    growth_sums = np.cumsum(growth_sums.reshape(num_queries, num_bins)[:, :num_radii], axis=1)
+    growth_counts = np.cumsum(growth_counts.reshape(num_queries, num_bins)[:, :num_radii], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_growth = growth_sums / growth_counts
+    mean_growth[growth_counts == 0] = np.nan
+
+    # Restoring the order of radius_range
+    ordered_density = np.empty_like(density)
+    ordered_density[:, radius_order] = density
+    ordered_mean_growth = np.empty_like(mean_growth)
+    ordered_mean_growth[:, radius_order] = mean_growth
+    return ordered_density, ordered_mean_growth
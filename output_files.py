@@ -0,0 +1,69 @@
+import os
+import time
+import contextlib
+
+# Size of the write buffer of the output files, so that lines reach the disk in large chunks rather than one by one
+OUTPUT_BUFFER_SIZE = 2 ** 20
+
+# Minimum number of seconds between two progress reports of a long loop
+PROGRESS_INTERVAL = 30
+
+
+@contextlib.contextmanager
+def atomic_output(path, mode='w', buffer_size=OUTPUT_BUFFER_SIZE):
+    """
+    Opening an output file for buffered writing, e.g.
+        with atomic_output("files/pairs.stable.tsv") as fout:
+            fout.writelines(lines)
+    The content is written to a temporary file next to the output file, synced to the disk and then renamed
+    over the output file, so an interrupted write (or a crash after the rename) never leaves a half-written
+    output (the temporary file is removed if writing fails, and the previous output, if any, is kept)
+    :param path: path to the output file
+    :param mode: 'w' for text or 'wb' for binary content (default = 'w')
+    :param buffer_size: size of the write buffer in bytes (default = OUTPUT_BUFFER_SIZE)
+    :return: file object to write the content to
+    """
+    tmp_path = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        with open(tmp_path, mode, buffering=buffer_size) as fout:
+            yield fout
+            # Syncing the content first, otherwise after a crash the rename could be on the disk without it
+            fout.flush()
+            os.fsync(fout.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+class ProgressReporter:
+    """
+    Progress of a long loop, printed at most every PROGRESS_INTERVAL seconds. Output files are only written
+    to disk once they are complete (or at checkpoints), so the progress is reported here instead
+    """
+
+    def __init__(self, description, total, interval=PROGRESS_INTERVAL):
+        """
+        :param description: description of the processed items, e.g. 'Neighborhood statistics of pairs'
+        :param total: total number of items
+        :param interval: minimum number of seconds between two reports (default = PROGRESS_INTERVAL)
+        """
+        self.description = description
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start_time = self.last_report_time = time.perf_counter()
+
+    def update(self, count):
+        """
+        Counting processed items, and printing the progress if the last report is old enough
+        :param count: number of items processed since the last update
+        :return:
+        """
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report_time >= self.interval:
+            self.last_report_time = now
+            print(f"{self.description}: {self.done}/{self.total} done in {now - self.start_time:.0f}s", flush=True)
@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+
+from profiling import profiler
+from output_files import atomic_output
+
+# Version of the pipeline state format (changing it makes every stage run again)
+PIPELINE_STATE_VERSION = 1
+
+
+def hash_file(path):
+    """
+    :param path: file path
+    :return: SHA-1 hash of the file content
+    """
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(2 ** 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class Stage:
+    """
+    A step of the pipeline. A stage is identified by a key hashing everything its result depends on:
+    the content of its input files, its parameters and the results of the stages it depends on.
+    A stage that can reload its result from its output files is skipped when its key has not changed
+    and its output files are unchanged since it last ran. Stages without outputs (e.g. the ones backed
+    by their own caches) are run when a later stage needs their result
+    """
+
+    def __init__(self, name, run, deps=(), inputs=(), params=None, outputs=(), load=None):
+        """
+        :param name: name of the stage
+        :param run: function computing the result of the stage, called with the results of the dependencies
+        it has arguments for (named after the dependencies), and with the stage key if it has a 'stage_key' argument
+        :param deps: names of the stages whose results this stage uses
+        :param inputs: paths to the files the result depends on (hashed by content)
+        :param params: JSON-serializable values the result depends on, e.g. options and fingerprints
+        of large inputs (default = None)
+        :param outputs: paths to the files the stage writes
+        :param load: function reloading the result from the output files, called like run, so that only
+        the dependencies it has arguments for are loaded (default = None, the stage always runs)
+        """
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.params = params
+        self.outputs = list(outputs)
+        self.load = load
+
+
+class Pipeline:
+    """
+    Minimal DAG runner: runs stages in order, skipping the stages that are up to date, and records
+    the key of every stage and the hashes of its output files in a JSON state file
+    """
+
+    def __init__(self, stages, state_path):
+        """
+        :param stages: list of stages, each listed after the stages it depends on
+        :param state_path: path to the JSON file recording the state of the stages
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        for stage in stages:
+            for dep in stage.deps:
+                assert self.order.index(dep) < self.order.index(stage.name), \
+                    f"Stage {stage.name} is listed before its dependency {dep}"
+        self.state_path = state_path
+        self.state = self.read_state()
+        self.results = {}
+        self._keys = {}
+
+    def read_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as fin:
+            state = json.load(fin)
+        return state.get("stages", {}) if state.get("version") == PIPELINE_STATE_VERSION else {}
+
+    def write_state(self):
+        # The state is replaced atomically, so an interrupted write never corrupts it
+        with atomic_output(self.state_path) as fout:
+            json.dump({"version": PIPELINE_STATE_VERSION, "stages": self.state}, fout, indent=2)
+
+    def key(self, name):
+        """
+        :param name: stage name
+        :return: hash of the input files, parameters and dependency results of the stage
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            key = hashlib.sha1()
+            key.update(json.dumps([name, stage.params], sort_keys=True, default=str).encode())
+            for path in stage.inputs:
+                key.update(f"{path}\t{hash_file(path) if os.path.exists(path) else None}\n".encode())
+            for dep in stage.deps:
+                key.update(f"{dep}\t{self.result_hash(dep)}\n".encode())
+            self._keys[name] = key.hexdigest()
+        return self._keys[name]
+
+    def result_hash(self, name):
+        """
+        :param name: stage name
+        :return: hash identifying the result of the stage: the hashes of its output files if it has any,
+        otherwise its key
+        """
+        stage = self.stages[name]
+        if not stage.outputs:
+            return self.key(name)
+        return hashlib.sha1("".join(f"{path}\t{hash_file(path) if os.path.exists(path) else None}\n"
+                                    for path in stage.outputs).encode()).hexdigest()
+
+    def is_up_to_date(self, name):
+        """
+        :param name: stage name
+        :return: True if the stage last ran with the same key and its output files have not changed since
+        """
+        stage = self.stages[name]
+        stage_state = self.state.get(name)
+        if stage.load is None or stage_state is None or stage_state.get("key") != self.key(name):
+            return False
+        return all(os.path.exists(path) and hash_file(path) == stage_state["outputs"].get(path)
+                   for path in stage.outputs)
+
+    def call(self, function, name):
+        arguments = function.__code__.co_varnames[:function.__code__.co_argcount]
+        kwargs = {dep: self.get(dep) for dep in self.stages[name].deps if dep in arguments}
+        if "stage_key" in arguments:
+            kwargs["stage_key"] = self.key(name)
+        return function(**kwargs)
+
+    def get(self, name):
+        """
+        Result of a stage, reloaded from its outputs if the stage was skipped
+        :param name: stage name
+        :return: result of the stage
+        """
+        if name not in self.results:
+            stage = self.stages[name]
+            if stage.load is None:
+                self.run_stage(name)
+            else:
+                self.results[name] = self.call(stage.load, name)
+        return self.results[name]
+
+    def run_stage(self, name):
+        print(f"Running stage: {name}")
+        with profiler.stage(name):
+            self.results[name] = self.call(self.stages[name].run, name)
+        # The keys of the downstream stages depend on the outputs that were just written
+        self._keys = {stage_name: key for stage_name, key in self._keys.items()
+                      if self.order.index(stage_name) <= self.order.index(name)}
+        self.state[name] = {"key": self.key(name),
+                            "outputs": {path: hash_file(path) for path in self.stages[name].outputs}}
+        self.write_state()
+
+    def run(self, from_stage=None, only_stage=None):
+        """
+        Running the pipeline
+        :param from_stage: name of the stage to resume from: earlier stages are reused if they are up to date,
+        and this stage and all later ones are run again (default = None, running only the out of date stages)
+        :param only_stage: name of the only stage to run, reusing the results of the earlier stages
+        (default = None)
+        :return:
+        """
+        for name in [from_stage, only_stage]:
+            if name is not None and name not in self.stages:
+                raise ValueError(f"Unknown stage: {name} (stages: {', '.join(self.order)})")
+
+        if only_stage is not None:
+            self.run_stage(only_stage)
+            return
+
+        start = self.order.index(from_stage) if from_stage is not None else len(self.order)
+        for i, name in enumerate(self.order):
+            if i < start:
+                # Stages without outputs to reload from only run when a later stage needs their result
+                if self.stages[name].load is None:
+                    continue
+                if self.is_up_to_date(name):
+                    print(f"Skipping up to date stage: {name}")
+                    continue
+            if name not in self.results:
+                self.run_stage(name)
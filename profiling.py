@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import contextlib
+
+from output_files import atomic_output
+
+# Version of the profile report format
+PROFILE_REPORT_VERSION = 1
+
+
+def get_cpu_times():
+    """
+    :return: CPU time (user + system) in seconds used by the current process and by its terminated child processes
+    (e.g. the workers of a closed pool)
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def get_peak_rss_mb():
+    """
+    :return: peak resident set size in MB of the current process and of its largest terminated child process
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+
+
+class LoopCounter:
+    """
+    Item counts of one execution of an instrumented loop
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def add(self, **counts):
+        """
+        Counting processed items, e.g. add(files=1, tokens=2500)
+        :param counts: numbers of processed items by unit
+        :return:
+        """
+        for unit, count in counts.items():
+            self.items[unit] = self.items.get(unit, 0) + count
+
+
+class _DisabledLoopCounter:
+    def add(self, **counts):
+        pass
+
+
+_disabled_loop_counter = _DisabledLoopCounter()
+
+
+class Profiler:
+    """
+    Instrumentation of the pipeline, disabled by default. Once enabled, it records the wall time, CPU time
+    and peak memory of every stage, and the wall time, CPU time and item throughput of the hot loops,
+    aggregated by loop name under the stage they ran in. Loops running in worker processes are measured
+    in the parent process, around the merging of the worker results
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.start_time = None
+        self.stages = []    # records of the top-level stages, in the order they finished
+        self.loops = {}     # loops that ran outside of any stage
+        self._stack = []    # records of the stages currently running (innermost last)
+
+    def enable(self):
+        self.enabled = True
+        self.start_time = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measuring a stage (stages can be nested, e.g. when a stage runs the stage it depends on, and are then
+        recorded under their parent stage; their times are included in the times of the parent)
+        :param name: stage name
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        record = {"name": name, "loops": {}, "stages": []}
+        (self._stack[-1]["stages"] if self._stack else self.stages).append(record)
+        self._stack.append(record)
+        start_wall = time.perf_counter()
+        start_cpu, start_children_cpu = get_cpu_times()
+        try:
+            yield
+        finally:
+            end_cpu, end_children_cpu = get_cpu_times()
+            peak_rss_mb, children_peak_rss_mb = get_peak_rss_mb()
+            record.update(wall_time_s=time.perf_counter() - start_wall, cpu_time_s=end_cpu - start_cpu,
+                          children_cpu_time_s=end_children_cpu - start_children_cpu, peak_rss_mb=peak_rss_mb,
+                          children_peak_rss_mb=children_peak_rss_mb)
+            self._stack.pop()
+            print(f"Stage {name}: {record['wall_time_s']:.2f}s wall, {record['cpu_time_s']:.2f}s CPU "
+                  f"(+{record['children_cpu_time_s']:.2f}s in worker processes), peak RSS {peak_rss_mb:.0f} MB")
+
+    @contextlib.contextmanager
+    def loop(self, name):
+        """
+        Measuring one execution of a hot loop, e.g.
+            with profiler.loop("extract_frequencies") as counter:
+                ...
+                counter.add(files=1, tokens=num_tokens)
+        :param name: loop name, executions with the same name are aggregated
+        :return: counter of the processed items
+        """
+        if not self.enabled:
+            yield _disabled_loop_counter
+            return
+
+        counter = LoopCounter()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield counter
+        finally:
+            loops = self._stack[-1]["loops"] if self._stack else self.loops
+            record = loops.setdefault(name, {"calls": 0, "wall_time_s": 0.0, "cpu_time_s": 0.0, "items": {}})
+            record["calls"] += 1
+            record["wall_time_s"] += time.perf_counter() - start_wall
+            record["cpu_time_s"] += time.process_time() - start_cpu
+            for unit, count in counter.items.items():
+                record["items"][unit] = record["items"].get(unit, 0) + count
+
+    @staticmethod
+    def add_throughput(loops):
+        """
+        Adding items per second of wall time to the loop records
+        :param loops: loop name - loop record dictionary
+        :return:
+        """
+        for record in loops.values():
+            record["throughput"] = {f"{unit}_per_s": count / record["wall_time_s"] if record["wall_time_s"] > 0
+                                    else None for unit, count in record["items"].items()}
+
+    def report(self):
+        """
+        :return: JSON-serializable report of the measurements
+        """
+        def finish_stage(record):
+            self.add_throughput(record["loops"])
+            for child in record["stages"]:
+                finish_stage(child)
+            return record
+
+        self.add_throughput(self.loops)
+        return {
+            "version": PROFILE_REPORT_VERSION,
+            "argv": sys.argv,
+            "start_time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+            "wall_time_s": time.time() - self.start_time,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "peak_rss_mb": get_peak_rss_mb()[0],
+            "stages": [finish_stage(record) for record in self.stages],
+            "loops": self.loops,
+        }
+
+    def save(self, outfile):
+        """
+        Saving the report to a JSON file
+        :param outfile: file path to save the report to
+        :return:
+        """
+        with atomic_output(outfile) as fout:
+            json.dump(self.report(), fout, indent=2)
+        print(f"Profile saved to {outfile}")
+
+
+# Profiler shared by all modules, enabled by main.py with --profile
+profiler = Profiler()
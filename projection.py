@@ -1,6 +1,7 @@
 import numpy as np
 from copy import deepcopy
-from gensim.models import keyedvectors
+
+from profiling import profiler
 
 """
 This code is a slightly modified version of 
@@ -22,24 +23,26 @@ def smart_procrustes_align_gensim(base_embed, other_embed, words=None):
     If `words` is set, intersect the two models' vocabulary with the vocabulary in words (see `intersection_align_gensim` documentation).
     """
 
-    # make sure vocabulary and indices are aligned
-    # added deepcopy here so that the vocabularies do not end up restricted to anchor words only
-    in_base_embed, in_other_embed = \
-        intersection_align_gensim(deepcopy(base_embed), deepcopy(other_embed), words=words)
-
-    # get the embedding matrices
-    base_vecs = in_base_embed.wv.vectors
-    other_vecs = in_other_embed.wv.vectors
-
-    # just a matrix dot product with numpy
-    m = other_vecs.T.dot(base_vecs)
-    # SVD method from numpy
-    u, _, v = np.linalg.svd(m)
-    # another matrix operation
-    ortho = u.dot(v)
-    # Replace original array with modified one
-    # i.e. multiplying the embedding matrix by "ortho"
-    other_embed.wv.vectors = (other_embed.wv.vectors).dot(ortho)
+    with profiler.loop("smart_procrustes_align_gensim") as counter:
+        # make sure vocabulary and indices are aligned
+        # added deepcopy here so that the vocabularies do not end up restricted to anchor words only
+        in_base_embed, in_other_embed = \
+            intersection_align_gensim(deepcopy(base_embed), deepcopy(other_embed), words=words)
+
+        # get the embedding matrices
+        base_vecs = in_base_embed.wv.vectors
+        other_vecs = in_other_embed.wv.vectors
+
+        # just a matrix dot product with numpy
+        m = other_vecs.T.dot(base_vecs)
+        # SVD method from numpy
+        u, _, v = np.linalg.svd(m)
+        # another matrix operation
+        ortho = u.dot(v)
+        # Replace original array with modified one
+        # i.e. multiplying the embedding matrix by "ortho"
+        other_embed.wv.vectors = (other_embed.wv.vectors).dot(ortho)
+        counter.add(shared_rows=len(base_vecs), rows=len(other_embed.wv.vectors))
     return other_embed
 
 
@@ -54,7 +57,6 @@ def intersection_align_gensim(m1, m2, words=None):
         -- you can find the index of any word on the .index2word list: model.index2word.index(word) => 2
     The .vocab dictionary is also updated for each model, preserving the count but updating the index.
     """
-
     # Get the vocab for each model
     vocab_m1 = set(m1.wv.vocab.keys())
     vocab_m2 = set(m2.wv.vocab.keys())
@@ -71,6 +73,9 @@ def intersection_align_gensim(m1, m2, words=None):
     common_vocab = list(common_vocab)
     common_vocab.sort(key=lambda w: m1.wv.vocab[w].count + m2.wv.vocab[w].count, reverse=True)
 
+    # Imported here so that importing this module (or aligning identical vocabularies) does not load gensim
+    from gensim.models import keyedvectors
+
     # Then for each model...
     for m in [m1, m2]:
         # Replace old array of vectors with new one (with common vocab)
@@ -90,3 +95,48 @@ def intersection_align_gensim(m1, m2, words=None):
         m.wv.vocab = new_vocab
 
     return (m1, m2)
+
+
+def procrustes_align_keyed_vectors(base_wv, other_wv, words=None, common_vocab=None):
+    """
+    Procrustes align other_wv to base_wv (gensim KeyedVectors) without copying the models.
+    Same alignment as `smart_procrustes_align_gensim`: the shared vocabulary (intersected with `words` if set)
+    is sorted by summed frequency, the rotation is computed from the shared rows, and every row of other_wv
+    is multiplied by it. Instead of deep-copying both models and rebuilding their vector matrices row by row,
+    the shared rows are gathered with fancy indexing and only other_wv.vectors is replaced (with float32 vectors).
+    If the shared vocabulary was already computed with `intersect_vocabularies`, it can be passed as `common_vocab`.
+    Return other_wv and the rotation matrix.
+    """
+
+    with profiler.loop("procrustes_align_keyed_vectors") as counter:
+        if common_vocab is None:
+            common_vocab = intersect_vocabularies(base_wv, other_wv, words=words)
+
+        # gather the shared rows in the same order for both embeddings
+        base_vecs = base_wv.vectors[[base_wv.vocab[w].index for w in common_vocab]]
+        other_vecs = other_wv.vectors[[other_wv.vocab[w].index for w in common_vocab]]
+
+        m = other_vecs.T.dot(base_vecs)
+        u, _, v = np.linalg.svd(m)
+        ortho = u.dot(v)
+        del base_vecs, other_vecs
+
+        other_wv.vectors = other_wv.vectors.dot(ortho).astype(np.float32, copy=False)
+        # normalized vectors (if computed before) are stale after the rotation
+        other_wv.vectors_norm = None
+        counter.add(shared_rows=len(common_vocab), rows=len(other_wv.vectors))
+    return other_wv, ortho
+
+
+def intersect_vocabularies(wv1, wv2, words=None):
+    """
+    Return the vocabulary shared by two gensim KeyedVectors (intersected with `words` if set),
+    sorted by descending frequency (summed for both), as in `intersection_align_gensim`.
+    """
+
+    common_vocab = set(wv1.vocab.keys()) & set(wv2.vocab.keys())
+    if words: common_vocab &= set(words)
+
+    common_vocab = list(common_vocab)
+    common_vocab.sort(key=lambda w: wv1.vocab[w].count + wv2.vocab[w].count, reverse=True)
+    return common_vocab
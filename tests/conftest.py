@@ -0,0 +1,51 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# The modules of the analysis are top-level scripts, imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def synthetic_analysis(tmp_path_factory):
+    """
+    Word statistics and aligned embeddings of a small synthetic corpus (generated as by benchmark_pipeline.py),
+    with placeholder model files from which the neighborhood statistics extractor loads the saved alignment
+    """
+    from benchmark_pipeline import generate_vocabulary, generate_corpus, generate_embeddings
+    from utils import Utils
+    from extract_word_stats import WordStatsExtractor
+    from extract_neighborhood_stats import NeighborhoodStatsExtractor
+    from aligned_embeddings import AlignedEmbeddings
+
+    data_dir = str(tmp_path_factory.mktemp("synthetic"))
+    rng = np.random.default_rng(0)
+    words = generate_vocabulary(2000, rng)
+    with open(f"{data_dir}/vocabulary.txt", 'w') as fout:
+        fout.writelines(f"{word}\n" for word in words)
+    vocabulary = Utils.read_vocabulary(f"{data_dir}/vocabulary.txt")
+
+    ws = WordStatsExtractor(f"{data_dir}/historical", f"{data_dir}/modern")
+    for data_split in ["historical", "modern"]:
+        corpus_dir, subdirs = ws.get_data_subdirs(data_split)
+        generate_corpus(corpus_dir, subdirs, words, data_split, 2, 5000, rng)
+        ws.extract_frequencies(vocabulary, data_split=data_split)
+    neologism_list = ws.extract_neologisms(f"{data_dir}/neologisms.txt")
+    frequency_growth_dict = ws.extract_frequency_growth(vocabulary, f"{data_dir}/freq_growth.tsv")
+
+    historical_vectors, modern_vectors = generate_embeddings(words, 16, rng)
+    historical_vectors_norm = \
+        (historical_vectors / np.sqrt((historical_vectors ** 2).sum(-1))[..., np.newaxis]).astype(np.float32)
+    model_paths = [f"{data_dir}/historical.w2v.bin", f"{data_dir}/modern.w2v.bin"]
+    for path in model_paths:
+        with open(path, 'w') as fout:
+            fout.write("synthetic\n")
+    AlignedEmbeddings(words, historical_vectors, historical_vectors_norm, words, modern_vectors, words,
+                      np.eye(16, dtype=np.float32)).save(f"{data_dir}/aligned", model_paths)
+    ns = NeighborhoodStatsExtractor(model_paths[0], model_paths[1], vocabulary, frequency_growth_dict,
+                                    alignment_dir=f"{data_dir}/aligned")
+    return types.SimpleNamespace(data_dir=data_dir, vocabulary=vocabulary, ws=ws, ns=ns,
+                                 neologism_list=neologism_list, frequency_growth_dict=frequency_growth_dict)
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+
+from aligned_embeddings import AlignedEmbeddings
+from neighbor_index import NeighborIndex
+
+
+def make_embeddings(num_words=50, dimension=8, seed=0):
+    rng = np.random.RandomState(seed)
+    words = [f"word{i}" for i in range(num_words)]
+    historical_vectors = rng.randn(num_words, dimension).astype(np.float32)
+    historical_vectors_norm = \
+        (historical_vectors / np.sqrt((historical_vectors ** 2).sum(-1))[..., np.newaxis]).astype(np.float32)
+    modern_projected_vectors = rng.randn(num_words, dimension).astype(np.float32)
+    return AlignedEmbeddings(words, historical_vectors, historical_vectors_norm, words[::-1],
+                             modern_projected_vectors, words[:10], np.eye(dimension, dtype=np.float32))
+
+
+def test_alignment_save_load(tmp_path):
+    embeddings = make_embeddings()
+    sources = [str(tmp_path / "historical.w2v.bin"), str(tmp_path / "modern.w2v.bin")]
+    for path in sources:
+        open(path, 'w').close()
+    embeddings.save(str(tmp_path / "aligned"), sources)
+
+    assert AlignedEmbeddings.is_saved(str(tmp_path / "aligned"), sources)
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path / "aligned"))
+    loaded = AlignedEmbeddings.load(str(tmp_path / "aligned"))
+    assert loaded.historical_words == embeddings.historical_words
+    assert loaded.modern_words == embeddings.modern_words
+    assert loaded.shared_words == embeddings.shared_words
+    for name in ["historical_vectors", "historical_vectors_norm", "modern_projected_vectors", "ortho"]:
+        assert np.array_equal(getattr(loaded, name), getattr(embeddings, name))
+
+
+def test_neighbor_index_save_load(tmp_path):
+    embeddings = make_embeddings()
+    vocabulary = {word: '' for word in embeddings.historical_words[::2]}
+    spearmanr_dict = {word: 0.01 * i for i, word in enumerate(embeddings.historical_words[:20])}
+    neighbor_index = NeighborIndex.build(embeddings, vocabulary, spearmanr_dict)
+    neighbor_index.save(str(tmp_path / "index"), "fingerprint")
+
+    loaded = NeighborIndex.load(str(tmp_path / "index"))
+    assert loaded.words == neighbor_index.words
+    assert np.array_equal(loaded.vectors_norm, neighbor_index.vectors_norm)
+    assert np.array_equal(loaded.growth, neighbor_index.growth, equal_nan=True)
+
+
+def test_neighbor_index_search_matches_filtered_search(tmp_path):
+    embeddings = make_embeddings()
+    vocabulary = {word: '' for word in embeddings.historical_words[::3]}
+    neighbor_index = NeighborIndex.build(embeddings, vocabulary, {})
+    query_words = embeddings.modern_words[:10]
+    queries = embeddings.modern_projected_vectors[:10]
+    rows, similarities = neighbor_index.search(queries, 5, exclude_words=query_words)
+
+    for query_word, query, query_rows, query_similarities in zip(query_words, queries, rows, similarities):
+        # Original search: all historical words ranked by similarity, then filtered to the vocabulary
+        all_similarities = embeddings.historical_vectors_norm.astype(np.float64) @ (query / np.linalg.norm(query))
+        ranked = [embeddings.historical_words[i] for i in np.argsort(-all_similarities)]
+        expected = [word for word in ranked if word in vocabulary and word != query_word][:5]
+        assert [neighbor_index.words[row] for row in query_rows] == expected
+        assert np.allclose(query_similarities,
+                           [all_similarities[embeddings.historical_index[word]] for word in expected], atol=1e-6)
+
+
+def test_neighbor_index_fingerprint_uses_alignment_manifest(tmp_path):
+    sources = [str(tmp_path / "historical.w2v.bin"), str(tmp_path / "modern.w2v.bin")]
+    for path in sources:
+        open(path, 'w').close()
+    make_embeddings().save(str(tmp_path / "aligned"), sources)
+    embeddings = AlignedEmbeddings.load(str(tmp_path / "aligned"))
+    vocabulary = {word: '' for word in embeddings.historical_words[::2]}
+    spearmanr_dict = {word: 0.01 * i for i, word in enumerate(embeddings.historical_words[:20])}
+    fingerprint = NeighborIndex.fingerprint(embeddings, vocabulary, spearmanr_dict)
+
+    # The vectors are not read
+    embeddings.historical_vectors_norm = None
+    assert NeighborIndex.fingerprint(embeddings, vocabulary, spearmanr_dict) == fingerprint
+    assert NeighborIndex.fingerprint(embeddings, vocabulary, {**spearmanr_dict, "word0": 0.5}) != fingerprint
+
+    # Realigning from updated models changes the manifest, and thus the fingerprint
+    with open(sources[0], 'w') as fout:
+        fout.write("updated")
+    make_embeddings().save(str(tmp_path / "aligned"), sources)
+    assert NeighborIndex.fingerprint(AlignedEmbeddings.load(str(tmp_path / "aligned")), vocabulary,
+                                     spearmanr_dict) != fingerprint
+
+
+def test_neighbor_index_load_or_build(tmp_path):
+    sources = [str(tmp_path / "historical.w2v.bin"), str(tmp_path / "modern.w2v.bin")]
+    for path in sources:
+        open(path, 'w').close()
+    make_embeddings().save(str(tmp_path / "aligned"), sources)
+    embeddings = AlignedEmbeddings.load(str(tmp_path / "aligned"))
+    vocabulary = {word: '' for word in embeddings.historical_words[::2]}
+    index_dir = str(tmp_path / "aligned" / "neighbor_index")
+
+    built = NeighborIndex.load_or_build(embeddings, vocabulary, {}, index_dir=index_dir)
+    saved_time = os.stat(f"{index_dir}/manifest.json").st_mtime_ns
+    loaded = NeighborIndex.load_or_build(embeddings, vocabulary, {}, index_dir=index_dir)
+    assert os.stat(f"{index_dir}/manifest.json").st_mtime_ns == saved_time
+    assert loaded.words == built.words
+    assert np.array_equal(loaded.vectors_norm, built.vectors_norm)
+
+    rebuilt = NeighborIndex.load_or_build(embeddings, dict(list(vocabulary.items())[:5]), {}, index_dir=index_dir)
+    assert len(rebuilt.words) == 5
@@ -0,0 +1,41 @@
+import numpy as np
+
+from control_index import ControlCandidateIndex
+
+
+def reference_pairing(neologisms, frequencies_modern, candidate_controls, frequencies_historical):
+    # Quadratic scan of the original analysis: the first remaining candidate within the constraints
+    candidate_controls = list(candidate_controls)
+    pairs = {}
+    for neologism in neologisms:
+        neologism_freq = frequencies_modern.get(neologism, 0)
+        for control in candidate_controls:
+            control_freq = frequencies_historical.get(control, 0)
+            if control_freq == 0:
+                continue
+            freq_ratio = neologism_freq / control_freq
+            if abs(len(neologism) - len(control)) < 2 and 0.75 < freq_ratio < 1.33:
+                pairs[neologism] = control
+                candidate_controls.remove(control)
+                break
+    return pairs
+
+
+def test_control_index_matches_quadratic_scan():
+    rng = np.random.RandomState(0)
+    candidate_controls = [f"c{'x' * rng.randint(0, 6)}{i}" for i in range(200)]
+    # Few distinct frequencies, so that ratios fall exactly on the bounds
+    frequencies_historical = {control: int(rng.choice([0, 3, 4, 75, 100, 133, 250])) for control in candidate_controls}
+    neologisms = [f"n{'y' * rng.randint(0, 6)}{i}" for i in range(300)]
+    frequencies_modern = {neologism: int(rng.choice([3, 4, 75, 100, 133, 200])) for neologism in neologisms}
+
+    candidate_index = ControlCandidateIndex(candidate_controls, frequencies_historical)
+    pairs = {}
+    for neologism in neologisms:
+        control = candidate_index.pop_control(len(neologism), frequencies_modern[neologism])
+        if control is not None:
+            pairs[neologism] = control
+    expected = reference_pairing(neologisms, frequencies_modern, candidate_controls, frequencies_historical)
+    assert len(expected) > 100
+    assert len(expected) < len(neologisms)
+    assert list(pairs.items()) == list(expected.items())
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+import extract_neighborhood_stats
+from extract_neighborhood_stats import NeighborhoodStats
+from neighbor_search import normalize_rows
+from test_utils import reference_neighborhood_stats
+from utils import COSINE_RADIUS_RANGE, EUCLIDEAN_RADIUS_RANGE
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files")
+
+
+def make_stats(distance, num_pairs=30, seed=0):
+    rng = np.random.RandomState(seed)
+    num_radii = len(COSINE_RADIUS_RANGE if distance == "cosine" else EUCLIDEAN_RADIUS_RANGE)
+    pair_stats = []
+    for i in range(num_pairs):
+        density = [np.sort(rng.randint(0, 20, num_radii)) for _ in range(2)]
+        growth = [np.where(d > 0, rng.uniform(-1, 1, num_radii), np.nan) for d in density]
+        pair_stats.append((f"neologism-{i}", density[0], growth[0], f"control{i}", density[1], growth[1]))
+    # One more pair than the table has rows for, as for a pair with a word missing from the embeddings
+    return NeighborhoodStats.from_pairs(distance, num_pairs + 1, pair_stats)
+
+
+def assert_same_stats(stats, expected):
+    assert stats.distance == expected.distance
+    assert stats.num_pairs == expected.num_pairs
+    assert list(stats.words) == list(expected.words)
+    assert stats.is_neologism.tolist() == expected.is_neologism.tolist()
+    assert stats.density.dtype == np.int64 and stats.density.tolist() == expected.density.tolist()
+    # Bitwise equal, including the NaNs of the empty neighborhoods
+    assert stats.growth.dtype == np.float64 and stats.growth.tobytes() == expected.growth.tobytes()
+
+
+def test_stats_npz_round_trip(tmp_path):
+    for distance in ["cosine", "euclidean"]:
+        stats = make_stats(distance)
+        assert np.isnan(stats.growth).any()
+        stats.save(str(tmp_path / f"stats.{distance}.npz"))
+        assert_same_stats(NeighborhoodStats.load(str(tmp_path / f"stats.{distance}.npz")), stats)
+
+    empty_stats = NeighborhoodStats.from_pairs("cosine", 2, [])
+    empty_stats.save(str(tmp_path / "empty.npz"))
+    assert_same_stats(NeighborhoodStats.load(str(tmp_path / "empty.npz")), empty_stats)
+
+
+def test_stats_text_round_trip(tmp_path):
+    stats = make_stats("cosine")
+    stats.write_text(str(tmp_path / "density.tsv"), str(tmp_path / "growth.tsv"))
+    assert_same_stats(NeighborhoodStats.read_text("cosine", stats.num_pairs, str(tmp_path / "density.tsv"),
+                                                  str(tmp_path / "growth.tsv")), stats)
+
+    # The published statistics are written back as they are
+    stats = NeighborhoodStats.read_text("cosine", 720, f"{FILES_DIR}/density.stable.tsv",
+                                        f"{FILES_DIR}/growth.stable.tsv")
+    stats.save(str(tmp_path / "stats.npz"))
+    NeighborhoodStats.load(str(tmp_path / "stats.npz")).write_text(str(tmp_path / "density.stable.tsv"),
+                                                                   str(tmp_path / "growth.stable.tsv"))
+    for name in ["density.stable.tsv", "growth.stable.tsv"]:
+        with open(f"{FILES_DIR}/{name}") as expected, open(tmp_path / name) as written:
+            assert written.read() == expected.read()
+
+
+def test_stats_summary_matches_means(tmp_path):
+    stats = make_stats("cosine")
+    summary = stats.summarize()
+    mean_neologism_growth, mean_control_growth = summary.mean_growth()
+    assert np.allclose(summary.mean_neologism_density, stats.density[stats.is_neologism].sum(axis=0) / stats.num_pairs)
+    assert np.allclose(summary.mean_control_density, stats.density[~stats.is_neologism].sum(axis=0) / stats.num_pairs)
+    assert np.allclose(mean_neologism_growth, np.nanmean(stats.growth[stats.is_neologism], axis=0))
+    assert np.allclose(mean_control_growth, np.nanmean(stats.growth[~stats.is_neologism], axis=0))
+
+
+def test_cosine_stats_match_neighbor_lists(synthetic_analysis, tmp_path):
+    ns = synthetic_analysis.ns
+    embeddings = ns.embeddings
+    pairs = synthetic_analysis.ws.pair_neologisms_with_controls(
+        synthetic_analysis.frequency_growth_dict, synthetic_analysis.neologism_list, str(tmp_path / "pairs.tsv"),
+        stability_constraint=False, seed=0)
+    stats = ns.compute_neighborhood_stats_cosine(pairs, str(tmp_path / "density.tsv"), str(tmp_path / "growth.tsv"))
+
+    # Neighbor lists of the original analysis: all historical words by similarity, without the word itself
+    # and the words outside the vocabulary
+    spearmanr_dict = {word: float(growth) for word, growth in synthetic_analysis.frequency_growth_dict.items()}
+    for word, is_neologism, density, growth in zip(stats.words, stats.is_neologism, stats.density, stats.growth):
+        vector = embeddings.modern_projected_vectors[embeddings.modern_index[word]] if is_neologism \
+            else embeddings.historical_vectors[embeddings.historical_index[word]]
+        similarities = normalize_rows(vector[np.newaxis, :]).dot(np.asarray(embeddings.historical_vectors_norm).T)[0]
+        neighbors = [(embeddings.historical_words[i], similarities[i]) for i in np.argsort(-similarities, kind='stable')
+                     if embeddings.historical_words[i] in synthetic_analysis.vocabulary
+                     and embeddings.historical_words[i] != word]
+        expected_density, expected_growth = reference_neighborhood_stats(neighbors, spearmanr_dict, stats.radius_range)
+        assert density.tolist() == expected_density.tolist()
+        # The means are taken from cumulative sums, which may differ from np.mean in the last bits
+        assert np.allclose(growth, expected_growth, rtol=1e-12, atol=1e-15, equal_nan=True)
+    assert (stats.density > 0).any()
+
+
+def test_pooled_cosine_stats_match_serial_stats(synthetic_analysis, tmp_path, monkeypatch):
+    # Small blocks, so that every worker gets several of them
+    monkeypatch.setattr(extract_neighborhood_stats, "NEIGHBOR_QUERY_BLOCK_SIZE", 2)
+    pairs = synthetic_analysis.ws.pair_neologisms_with_controls(
+        synthetic_analysis.frequency_growth_dict, synthetic_analysis.neologism_list, str(tmp_path / "pairs.tsv"),
+        stability_constraint=False, seed=0)
+    assert len(pairs) > 3 * 2
+
+    outputs = []
+    for workers in [1, 3]:
+        density_filename, growth_filename = str(tmp_path / f"density.{workers}.tsv"), \
+            str(tmp_path / f"growth.{workers}.tsv")
+        synthetic_analysis.ns.compute_neighborhood_stats_cosine(pairs, density_filename, growth_filename,
+                                                                workers=workers)
+        with open(density_filename, 'rb') as density_fin, open(growth_filename, 'rb') as growth_fin:
+            outputs.append((density_fin.read(), growth_fin.read()))
+    assert outputs[1] == outputs[0]
+
+
+def test_batched_neighbors_match_per_word_neighbors(synthetic_analysis):
+    ns = synthetic_analysis.ns
+    embeddings = ns.embeddings
+    words = list(synthetic_analysis.vocabulary)[:10] + ["missingword"] + list(synthetic_analysis.vocabulary)[10:17]
+    for use_modern_projected in [True, False]:
+        # Blocks of 4 words, the last one shorter
+        batch = ns.fetch_neighbors_cosine_batch(words, 25, use_modern_projected, block_size=4)
+        assert batch[10] is None
+        for word, neighbors in zip(words, batch):
+            if word == "missingword":
+                continue
+            vector = normalize_rows(ns.get_vector(word, use_modern_projected)[np.newaxis, :])
+            similarities = vector.dot(np.asarray(embeddings.historical_vectors_norm).T)[0]
+            expected = [(embeddings.historical_words[i], similarities[i]) for i in np.argsort(-similarities)
+                        if embeddings.historical_words[i] in synthetic_analysis.vocabulary
+                        and embeddings.historical_words[i] != word][:25]
+            assert [neighbor for neighbor, _ in neighbors] == [neighbor for neighbor, _ in expected]
+            assert np.allclose([similarity for _, similarity in neighbors],
+                               [similarity for _, similarity in expected], atol=1e-6)
+            # Querying the word alone gives the same neighbors (the similarities may differ in the last bits)
+            single = ns.fetch_neighbors_cosine(word, 25, use_modern_projected)
+            assert [neighbor for neighbor, _ in single] == [neighbor for neighbor, _ in neighbors]
+            assert np.allclose([similarity for _, similarity in single],
+                               [similarity for _, similarity in neighbors], atol=1e-6)
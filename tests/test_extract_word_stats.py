@@ -0,0 +1,93 @@
+import os
+import numpy as np
+
+import extract_word_stats
+from extract_word_stats import WordStatsExtractor
+from benchmark_pipeline import generate_vocabulary, generate_corpus
+
+
+def make_corpus(data_dir, num_words=200, seed=0):
+    rng = np.random.default_rng(seed)
+    words = generate_vocabulary(num_words, rng)
+    with open(f"{data_dir}/vocabulary.txt", 'w') as fout:
+        fout.writelines(f"{word}\n" for word in words)
+    ws = WordStatsExtractor(f"{data_dir}/historical", f"{data_dir}/modern")
+    for data_split in ["historical", "modern"]:
+        corpus_dir, subdirs = ws.get_data_subdirs(data_split)
+        generate_corpus(corpus_dir, subdirs, words, data_split, 3, 300, rng)
+    return {word: '' for word in words}
+
+
+def extract(data_dir, vocabulary, **kwargs):
+    ws = WordStatsExtractor(f"{data_dir}/historical", f"{data_dir}/modern", **kwargs)
+    for data_split in ["historical", "modern"]:
+        ws.extract_frequencies(vocabulary, data_split, vocabulary_path=f"{data_dir}/vocabulary.txt")
+    return ws
+
+
+def assert_same_frequencies(ws, expected):
+    for table, expected_table in [(ws.frequency_table_historical, expected.frequency_table_historical),
+                                  (ws.frequency_table_modern, expected.frequency_table_modern)]:
+        assert table.words == expected_table.words
+        assert table.columns == expected_table.columns
+        assert table.matrix.tobytes() == expected_table.matrix.tobytes()
+    # Same forms and counts, in the same order
+    assert [(word, list(counter.items())) for word, counter in ws.capitalization_counter_dict.items()] == \
+        [(word, list(counter.items())) for word, counter in expected.capitalization_counter_dict.items()]
+
+
+def test_pooled_frequencies_match_serial_frequencies(tmp_path):
+    vocabulary = make_corpus(str(tmp_path))
+    serial = extract(str(tmp_path), vocabulary)
+    pooled = extract(str(tmp_path), vocabulary, workers=3)
+    assert len(serial.frequency_table_historical.words) > 0
+    assert len(serial.capitalization_counter_dict) > 0
+    assert_same_frequencies(pooled, serial)
+
+
+def test_frequency_cache(tmp_path, monkeypatch):
+    vocabulary = make_corpus(str(tmp_path))
+    cache_dir = str(tmp_path / "cache")
+    expected = extract(str(tmp_path), vocabulary, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # An unchanged corpus is not counted again
+    count_file = extract_word_stats._count_file
+    counted_files = []
+
+    def counting_count_file(filename, *args):
+        counted_files.append(filename)
+        return count_file(filename, *args)
+
+    monkeypatch.setattr(extract_word_stats, "_count_file", counting_count_file)
+    assert_same_frequencies(extract(str(tmp_path), vocabulary, cache_dir=cache_dir), expected)
+    assert counted_files == []
+
+    ws = WordStatsExtractor(f"{tmp_path}/historical", f"{tmp_path}/modern", cache_dir=cache_dir)
+    cache_path = ws.get_frequency_cache_path("historical", f"{tmp_path}/vocabulary.txt")
+    modern_cache_path = ws.get_frequency_cache_path("modern", f"{tmp_path}/vocabulary.txt")
+    corpus_file = f"{tmp_path}/historical/1900s/1900s_0.txt"
+
+    # Changing the modification time, the size of a corpus file or the vocabulary changes the cache path
+    stat = os.stat(corpus_file)
+    os.utime(corpus_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    mtime_cache_path = ws.get_frequency_cache_path("historical", f"{tmp_path}/vocabulary.txt")
+    assert mtime_cache_path != cache_path
+    with open(corpus_file, 'a') as fout:
+        fout.write(f"{next(iter(vocabulary))}\n")
+    size_cache_path = ws.get_frequency_cache_path("historical", f"{tmp_path}/vocabulary.txt")
+    assert size_cache_path not in [cache_path, mtime_cache_path]
+    assert ws.get_frequency_cache_path("modern", f"{tmp_path}/vocabulary.txt") == modern_cache_path
+
+    # The changed split is counted again, and its stale cache is replaced
+    updated = extract(str(tmp_path), vocabulary, cache_dir=cache_dir)
+    assert sorted(counted_files) == sorted(f"{tmp_path}/historical/{subdir}/{subdir}_{i}.txt"
+                                           for subdir in ws.get_data_subdirs("historical")[1] for i in range(3))
+    assert sorted(os.listdir(cache_dir)) == sorted([os.path.basename(size_cache_path),
+                                                    os.path.basename(modern_cache_path)])
+    word = next(iter(vocabulary))
+    assert updated.frequency_table_historical["1900s"][word] > expected.frequency_table_historical["1900s"][word]
+
+    with open(f"{tmp_path}/vocabulary.txt", 'a') as fout:
+        fout.write("newword\n")
+    assert ws.get_frequency_cache_path("modern", f"{tmp_path}/vocabulary.txt") != modern_cache_path
@@ -0,0 +1,40 @@
+import numpy as np
+from collections import Counter
+
+from utils import Utils
+from frequency_table import FrequencyTable
+from extract_word_stats import WordStatsExtractor
+
+
+def test_from_counts_matches_normalize():
+    counts_dict = {"1810s": Counter({"apple": 2, "pear": 1}), "1820s": Counter({"pear": 4}),
+                   "total": Counter({"apple": 2, "pear": 5})}
+    num_tokens_dict = {"1810s": 7, "1820s": 9, "total": 16}
+    table = FrequencyTable.from_counts(counts_dict, num_tokens_dict, ["apple", "pear"])
+    for column, counts in counts_dict.items():
+        assert dict(table[column]) == Utils.normalize(counts, num_tokens_dict[column])
+
+
+def test_from_counts_column_without_tokens():
+    counts_dict = {"1810s": Counter({"apple": 2}), "1820s": Counter(), "total": Counter({"apple": 2})}
+    num_tokens_dict = {"1810s": 5, "1820s": 0, "total": 5}
+    table = FrequencyTable.from_counts(counts_dict, num_tokens_dict, ["apple"])
+    assert table.column("1820s").tolist() == [0.0]
+    assert dict(table["1820s"]) == {}
+
+
+def test_frequency_growth_with_empty_decade(tmp_path):
+    # One decade only contains an empty file, which must not wipe out the frequency growth rates
+    rng = np.random.RandomState(0)
+    vocabulary = {f"word{i}": '' for i in range(20)}
+    ws = WordStatsExtractor(str(tmp_path), str(tmp_path))
+    _, subdirs = ws.get_data_subdirs("historical")
+    for k, subdir in enumerate(subdirs):
+        (tmp_path / subdir).mkdir()
+        text = "" if k == 3 else " ".join(rng.choice(list(vocabulary) + ["the", "a"], size=200))
+        (tmp_path / subdir / "text.txt").write_text(text + "\n")
+
+    ws.extract_frequencies(vocabulary, data_split="historical")
+    frequency_growth_dict = ws.extract_frequency_growth(vocabulary, str(tmp_path / "freq_growth.tsv"))
+    assert len(frequency_growth_dict) == len(vocabulary)
+    assert not np.isnan(list(frequency_growth_dict.values())).any()
@@ -0,0 +1,115 @@
+import numpy as np
+from scipy import optimize, special
+
+from glm import LogisticGLMFits, NeighborhoodGLMs
+
+
+def make_data(num_rows, seed):
+    rng = np.random.RandomState(seed)
+    predictors = np.stack([rng.poisson(200, num_rows).astype(np.float64), rng.uniform(-1, 1, num_rows)], axis=1)
+    probabilities = special.expit(-1 + 0.004 * predictors[:, 0] + 3 * predictors[:, 1])
+    response = (rng.uniform(size=num_rows) < probabilities).astype(np.float64)
+    return predictors, response
+
+
+def reference_fit(predictors, response):
+    # Maximum likelihood estimates found by a general-purpose optimizer, and standard errors from the Fisher information
+    x = np.column_stack([np.ones(len(response)), predictors])
+
+    def negative_log_likelihood(coefficients):
+        eta = x @ coefficients
+        return np.sum(np.logaddexp(0, eta) - response * eta), x.T @ (special.expit(eta) - response)
+
+    result = optimize.minimize(negative_log_likelihood, np.zeros(x.shape[1]), jac=True, method='BFGS',
+                               options={'gtol': 1e-10, 'maxiter': 10000})
+    mu = special.expit(x @ result.x)
+    standard_errors = np.sqrt(np.diag(np.linalg.inv(x.T @ (x * (mu * (1 - mu))[:, np.newaxis]))))
+    r_squared = 1 - np.sum((response - mu) ** 2) / np.sum((response - response.mean()) ** 2)
+    return result.x, standard_errors, r_squared
+
+
+def test_logistic_glm_fits_match_reference_fits():
+    num_rows = 300
+    predictors = []
+    responses = []
+    masks = []
+    for seed, num_used in enumerate([300, 250, 120]):
+        model_predictors, model_response = make_data(num_rows, seed)
+        predictors.append(model_predictors)
+        responses.append(model_response)
+        mask = np.zeros(num_rows, dtype=bool)
+        mask[np.random.RandomState(seed).permutation(num_rows)[:num_used]] = True
+        masks.append(mask)
+    fits = LogisticGLMFits(np.array(predictors), np.array(responses), np.array(masks))
+    assert fits.converged.all()
+
+    for model, (model_predictors, model_response, mask) in enumerate(zip(predictors, responses, masks)):
+        coefficients, standard_errors, r_squared = reference_fit(model_predictors[mask], model_response[mask])
+        assert fits.num_observations[model] == mask.sum()
+        assert np.allclose(fits.coefficients[model], coefficients, rtol=1e-5, atol=1e-8)
+        assert np.allclose(fits.standard_errors[model], standard_errors, rtol=1e-5)
+        assert np.isclose(fits.r_squared[model], r_squared, rtol=1e-6)
+
+        # The batched fit is the same as fitting the model alone
+        single_fit = LogisticGLMFits(model_predictors[mask][np.newaxis], model_response[mask],
+                                     np.ones((1, mask.sum()), dtype=bool))
+        assert np.allclose(fits.coefficients[model], single_fit.coefficients[0], rtol=1e-10)
+        assert np.allclose(fits.standard_errors[model], single_fit.standard_errors[0], rtol=1e-10)
+
+
+def test_logistic_glm_fit_of_a_binary_predictor():
+    # With a single binary predictor, the estimates are the log odds of the two groups, and the variances are
+    # the inverses of the summed binomial variances (1 / (n p (1 - p))), so the fit is known in closed form
+    x = np.array([0] * 10 + [1] * 20, dtype=np.float64)
+    y = np.array([1] * 2 + [0] * 8 + [1] * 15 + [0] * 5, dtype=np.float64)
+    fits = LogisticGLMFits(x[np.newaxis, :, np.newaxis], y, np.ones((1, len(x)), dtype=bool))
+    assert fits.converged.all()
+
+    intercept_variance = 1 / (10 * 0.2 * 0.8)
+    slope_variance = intercept_variance + 1 / (20 * 0.75 * 0.25)
+    assert np.allclose(fits.coefficients[0], [np.log(0.2 / 0.8), np.log(0.75 / 0.25) - np.log(0.2 / 0.8)],
+                       rtol=1e-8)
+    assert np.allclose(fits.standard_errors[0], np.sqrt([intercept_variance, slope_variance]), rtol=1e-8)
+
+
+def test_duplicated_rows_shrink_standard_errors_by_square_root_of_two():
+    # The data once (padded to 400 rows) and every row twice, fitted together
+    predictors, response = make_data(200, 5)
+    doubled_predictors = np.concatenate([predictors, predictors])
+    doubled_response = np.concatenate([response, response])
+    mask = np.ones((2, 400), dtype=bool)
+    mask[0, 200:] = False
+    fits = LogisticGLMFits(np.array([doubled_predictors, doubled_predictors]),
+                           np.array([doubled_response, doubled_response]), mask)
+    assert fits.converged.all()
+    assert np.allclose(fits.coefficients[1], fits.coefficients[0], rtol=1e-8)
+    assert np.allclose(fits.standard_errors[0] / fits.standard_errors[1], np.sqrt(2), rtol=1e-8)
+
+
+def test_models_with_too_few_rows_are_not_fitted():
+    predictors, response = make_data(10, 0)
+    mask = np.zeros((1, 10), dtype=bool)
+    mask[0, :3] = True
+    fits = LogisticGLMFits(predictors[np.newaxis], response, mask)
+    assert np.isnan(fits.coefficients).all()
+    assert np.isnan(fits.standard_errors).all()
+    assert np.isnan(fits.adjusted_r_squared).all()
+
+
+def test_neighborhood_glms_leave_out_empty_neighborhoods():
+    radius_range = [0.5, 0.4]
+    num_words = 200
+    predictors, is_neologism = make_data(num_words, 3)
+    density = np.stack([predictors[:, 0] // 4, predictors[:, 0]], axis=1)
+    growth = np.stack([predictors[:, 1], predictors[:, 1]], axis=1)
+    growth[:40, 0] = np.nan
+    glms = NeighborhoodGLMs([("stable", is_neologism.astype(bool), density, growth)], radius_range)
+
+    # Largest neighborhoods first
+    results = glms.get_results(0)
+    assert [radius for radius, _, _ in results] == [0.4, 0.5]
+    for radius_index in range(len(radius_range)):
+        used = ~np.isnan(growth[:, radius_index])
+        coefficients, _, _ = reference_fit(np.column_stack([density[used, radius_index], growth[used, radius_index]]),
+                                           is_neologism[used])
+        assert np.allclose(glms.fits.coefficients[radius_index], coefficients, rtol=1e-5, atol=1e-8)
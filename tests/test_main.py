@@ -0,0 +1,38 @@
+import os
+import numpy as np
+
+import main
+from extract_neighborhood_stats import NeighborhoodStats
+
+
+def read_outputs(output_dir):
+    # Text outputs as they are, statistics tables as arrays (the .npz archives hold the time they were written)
+    outputs = {}
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith(".npz"):
+            stats = NeighborhoodStats.load(f"{output_dir}/{name}")
+            outputs[name] = (list(stats.words), stats.is_neologism.tolist(), stats.density.tolist(),
+                             stats.growth.tobytes())
+        else:
+            with open(f"{output_dir}/{name}") as fin:
+                outputs[name] = fin.read()
+    return outputs
+
+
+def test_sweep_workers_match_serial_sweep(synthetic_analysis, tmp_path, monkeypatch):
+    outputs = []
+    for workers in [1, 2]:
+        output_dir = tmp_path / f"workers{workers}"
+        output_dir.mkdir()
+        monkeypatch.chdir(output_dir)
+        main.run_sweep(synthetic_analysis.ws, synthetic_analysis.ns, synthetic_analysis.frequency_growth_dict,
+                       synthetic_analysis.neologism_list, [0, 1], workers, plot=False)
+        outputs.append(read_outputs("files"))
+
+    serial_outputs, pooled_outputs = outputs
+    # Pairs, statistics, density, growth, summary and GLM input of both control sets of both seeds
+    assert len(serial_outputs) == 4 * 6
+    assert pooled_outputs == serial_outputs
+    assert serial_outputs["pairs.stable.seed0.tsv"] != ""
+    # The seeds give different relaxed control sets
+    assert serial_outputs["pairs.relaxed.seed0.tsv"] != serial_outputs["pairs.relaxed.seed1.tsv"]
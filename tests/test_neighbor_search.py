@@ -0,0 +1,123 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from neighbor_search import *
+from utils import COSINE_RADIUS_RANGE, EUCLIDEAN_RADIUS_RANGE
+
+
+def float32_neighbors(value, count=3):
+    # float32 values next to value: the closest one and count values above and below it
+    values = [np.float32(value)]
+    for direction in [np.inf, -np.inf]:
+        current = np.float32(value)
+        for _ in range(count):
+            current = np.nextafter(current, np.float32(direction))
+            values.append(current)
+    return np.array(values, dtype=np.float32)
+
+
+def test_float32_threshold_matches_double_comparison():
+    for radius in COSINE_RADIUS_RANGE:
+        threshold = float32_threshold(radius)
+        assert threshold.dtype == np.float32
+        values = float32_neighbors(radius)
+        assert np.array_equal(values >= threshold, values.astype(np.float64) >= radius)
+
+
+def test_range_search_at_radius_boundaries():
+    # Similarities to the first unit vector are exactly the first coordinates of the rows
+    similarities = np.concatenate([float32_neighbors(radius) for radius in COSINE_RADIUS_RANGE])
+    matrix = np.zeros((len(similarities), 3), dtype=np.float32)
+    matrix[:, 0] = similarities
+    matrix[:, 1] = np.sqrt(1 - similarities.astype(np.float64) ** 2)
+    query = np.array([[1, 0, 0]], dtype=np.float32)
+    for radius in COSINE_RADIUS_RANGE:
+        [(rows, hit_similarities)] = cosine_range_search(query, matrix, radius, block_size=5)
+        expected_rows = np.flatnonzero(similarities.astype(np.float64) >= radius)
+        assert np.array_equal(np.sort(rows), expected_rows)
+        assert np.array_equal(hit_similarities, similarities[rows])
+
+
+def test_range_search_matches_top_k():
+    rng = np.random.RandomState(0)
+    matrix = rng.randn(500, 8).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    queries = rng.randn(20, 8).astype(np.float32)
+    exclude_rows = rng.randint(-1, 500, size=20)
+    # Top-N search of all rows, cut at the radius as the original analysis cut the top 5000 neighbors
+    top_rows, top_similarities = cosine_top_k(queries, matrix, len(matrix), exclude_rows)
+    for radius in [0.3, 0.55]:
+        results = cosine_range_search(queries, matrix, radius, exclude_rows, block_size=64)
+        for (rows, similarities), query_top_rows, query_top_similarities in zip(results, top_rows, top_similarities):
+            within = query_top_similarities.astype(np.float64) >= radius
+            assert np.array_equal(rows, query_top_rows[within])
+            assert np.allclose(similarities, query_top_similarities[within], rtol=1e-6)
+
+
+def make_clustered_matrix(num_rows=2000, dimension=16, num_clusters=40, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(num_clusters, dimension)
+    matrix = (centers[rng.randint(num_clusters, size=num_rows)] + 0.5 * rng.randn(num_rows, dimension))
+    matrix = matrix.astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True), rng
+
+
+def test_ivf_probing_all_lists_is_exact():
+    matrix, rng = make_clustered_matrix()
+    queries = matrix[rng.choice(len(matrix), 30, replace=False)]
+    exclude_rows = rng.randint(-1, len(matrix), size=30)
+    ivf = IVFSearch(num_lists=20, num_probes=20).fit(matrix)
+
+    rows, similarities = ivf.search(queries, 10, exclude_rows)
+    top_rows, top_similarities = cosine_top_k(queries, matrix, 10, exclude_rows)
+    for query_rows, query_top_rows in zip(rows, top_rows):
+        assert np.array_equal(query_rows, query_top_rows)
+    for (query_rows, _), (range_rows, _) in zip(ivf.range_search(queries, 0.6, exclude_rows),
+                                                cosine_range_search(queries, matrix, 0.6, exclude_rows)):
+        assert np.array_equal(query_rows, range_rows)
+
+
+def test_ivf_recall():
+    matrix, rng = make_clustered_matrix()
+    queries = matrix[rng.choice(len(matrix), 100, replace=False)]
+    top_rows, _ = cosine_top_k(queries, matrix, 10)
+    recalls = []
+    for num_probes in [1, IVF_DEFAULT_PROBES]:
+        rows, _ = IVFSearch(num_lists=45, num_probes=num_probes).fit(matrix).search(queries, 10)
+        recalls.append(np.mean([len(np.intersect1d(query_rows, query_top_rows)) / 10
+                                for query_rows, query_top_rows in zip(rows, top_rows)]))
+    # More probes find more of the exact neighbors, and the default finds almost all of them
+    assert recalls[0] < recalls[1]
+    assert recalls[1] >= 0.95
+
+
+def test_euclidean_profiles_match_cdist():
+    rng = np.random.RandomState(0)
+    radius_range = EUCLIDEAN_RADIUS_RANGE[::-1]
+    matrix = (1.2 * rng.randn(1000, 4)).astype(np.float32)
+    queries = (1.2 * rng.randn(15, 4)).astype(np.float32)
+    # A query far from all rows, with empty neighborhoods
+    queries[0] = 8
+    # Distances of the original analysis, in double precision
+    distances = cdist(queries.astype(np.float64), matrix.astype(np.float64))
+    # Rows close enough to a radius for their float32 distances to fall on the other side of it are left out
+    kept = np.min(np.abs(distances[..., np.newaxis] - radius_range), axis=(0, 2)) > 1e-3
+    matrix, distances = matrix[kept], distances[:, kept]
+    growth = np.where(rng.rand(len(matrix)) < 0.7, rng.uniform(-1, 1, len(matrix)), np.nan)
+    exclude_rows = rng.randint(-1, len(matrix), size=15)
+
+    distances[np.flatnonzero(exclude_rows >= 0), exclude_rows[exclude_rows >= 0]] = np.inf
+    neighborhoods = distances[..., np.newaxis] < radius_range
+    expected_density = neighborhoods.sum(axis=1)
+    known_neighborhoods = neighborhoods & ~np.isnan(growth)[:, np.newaxis]
+    with np.errstate(invalid='ignore'):
+        expected_growth = np.einsum('qnr,n->qr', known_neighborhoods, np.nan_to_num(growth)) / \
+            known_neighborhoods.sum(axis=1)
+
+    # A budget of a few rows per block
+    density, mean_growth = euclidean_neighborhood_profiles(queries, matrix, radius_range, growth, exclude_rows,
+                                                           memory_budget=EUCLIDEAN_BYTES_PER_DISTANCE * 15 * 7)
+    assert np.array_equal(density, expected_density)
+    assert np.allclose(mean_growth, expected_growth, rtol=1e-12, equal_nan=True)
+    assert np.isnan(expected_growth).any()
+    assert (expected_density > 0).any()
@@ -0,0 +1,30 @@
+import os
+import pytest
+
+import output_files
+from output_files import atomic_output
+
+
+def test_atomic_output_replaces_file(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(output_files.os, "fsync", lambda fd: synced.append(fd))
+    path = str(tmp_path / "files" / "pairs.tsv")
+    with atomic_output(path) as fout:
+        fout.writelines(f"word{i}\tcontrol{i}\n" for i in range(1000))
+        # Nothing is visible at the output path until the content is complete
+        assert not os.path.exists(path)
+    assert len(synced) == 1
+    assert open(path).read() == "".join(f"word{i}\tcontrol{i}\n" for i in range(1000))
+    assert os.listdir(tmp_path / "files") == ["pairs.tsv"]
+
+
+def test_atomic_output_keeps_previous_file_on_failure(tmp_path):
+    path = str(tmp_path / "density.tsv")
+    with atomic_output(path) as fout:
+        fout.write("complete\n")
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_output(path) as fout:
+            fout.write("partial")
+            raise KeyboardInterrupt
+    assert open(path).read() == "complete\n"
+    assert os.listdir(tmp_path) == ["density.tsv"]
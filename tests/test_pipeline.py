@@ -0,0 +1,128 @@
+import os
+import pytest
+
+import extract_neighborhood_stats
+from pipeline import Stage, Pipeline
+
+
+def make_pipeline(tmp_path, runs, scale=2):
+    def write(path, text):
+        with open(path, 'w') as fout:
+            fout.write(text)
+
+    def read(path):
+        with open(path) as fin:
+            return fin.read()
+
+    def numbers():
+        runs.append("numbers")
+        write(f"{tmp_path}/numbers.txt", read(f"{tmp_path}/input.txt"))
+        return read(f"{tmp_path}/numbers.txt")
+
+    def scaled(numbers):
+        runs.append("scaled")
+        write(f"{tmp_path}/scaled.txt", " ".join(str(scale * int(x)) for x in numbers.split()))
+        return read(f"{tmp_path}/scaled.txt")
+
+    def total(scaled):
+        runs.append("total")
+        write(f"{tmp_path}/total.txt", str(sum(int(x) for x in scaled.split())))
+        return read(f"{tmp_path}/total.txt")
+
+    return Pipeline([
+        Stage("numbers", numbers, inputs=[f"{tmp_path}/input.txt"], outputs=[f"{tmp_path}/numbers.txt"],
+              load=lambda: read(f"{tmp_path}/numbers.txt")),
+        Stage("scaled", scaled, deps=["numbers"], params={"scale": scale}, outputs=[f"{tmp_path}/scaled.txt"],
+              load=lambda: read(f"{tmp_path}/scaled.txt")),
+        Stage("total", total, deps=["scaled"], outputs=[f"{tmp_path}/total.txt"],
+              load=lambda: read(f"{tmp_path}/total.txt")),
+    ], f"{tmp_path}/pipeline_state.json")
+
+
+def test_pipeline_skips_up_to_date_stages(tmp_path):
+    (tmp_path / "input.txt").write_text("1 2 3")
+    runs = []
+    make_pipeline(tmp_path, runs).run()
+    assert runs == ["numbers", "scaled", "total"]
+    assert (tmp_path / "total.txt").read_text() == "12"
+
+    runs.clear()
+    make_pipeline(tmp_path, runs).run()
+    assert runs == []
+
+    # A changed parameter runs the stage again, and the later stages since its output changed
+    make_pipeline(tmp_path, runs, scale=3).run()
+    assert runs == ["scaled", "total"]
+    assert (tmp_path / "total.txt").read_text() == "18"
+
+    # Input files are compared by content, not by modification time
+    runs.clear()
+    (tmp_path / "input.txt").write_text("1 2 3")
+    make_pipeline(tmp_path, runs, scale=3).run()
+    assert runs == []
+    (tmp_path / "input.txt").write_text("1 2 4")
+    make_pipeline(tmp_path, runs, scale=3).run()
+    assert runs == ["numbers", "scaled", "total"]
+
+    # A modified output runs the stage that wrote it again
+    runs.clear()
+    (tmp_path / "total.txt").write_text("0")
+    make_pipeline(tmp_path, runs, scale=3).run()
+    assert runs == ["total"]
+    assert (tmp_path / "total.txt").read_text() == "21"
+
+    runs.clear()
+    make_pipeline(tmp_path, runs, scale=3).run(from_stage="scaled")
+    assert runs == ["scaled", "total"]
+    runs.clear()
+    make_pipeline(tmp_path, runs, scale=3).run(only_stage="scaled")
+    assert runs == ["scaled"]
+    with pytest.raises(ValueError):
+        make_pipeline(tmp_path, runs).run(only_stage="unknown")
+
+
+def test_interrupted_neighborhood_stats_resume_from_checkpoint(synthetic_analysis, tmp_path, monkeypatch):
+    # Small blocks, so that the pairs are checkpointed several times
+    monkeypatch.setattr(extract_neighborhood_stats, "NEIGHBOR_QUERY_BLOCK_SIZE", 4)
+    ns = synthetic_analysis.ns
+    pairs = synthetic_analysis.ws.pair_neologisms_with_controls(
+        synthetic_analysis.frequency_growth_dict, synthetic_analysis.neologism_list, str(tmp_path / "pairs.tsv"),
+        stability_constraint=False, seed=0)
+    assert len(pairs) > 3 * 4
+    expected = ns.compute_neighborhood_stats_cosine(pairs, str(tmp_path / "expected_density.tsv"),
+                                                    str(tmp_path / "expected_growth.tsv"))
+
+    compute_block = extract_neighborhood_stats.NeighborhoodStatsExtractor.compute_pair_block_stats_cosine
+    num_blocks = []
+
+    def interrupted_compute_block(self, word_pairs):
+        num_blocks.append(len(word_pairs))
+        if len(num_blocks) == 3:
+            raise KeyboardInterrupt
+        return compute_block(self, word_pairs)
+
+    density_filename, growth_filename = str(tmp_path / "density.tsv"), str(tmp_path / "growth.tsv")
+    monkeypatch.setattr(extract_neighborhood_stats.NeighborhoodStatsExtractor, "compute_pair_block_stats_cosine",
+                        interrupted_compute_block)
+    with pytest.raises(KeyboardInterrupt):
+        ns.compute_neighborhood_stats_cosine(pairs, density_filename, growth_filename, checkpoint_key="key")
+    assert not os.path.exists(density_filename)
+
+    resumed_blocks = []
+
+    def resumed_compute_block(self, word_pairs):
+        resumed_blocks.append(len(word_pairs))
+        return compute_block(self, word_pairs)
+
+    monkeypatch.setattr(extract_neighborhood_stats.NeighborhoodStatsExtractor, "compute_pair_block_stats_cosine",
+                        resumed_compute_block)
+    stats = ns.compute_neighborhood_stats_cosine(pairs, density_filename, growth_filename, checkpoint_key="key")
+    # The two blocks done before the interruption are not computed again
+    assert len(resumed_blocks) == (len(pairs) + 3) // 4 - 2
+    assert (tmp_path / "density.tsv").read_text() == (tmp_path / "expected_density.tsv").read_text()
+    assert (tmp_path / "growth.tsv").read_text() == (tmp_path / "expected_growth.tsv").read_text()
+    assert list(stats.words) == list(expected.words)
+    assert stats.density.tolist() == expected.density.tolist()
+    assert stats.growth.tobytes() == expected.growth.tobytes()
+    # Only the output files are left
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("density")) == ["density.tsv"]
@@ -0,0 +1,61 @@
+import json
+import numpy as np
+
+from profiling import Profiler, profiler
+from glm import NeighborhoodGLMs
+
+
+def test_disabled_profiler_records_nothing():
+    disabled = Profiler()
+    with disabled.stage("stage"):
+        with disabled.loop("loop") as counter:
+            counter.add(items=3)
+    assert disabled.stages == [] and disabled.loops == {}
+
+
+def test_profiler_aggregates_loops_by_stage():
+    enabled = Profiler()
+    enabled.enable()
+    with enabled.stage("outer"):
+        for _ in range(3):
+            with enabled.loop("hot") as counter:
+                counter.add(files=1, tokens=100)
+        with enabled.stage("inner"):
+            with enabled.loop("hot") as counter:
+                counter.add(files=2)
+    with enabled.loop("standalone") as counter:
+        counter.add(rows=5)
+
+    report = json.loads(json.dumps(enabled.report()))
+    assert [stage["name"] for stage in report["stages"]] == ["outer"]
+    outer = report["stages"][0]
+    assert outer["loops"]["hot"]["calls"] == 3
+    assert outer["loops"]["hot"]["items"] == {"files": 3, "tokens": 300}
+    assert set(outer["loops"]["hot"]["throughput"]) == {"files_per_s", "tokens_per_s"}
+    # Nested stages are recorded under their parent, with their own loops, and included in its times
+    assert [stage["name"] for stage in outer["stages"]] == ["inner"]
+    assert outer["stages"][0]["loops"]["hot"]["items"] == {"files": 2}
+    assert outer["wall_time_s"] >= outer["stages"][0]["wall_time_s"]
+    assert report["loops"]["standalone"]["items"] == {"rows": 5}
+
+
+def test_profiled_glm_fit_is_reported(tmp_path, monkeypatch):
+    # The shared profiler, as enabled by main.py --profile, restored afterwards
+    for name, value in [("enabled", False), ("start_time", None), ("stages", []), ("loops", {}), ("_stack", [])]:
+        monkeypatch.setattr(profiler, name, value)
+    profiler.enable()
+
+    rng = np.random.RandomState(0)
+    density = rng.poisson(50, (100, 2)).astype(np.float64)
+    growth = rng.uniform(-1, 1, (100, 2))
+    growth[:10, 0] = np.nan
+    with profiler.stage("glm"):
+        NeighborhoodGLMs([("stable", rng.uniform(size=100) < 0.5, density, growth)], [0.5, 0.4])
+    profiler.save(str(tmp_path / "profile.json"))
+
+    with open(tmp_path / "profile.json") as fin:
+        report = json.load(fin)
+    loop = report["stages"][0]["loops"]["fit_logistic_glms"]
+    assert report["stages"][0]["name"] == "glm"
+    assert loop["calls"] == 1
+    assert loop["items"] == {"models": 2, "rows": 190}
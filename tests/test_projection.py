@@ -0,0 +1,55 @@
+import copy
+import types
+import numpy as np
+import pytest
+
+from projection import smart_procrustes_align_gensim, procrustes_align_keyed_vectors, intersect_vocabularies
+
+
+def make_wv(words, vectors):
+    # Plain stand-in for gensim's KeyedVectors, with the attributes used by the alignment
+    vocab = {word: types.SimpleNamespace(index=i, count=len(words) - i) for i, word in enumerate(words)}
+    return types.SimpleNamespace(vectors=vectors, vocab=vocab, index2word=list(words), vectors_norm=None)
+
+
+def make_vectors(num_words=40, dimension=6, seed=0):
+    rng = np.random.RandomState(seed)
+    base_vectors = rng.randn(num_words, dimension).astype(np.float32)
+    rotation, _ = np.linalg.qr(rng.randn(dimension, dimension))
+    other_vectors = (base_vectors.dot(rotation) + 0.1 * rng.randn(num_words, dimension)).astype(np.float32)
+    return base_vectors, other_vectors
+
+
+def test_alignment_matches_smart_procrustes():
+    # With identical vocabularies, the baseline does not need gensim to intersect them
+    words = [f"word{i}" for i in range(40)]
+    base_vectors, other_vectors = make_vectors()
+    base_model = types.SimpleNamespace(wv=make_wv(words, base_vectors))
+    other_model = types.SimpleNamespace(wv=make_wv(words, other_vectors.copy()))
+
+    expected = smart_procrustes_align_gensim(base_model, other_model).wv.vectors
+    aligned_wv, ortho = procrustes_align_keyed_vectors(make_wv(words, base_vectors), make_wv(words, other_vectors))
+
+    assert aligned_wv.vectors.dtype == np.float32
+    assert np.allclose(aligned_wv.vectors, expected, atol=1e-5)
+    assert np.allclose(ortho.dot(ortho.T), np.eye(len(ortho)), atol=1e-6)
+    # The alignment undoes the rotation up to the noise
+    assert np.abs(aligned_wv.vectors - base_vectors).max() < 0.5
+
+
+def test_alignment_with_shared_vocabulary_matches_smart_procrustes():
+    pytest.importorskip("gensim")
+    from benchmark_pipeline import make_keyed_vectors
+
+    base_vectors, other_vectors = make_vectors()
+    base_words = [f"word{i}" for i in range(40)]
+    other_words = [f"word{i}" for i in range(10, 40)] + [f"new{i}" for i in range(10)]
+    base_model = make_keyed_vectors(base_words, base_vectors)
+    other_model = make_keyed_vectors(other_words, other_vectors)
+
+    shared_words = intersect_vocabularies(base_model.wv, other_model.wv)
+    assert sorted(shared_words) == sorted(base_words[10:])
+    aligned_wv, _ = procrustes_align_keyed_vectors(base_model.wv, copy.copy(other_model.wv),
+                                                   common_vocab=shared_words)
+    expected = smart_procrustes_align_gensim(base_model, other_model).wv.vectors
+    assert np.allclose(aligned_wv.vectors, expected, atol=1e-5)
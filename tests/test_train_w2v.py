@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing
+import pytest
+
+train_w2v = pytest.importorskip("train_w2v", exc_type=ImportError)
+
+
+def simple_sent_tokenize(text):
+    # Stand-in for NLTK's sentence tokenizer, so that the test does not need the Punkt models
+    return [sentence for sentence in text.strip().split(" | ") if sentence]
+
+
+def test_preprocessed_sentences_match_raw_sentences(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_w2v, "sent_tokenize", simple_sent_tokenize)
+    data_path = tmp_path / "coha"
+    texts = ["Hello there. | <p> | A  double space | @ @ | The END",
+             "<P> | One more sentence",
+             "@"]
+    for i, dirname in enumerate(train_w2v.get_corpus_dirs("historical")):
+        (data_path / dirname).mkdir(parents=True)
+        for j, text in enumerate(texts[:1 + i % 3]):
+            # COHA files have the text on their third line
+            (data_path / dirname / f"{j}.txt").write_text(f"header\n\n{text}\n")
+
+    raw = list(train_w2v.CorpusSentences(str(data_path), "historical"))
+    preprocessed_path = tmp_path / "preprocessed"
+    preprocessed_path.mkdir()
+    for dirname in train_w2v.get_corpus_dirs("historical"):
+        train_w2v.preprocess_directory(str(data_path), dirname, "historical", f"{preprocessed_path}/{dirname}.txt")
+    preprocessed = list(train_w2v.PreprocessedSentences(str(preprocessed_path), "historical"))
+
+    assert [] in raw
+    assert preprocessed == raw
+
+
+def test_pooled_tokenization_keeps_file_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_w2v, "sent_tokenize", simple_sent_tokenize)
+    (tmp_path / "1990s").mkdir()
+    for i in range(23):
+        sentences = " | ".join(f"File {i} sentence {j}" for j in range(i % 4 + 1))
+        (tmp_path / "1990s" / f"{i}.txt").write_text(f"header\n\n{sentences}\n")
+
+    serial = list(train_w2v.read_directory_sentences(str(tmp_path), "1990s", "historical"))
+    # Forked, so that the workers use the stand-in tokenizer too
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        pooled = list(train_w2v.read_directory_sentences(str(tmp_path), "1990s", "historical", pool=pool,
+                                                         num_pending=3, files_per_chunk=2))
+    assert len(serial) == sum(i % 4 + 1 for i in range(23))
+    assert pooled == serial
+
+
+def write_corpus(data_path, text):
+    for dirname in train_w2v.get_corpus_dirs("historical"):
+        (data_path / dirname).mkdir(parents=True, exist_ok=True)
+        (data_path / dirname / "0.txt").write_text(f"header\n\n{text} {dirname}\n")
+
+
+def make_params(data_path, preprocessed_dirname, preprocess, tokenization_workers=2):
+    return argparse.Namespace(data_path=str(data_path), data_split="historical", model_dirname="models",
+                              preprocessed_dirname=str(preprocessed_dirname), preprocess=preprocess, size=10,
+                              window=2, min_count=1, tokenization_workers=tokenization_workers)
+
+
+def test_preprocessed_corpus_of_another_corpus_is_not_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_w2v, "sent_tokenize", simple_sent_tokenize)
+    write_corpus(tmp_path / "first", "First corpus")
+    write_corpus(tmp_path / "second", "Second corpus")
+
+    trainer = train_w2v.EmbeddingTrainer(make_params(tmp_path / "first", tmp_path / "corpora", True))
+    assert isinstance(trainer.sentences, train_w2v.PreprocessedSentences)
+    assert list(trainer.sentences)[0] == ["first", "corpus", "1810s"]
+    # Reused for the same corpus
+    trainer = train_w2v.EmbeddingTrainer(make_params(tmp_path / "first", tmp_path / "corpora", False))
+    assert list(trainer.sentences)[0] == ["first", "corpus", "1810s"]
+
+    # Preprocessed again for another corpus, or for a changed corpus file
+    trainer = train_w2v.EmbeddingTrainer(make_params(tmp_path / "second", tmp_path / "corpora", False))
+    assert list(trainer.sentences)[0] == ["second", "corpus", "1810s"]
+    (tmp_path / "second" / "1810s" / "0.txt").write_text("header\n\nChanged text\n")
+    trainer = train_w2v.EmbeddingTrainer(make_params(tmp_path / "second", tmp_path / "corpora", False))
+    assert list(trainer.sentences)[0] == ["changed", "text"]
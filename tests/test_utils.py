@@ -0,0 +1,97 @@
+import os
+import sys
+import subprocess
+import warnings
+import numpy as np
+from scipy import stats
+
+from utils import Utils, COSINE_RADIUS_RANGE
+
+
+def reference_neighborhood_stats(neighbors, spearmanr_dict, radius_range):
+    # Per-radius computation of the original analysis, from (word, similarity) lists sorted by similarity
+    density = []
+    growth = []
+    for r in radius_range:
+        neighbor_words = [w for w, d in neighbors if float(d) >= r]
+        density.append(len(neighbor_words))
+        filtered = [w for w in neighbor_words if w in spearmanr_dict]
+        growth.append(np.mean([spearmanr_dict[w] for w in filtered]) if len(filtered) > 0 else np.nan)
+    return np.array(density), np.array(growth)
+
+
+def test_neighborhood_profile_matches_reference():
+    rng = np.random.RandomState(0)
+    for num_neighbors in [0, 1, 50, 5000]:
+        words = [f"word{i}" for i in range(num_neighbors)]
+        similarities = np.sort(rng.uniform(0.2, 0.7, num_neighbors).astype(np.float32))[::-1]
+        # Neighbors exactly on the radii, which belong to the neighborhoods
+        similarities[::97] = np.float32(0.45)
+        similarities = np.sort(similarities)[::-1]
+        spearmanr_dict = {word: rng.uniform(-1, 1) for word in words if rng.rand() < 0.7}
+        growth = np.array([spearmanr_dict.get(word, np.nan) for word in words])
+
+        reference_density, reference_growth = \
+            reference_neighborhood_stats(list(zip(words, similarities)), spearmanr_dict, COSINE_RADIUS_RANGE)
+        density, mean_growth = Utils.neighborhood_profile(similarities, growth, COSINE_RADIUS_RANGE)
+        assert np.array_equal(density, reference_density)
+        assert np.allclose(mean_growth, reference_growth, rtol=1e-12, atol=1e-15, equal_nan=True)
+
+        # Bitwise equal, not only close
+        density, mean_growth = Utils.neighborhood_profile(similarities, growth, COSINE_RADIUS_RANGE, exact_means=True)
+        assert np.array_equal(density, reference_density)
+        assert np.array_equal(mean_growth, reference_growth, equal_nan=True)
+
+
+def test_neighborhood_profile_many_radii():
+    rng = np.random.RandomState(0)
+    similarities = np.sort(rng.uniform(0.2, 0.7, 10000))[::-1]
+    growth = np.where(rng.rand(10000) < 0.7, rng.uniform(-1, 1, 10000), np.nan)
+    radius_range = np.linspace(0.7, 0.2, 500)
+    density, mean_growth = Utils.neighborhood_profile(similarities, growth, radius_range)
+    exact_density, exact_mean_growth = Utils.neighborhood_profile(similarities, growth, radius_range,
+                                                                  exact_means=True)
+    assert np.array_equal(density, exact_density)
+    assert np.allclose(mean_growth, exact_mean_growth, rtol=1e-12, atol=1e-15, equal_nan=True)
+
+
+def test_rank_rows_matches_rankdata():
+    rng = np.random.RandomState(0)
+    # Small integer values, so that most rows have ties
+    matrix = rng.randint(0, 4, size=(200, 9)).astype(np.float64)
+    ranks = Utils.rank_rows(matrix)
+    for row, row_ranks in zip(matrix, ranks):
+        assert np.array_equal(row_ranks, stats.rankdata(row))
+
+
+def test_batch_spearmanr_matches_spearmanr():
+    rng = np.random.RandomState(0)
+    time_steps = np.arange(9)
+    matrix = np.concatenate([rng.randint(0, 4, size=(200, 9)), rng.poisson(50, size=(200, 9)),
+                             np.zeros((2, 9)), np.arange(9)[np.newaxis, :], np.arange(9)[np.newaxis, ::-1]])
+    frequencies = matrix / rng.randint(1000, 2000, size=9)
+    with warnings.catch_warnings():
+        # Constant rows, the correlation of which is undefined
+        warnings.simplefilter("ignore")
+        expected = [stats.spearmanr(time_steps, row) for row in frequencies]
+        correlations, pvalues = Utils.batch_spearmanr(time_steps, frequencies)
+    # Bitwise equal, as the frequency growth file prints them
+    assert [f"{corr}\t{pval}" for corr, pval in expected] == \
+        [f"{corr}\t{pval}" for corr, pval in zip(correlations, pvalues)]
+
+
+def test_main_does_not_load_heavy_modules():
+    # Plotting, training and t-SNE libraries are only imported where they are used
+    code = "import sys, main; print(*[m for m in ['matplotlib', 'gensim', 'sklearn', 'nltk'] if m in sys.modules])"
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ""
+
+
+def test_plot_neighborhood_stats_without_display(tmp_path, monkeypatch):
+    monkeypatch.delenv("DISPLAY", raising=False)
+    outfile = str(tmp_path / "density.png")
+    Utils.plot_neighborhood_stats(np.arange(9) * 1.5, np.arange(9) * 1.25, "cosine", "density", outfile)
+    with open(outfile, 'rb') as fin:
+        assert fin.read(8) == b"\x89PNG\r\n\x1a\n"
+    assert not os.path.exists(outfile + ".tmp")
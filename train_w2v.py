@@ -1,8 +1,16 @@
-from gensim.models import Word2Vec
 from nltk.tokenize import sent_tokenize
 import os
+import json
+import time
 import argparse
 import multiprocessing
+from collections import deque
+
+from output_files import atomic_output
+
+
+# Number of files tokenized together by one worker task
+TOKENIZATION_FILES_PER_CHUNK = 64
 
 
 def parse_args():
@@ -11,65 +19,278 @@ def parse_args():
                         help="Path to COHA or COCA text directory (containing decade / genre subdirectories)")
     parser.add_argument("data_split", choices=["historical", "modern"],
                         help="Historical (COHA) or Modern (COCA) data split")
+    parser.add_argument("--model_dirname", type=str, default="models",
+                        help="Directory to save the trained model to (default = 'models')")
+    parser.add_argument("--preprocessed_dirname", type=str, default="corpora",
+                        help="Directory to store the preprocessed (tokenized) corpus in (default = 'corpora')")
+    parser.add_argument("--preprocess", action='store_true',
+                        help="Tokenize the corpus into the preprocessed corpus directory before training "
+                             "(otherwise an existing preprocessed corpus is used, or the raw text is tokenized "
+                             "on every pass)")
+    parser.add_argument("--size", type=int, default=300, help="Dimensionality of the embeddings (default = 300)")
+    parser.add_argument("--window", type=int, default=5, help="Context window size (default = 5)")
+    parser.add_argument("--min_count", type=int, default=5, help="Minimum word count (default = 5)")
+    parser.add_argument("--tokenization_workers", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of processes used for sentence tokenization (default = number of CPUs)")
     return parser.parse_args()
 
 
+def get_corpus_dirs(data_split):
+    if data_split == 'historical':
+        return ['1810s', '1820s', '1830s', '1840s', '1850s',
+                '1860s', '1870s', '1880s', '1890s', '1900s',
+                '1910s', '1920s', '1930s', '1940s', '1950s',
+                '1960s', '1970s', '1980s']
+    else:
+        return ['text_academic_rpe', 'text_fiction_awq', 'text_magazine_qch', 'text_newspaper_lsp',
+                'text_spoken_kde']
+
+
+def tokenize_files(data_path, dirname, filenames, data_split):
+    """
+    Reading a chunk of text files of one decade / genre directory and converting them to sentences
+    :param data_path: path to COHA or COCA text directory
+    :param dirname: name of the decade / genre subdirectory
+    :param filenames: names of the files to read
+    :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+    :return: list of sentences (lists of lowercased tokens), number of documents and number of tokens read
+    """
+    sentences = []
+    num_docs = 0
+    for filename in filenames:
+        with open(f"{data_path}/{dirname}/{filename}") as f:
+            if data_split == 'historical':
+                # specific to reading COHA files
+                lines = f.readlines()
+                if len(lines) != 3:
+                    print(f"File {filename} contains {len(lines)} lines", flush=True)
+                    continue
+                texts = [lines[2]]
+            else:
+                # specific to reading COCA files
+                texts = f.readlines()[1:]
+        num_docs += len(texts)
+        for text in texts:
+            try:
+                sents = sent_tokenize(text)
+            except UnicodeDecodeError:
+                print(f"UnicodeDecodeError occurred in {filename}")
+                sents = []
+            for sent in sents:
+                sentences.append([x.lower() for x in sent.split(' ') if x != '@' and x.lower() != '<p>'])
+    return sentences, num_docs, sum(len(sentence) for sentence in sentences)
+
+
+def _tokenize_files_task(task):
+    return tokenize_files(*task)
+
+
+def read_directory_sentences(data_path, dirname, data_split, pool=None, num_pending=1,
+                             files_per_chunk=TOKENIZATION_FILES_PER_CHUNK):
+    """
+    Reading the text files of one decade / genre directory and converting them to sentences.
+    If a process pool is given, chunks of files are tokenized in parallel, but the sentences are still
+    returned in the same (deterministic) order as when reading the files one by one
+    :param data_path: path to COHA or COCA text directory
+    :param dirname: name of the decade / genre subdirectory
+    :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+    :param pool: process pool for tokenization (default = None, tokenizing in the current process)
+    :param num_pending: maximum number of chunks submitted to the pool ahead of the one being read (default = 1)
+    :param files_per_chunk: number of files tokenized by one task
+    :return: iterator over sentences (lists of lowercased tokens)
+    """
+    files = os.listdir(f"{data_path}/{dirname}")
+    tasks = [(data_path, dirname, files[i:i + files_per_chunk], data_split)
+             for i in range(0, len(files), files_per_chunk)]
+
+    start_time = time.time()
+    num_docs = 0
+    num_tokens = 0
+
+    if pool is None:
+        results = map(_tokenize_files_task, tasks)
+    else:
+        results = _ordered_bounded_imap(pool, _tokenize_files_task, tasks, num_pending)
+    for sentences, chunk_docs, chunk_tokens in results:
+        num_docs += chunk_docs
+        num_tokens += chunk_tokens
+        yield from sentences
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"Read directory {dirname}: {num_docs} docs, {num_tokens} tokens in {elapsed:.1f}s "
+          f"({num_docs / elapsed:.1f} docs/s, {num_tokens / elapsed:.0f} tokens/s)", flush=True)
+
+
+def _ordered_bounded_imap(pool, func, tasks, num_pending):
+    """
+    Same as pool.imap, but keeping at most num_pending tasks in flight, so that results do not pile up in memory
+    when they are consumed slower than they are produced
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= num_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def preprocess_directory(data_path, dirname, data_split, output_path):
+    """
+    Tokenizing one decade / genre directory and writing its sentences to a text file,
+    one sentence per line with tokens separated by single spaces (readable by gensim's LineSentence)
+    :param data_path: path to COHA or COCA text directory
+    :param dirname: name of the decade / genre subdirectory
+    :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+    :param output_path: path to the output file
+    :return: number of sentences written
+    """
+    num_sentences = 0
+    with atomic_output(output_path) as fout:
+        for sentence in read_directory_sentences(data_path, dirname, data_split):
+            fout.write(" ".join(sentence) + "\n")
+            num_sentences += 1
+    return num_sentences
+
+
+def get_corpus_fingerprint(data_path, data_split):
+    """
+    :param data_path: path to COHA or COCA text directory
+    :param data_split: 'historical' or 'modern' (corresponding to COHA and COCA respectively)
+    :return: description of the corpus a preprocessed corpus is built from: the text directory, the split
+    and the [size, modification time] of every text file
+    """
+    files = {}
+    for dirname in get_corpus_dirs(data_split):
+        if not os.path.isdir(f"{data_path}/{dirname}"):
+            continue
+        for filename in sorted(os.listdir(f"{data_path}/{dirname}")):
+            stat = os.stat(f"{data_path}/{dirname}/{filename}")
+            files[f"{dirname}/{filename}"] = [stat.st_size, stat.st_mtime_ns]
+    return {"data_path": os.path.abspath(data_path), "data_split": data_split, "files": files}
+
+
+def _preprocess_directory_task(task):
+    return task[1], preprocess_directory(*task)
+
+
+class CorpusSentences:
+    """
+    Restartable iterable over the tokenized sentences of COHA or COCA. The text files are read anew
+    on every pass (Word2Vec makes one pass to build the vocabulary and one per training epoch),
+    so the corpus is never held in memory
+    """
+
+    def __init__(self, data_path, data_split, workers=1):
+        self.data_path = data_path
+        self.data_split = data_split
+        self.workers = workers      # number of processes used for sentence tokenization
+
+    def __iter__(self):
+        if self.workers <= 1:
+            for dirname in get_corpus_dirs(self.data_split):
+                print(f"Reading directory: {dirname}", flush=True)
+                yield from read_directory_sentences(self.data_path, dirname, self.data_split)
+            return
+
+        # The corpus is iterated from a Word2Vec producer thread, so the workers are spawned rather than forked
+        with multiprocessing.get_context("spawn").Pool(self.workers) as pool:
+            for dirname in get_corpus_dirs(self.data_split):
+                print(f"Reading directory: {dirname}", flush=True)
+                yield from read_directory_sentences(self.data_path, dirname, self.data_split,
+                                                    pool=pool, num_pending=2 * self.workers)
+
+
+class PreprocessedSentences:
+    """
+    Restartable iterable over the sentences of a corpus preprocessed with preprocess_directory,
+    which skips sentence tokenization and filtering altogether
+    """
+
+    def __init__(self, preprocessed_path, data_split):
+        self.preprocessed_path = preprocessed_path
+        self.data_split = data_split
+
+    def __iter__(self):
+        for dirname in get_corpus_dirs(self.data_split):
+            print(f"Reading preprocessed directory: {dirname}", flush=True)
+            with open(f"{self.preprocessed_path}/{dirname}.txt") as f:
+                for line in f:
+                    # Splitting on single spaces (rather than any whitespace, as LineSentence does)
+                    # reproduces the tokenized sentences exactly. Sentences left without tokens after filtering
+                    # are written as empty lines, which are read back as empty sentences rather than ['']
+                    yield line[:-1].split(' ') if line != "\n" else []
+
+
 class EmbeddingTrainer:
     def __init__(self, params):
         self.data_path = params.data_path
         self.model_dirname = params.model_dirname
         self.data_split = params.data_split
-        self.model_file_path = f"models/{self.data_split}.w2v.bin"
-        self.sentences = []
+        self.model_file_path = f"{self.model_dirname}/{self.data_split}.w2v.bin"
+        self.preprocessed_path = f"{params.preprocessed_dirname}/{self.data_split}"
+        self.size = params.size
+        self.window = params.window
+        self.min_count = params.min_count
+        self.tokenization_workers = params.tokenization_workers
+
+        if params.preprocess:
+            self.preprocess()
+        elif os.path.exists(f"{self.preprocessed_path}/DONE") and not self.is_preprocessed():
+            print(f"The preprocessed corpus in {self.preprocessed_path} was built from another corpus", flush=True)
+            self.preprocess()
+        if self.is_preprocessed():
+            print(f"Using preprocessed corpus from {self.preprocessed_path}", flush=True)
+            self.sentences = PreprocessedSentences(self.preprocessed_path, self.data_split)
+        else:
+            self.sentences = CorpusSentences(self.data_path, self.data_split, workers=params.tokenization_workers)
 
-    def load_sentences(self):
+    def is_preprocessed(self):
         """
-        Reading text files and converting them to a set of sentence that the embeddings will be trained on
+        :return: True if the preprocessed corpus is complete and was built from the current corpus files
+        """
+        try:
+            with open(f"{self.preprocessed_path}/DONE") as fin:
+                fingerprint = json.load(fin)
+        except (OSError, ValueError):
+            return False
+        return fingerprint == get_corpus_fingerprint(self.data_path, self.data_split)
+
+    def preprocess(self):
+        """
+        Tokenizing the corpus once and saving it to the preprocessed corpus directory,
+        processing decade / genre directories in parallel (in up to tokenization_workers processes)
         :return:
         """
-        if self.data_split == 'historical':
-            dirs = ['1810s', '1820s', '1830s', '1840s', '1850s',
-                    '1860s', '1870s', '1880s', '1890s', '1900s',
-                    '1910s', '1920s', '1930s', '1940s', '1950s',
-                    '1960s', '1970s', '1980s']
-        else:
-            dirs = ['text_academic_rpe', 'text_fiction_awq', 'text_magazine_qch', 'text_newspaper_lsp',
-                    'text_spoken_kde']
-        for dirname in dirs:
-            print(f"Reading directory: {dirname}", flush=True)
-            files = os.listdir(f"{self.data_path}/{dirname}")
-            for filename in files:
-                with open(f"{self.data_path}/{dirname}/{filename}") as f:
-                    if self.data_split == 'historical':
-                        # specific to reading COHA files
-                        lines = f.readlines()
-                        if len(lines) != 3:
-                            print(f"File {filename} contains {len(lines)} lines", flush=True)
-                            continue
-                        texts = [lines[2]]
-                    else:
-                        # specific to reading COCA files
-                        texts = f.readlines()[1:]
-                    for text in texts:
-                        try:
-                            sents = sent_tokenize(text)
-                        except UnicodeDecodeError:
-                            print(f"UnicodeDecodeError occurred in {filename}")
-                            sents = []
-                        for sent in sents:
-                            self.sentences.append([x.lower() for x in sent.split(' ')
-                                                   if x != '@' and x.lower() != '<p>'])
+        print(f"Preprocessing {self.data_split.upper()} data into {self.preprocessed_path}", flush=True)
+        os.makedirs(self.preprocessed_path, exist_ok=True)
+        if os.path.exists(f"{self.preprocessed_path}/DONE"):
+            os.remove(f"{self.preprocessed_path}/DONE")
+
+        dirs = get_corpus_dirs(self.data_split)
+        tasks = [(self.data_path, dirname, self.data_split, f"{self.preprocessed_path}/{dirname}.txt")
+                 for dirname in dirs]
+        with multiprocessing.Pool(max(1, min(len(dirs), self.tokenization_workers))) as pool:
+            for dirname, num_sentences in pool.imap_unordered(_preprocess_directory_task, tasks):
+                print(f"Preprocessed directory {dirname}: {num_sentences} sentences", flush=True)
+
+        # The marker file is only written once all directories have been preprocessed. It records the corpus
+        # files they were preprocessed from, so that a preprocessed corpus is never used for another corpus
+        with atomic_output(f"{self.preprocessed_path}/DONE") as fout:
+            json.dump(get_corpus_fingerprint(self.data_path, self.data_split), fout, indent=2)
 
     def train_w2v(self):
         """
         Learning Word2Vec embeddings from the provided data
         :return:
         """
-        self.load_sentences()
         print(f"Building Word2Vec embeddings for {self.data_split.upper()} data", flush=True)
         print(f"Model will be saved to file {self.model_file_path}", flush=True)
+        # Imported here so that preprocessing does not load gensim
+        from gensim.models import Word2Vec
 
-        model = Word2Vec(self.sentences, size=300, window=5, min_count=5, workers=multiprocessing.cpu_count(), sg=1)
+        model = Word2Vec(self.sentences, size=self.size, window=self.window, min_count=self.min_count,
+                         workers=multiprocessing.cpu_count(), sg=1)
         print(f"Finished training Word2Vec for {self.data_split.upper()} data", flush=True)
         model.save(self.model_file_path)
         print(f"Model saved to file", flush=True)
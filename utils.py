@@ -1,10 +1,20 @@
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy import special
+
+from profiling import profiler
+from output_files import atomic_output
 
 # Fixed hyperparameters used in our analysis
 MIN_FREQUENCY_RATIO = 20
 MIN_WORD_LEN = 3
 MAX_SPEARMANS_CORRELATION = 0.1
+# Control words must differ from their neologisms by less than MAX_CONTROL_LENGTH_DIFFERENCE characters
+# and the neologism-control frequency ratio must fall strictly within the range below.
+# To replicate our results, one needs to restrict the frequency ratio to fall within (0.75, 1.33),
+# rather than (0.75, 1.25) as reported in the paper
+MAX_CONTROL_LENGTH_DIFFERENCE = 2
+MIN_CONTROL_FREQUENCY_RATIO = 0.75
+MAX_CONTROL_FREQUENCY_RATIO = 1.33
 COSINE_RADIUS_RANGE = np.arange(0.55, 0.35, -0.025)
 EUCLIDEAN_RADIUS_RANGE = np.arange(2, 5.5, 0.5)
 
@@ -42,70 +52,146 @@ class Utils:
         return dn
 
     @staticmethod
-    def reformat_feats_for_glm(density_filename, growth_filename, radius_range, outfile):
+    def rank_rows(matrix):
+        """
+        Ranking the values in each row of a matrix, assigning tied values the average of their ranks
+        (same as scipy.stats.rankdata with the default 'average' method, applied to every row)
+        :param matrix: 2D array of values to rank
+        :return: array of ranks (starting from 1) of the same shape as the input
+        """
+
+        num_rows, num_cols = matrix.shape
+        order = np.argsort(matrix, axis=1, kind='mergesort')
+        sorted_matrix = np.take_along_axis(matrix, order, axis=1)
+        positions = np.broadcast_to(np.arange(num_cols), matrix.shape)
+
+        # Positions (in sorted order) of the first and the last element of each group of tied values
+        is_first = np.ones(matrix.shape, dtype=bool)
+        is_first[:, 1:] = sorted_matrix[:, 1:] != sorted_matrix[:, :-1]
+        is_last = np.ones(matrix.shape, dtype=bool)
+        is_last[:, :-1] = is_first[:, 1:]
+        first = np.maximum.accumulate(np.where(is_first, positions, 0), axis=1)
+        last = np.minimum.accumulate(np.where(is_last, positions, num_cols - 1)[:, ::-1], axis=1)[:, ::-1]
+
+        ranks = np.empty(matrix.shape, dtype=np.float64)
+        np.put_along_axis(ranks, order, 0.5 * (first + last + 2), axis=1)
+        return ranks
+
+    @staticmethod
+    def batch_spearmanr(x, matrix):
+        """
+        Computing Spearman correlation coefficients and two-sided p-values between the sequence x and every
+        row of the matrix at once. Follows the computation in scipy.stats.spearmanr, so the results match
+        calling it separately for each row; rows with constant values get NaN
+        :param x: sequence of values (e.g. time steps)
+        :param matrix: 2D array, each row of which is correlated with x
+        :return: arrays of correlation coefficients and p-values, one value per row
+        """
+
+        matrix = np.asarray(matrix, dtype=np.float64)
+        num_obs = matrix.shape[1]
+        x_ranks = Utils.rank_rows(np.asarray(x, dtype=np.float64)[np.newaxis, :])[0]
+        ranks = Utils.rank_rows(matrix)
+
+        # Same operations as np.corrcoef on the pair of rank vectors, so that the results are bitwise identical
+        scale = np.true_divide(1, num_obs - 1)
+        x_centered = x_ranks - x_ranks.mean()
+        centered = ranks - ranks.mean(axis=1, keepdims=True)
+        covariance = (centered @ x_centered) * scale
+        x_stddev = np.sqrt(np.dot(x_centered, x_centered) * scale)
+        stddev = np.sqrt(np.einsum('ij,ij->i', centered, centered) * scale)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = np.clip(covariance / stddev / x_stddev, -1, 1)
+        rs[(stddev == 0) | (x_stddev == 0)] = np.nan
+
+        dof = num_obs - 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = rs * np.sqrt((dof / ((rs + 1.0) * (1.0 - rs))).clip(0))
+        pvalues = 2 * special.stdtr(dof, -np.abs(t))
+        return rs, pvalues
+
+    @staticmethod
+    def neighborhood_profile(similarities, growth, radius_range, exact_means=False):
+        """
+        Computing the density and mean frequency growth rate of the neighborhoods of a word for a range of radii
+        in one pass, using binary search over the sorted similarities and cumulative sums of the growth rates
+        :param similarities: cosine similarities of the neighbors to the word, sorted in descending order
+        :param growth: frequency growth rates of the neighbors aligned with the similarities (NaN if unknown)
+        :param radius_range: radii (minimum similarities) to compute the statistics for, in any order
+        :param exact_means: whether to take each mean with np.mean over its neighbors instead of from the cumulative
+        sums, which is bitwise identical to the original per-radius computation but costs one pass per radius
+        (default = False)
+        :return: arrays of neighborhood densities and mean frequency growth rates, one value per radius
+        (NaN growth for neighborhoods without any neighbor with a known growth rate)
+        """
+
+        # Neighbors within radius r are the ones with similarity >= r, i.e. a prefix of the sorted neighbors
+        similarities = np.asarray(similarities, dtype=np.float64)
+        density = np.searchsorted(-similarities, -np.asarray(radius_range, dtype=np.float64), side='right')
+
+        growth = np.asarray(growth, dtype=np.float64)
+        known = ~np.isnan(growth)
+        growth_counts = np.concatenate([[0], np.cumsum(known)])[density]
+        if exact_means:
+            # np.mean sums pairwise, so the cumulative sums may differ from it in the last bit
+            known_growth = growth[known]
+            mean_growth = np.array([np.mean(known_growth[:count]) if count > 0 else np.nan
+                                    for count in growth_counts])
+            return density, mean_growth
+
+        growth_sums = np.concatenate([[0.0], np.cumsum(np.where(known, growth, 0.0))])[density]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_growth = growth_sums / growth_counts
+        mean_growth[growth_counts == 0] = np.nan
+        return density, mean_growth
+
+    @staticmethod
+    def reformat_feats_for_glm(words, is_neologism, density, growth, radius_range, outfile):
         """
-        Reading density and frequency growth values from corresponding files and re-formatting them
-        to create input for the GLM script
-        :param density_filename: path to the file storing the neighborhood densities
-        :param growth_filename: path to the file storing the neighborhood frequency growth rates
+        Writing the density and frequency growth values of the words to a CSV file, as input for the GLM script
+        :param words: neologisms and control words
+        :param is_neologism: role of each word (True for the neologisms, False for the control words)
+        :param density: neighborhood densities of each word (words x radii)
+        :param growth: mean neighborhood frequency growth rates of each word (words x radii, NaN if empty)
         :param radius_range: range of cosine similarity thresholds defining neighborhood sizes
         :param outfile: file path to output features that GLM will be fit to
         :return:
         """
 
-        neologisms_list = []
-        controls_list = []
-        density_dict = {}
-        growth_dict = {}
-
-        with open(density_filename) as fin:
-            for line in fin:
-                s = line.strip().split('\t')
-                neologism = s[0]
-                neologisms_list.append(neologism)
-                density_dict[neologism] = s[1:len(radius_range)+1]
-                control = s[len(radius_range)+1]
-                controls_list.append(control)
-                density_dict[control] = s[len(radius_range)+2:]
-
-        with open(growth_filename) as fin:
-            for line in fin:
-                s = line.strip().split('\t')
-                neologism = s[0]
-                neologisms_list.append(neologism)
-                growth_dict[neologism] = s[1:len(radius_range)+1]
-                control = s[len(radius_range)+1]
-                controls_list.append(control)
-                growth_dict[control] = s[len(radius_range)+2:]
-
-        with open(outfile, 'w') as fout:
-            vars = ["Word"] + ["DensityAtRadius" + "{0:.3f}".format(r) for r in radius_range] + \
-                   ["SpearmanAtRadius" + "{0:.3f}".format(r) for r in radius_range] + ["IsNeologism"]
-            fout.write(",".join(vars) + "\n")
-
-            for neologism in neologisms_list:
-                feats = [neologism] + [str(x) for x in density_dict[neologism]] + \
-                       [str(x) for x in growth_dict[neologism]] + ['1']
-                fout.write(",".join(feats) + '\n')
-                fout.flush()
-            for control in controls_list:
-                feats = [control] + [str(x) for x in density_dict[control]] + \
-                        [str(x) for x in growth_dict[control]] + ['0']
-                fout.write(",".join(feats) + "\n")
-                fout.flush()
+        def format_value(x):
+            return "NaN" if np.isnan(x) else str(x)
+
+        with profiler.loop("reformat_feats_for_glm") as counter:
+            # Every word is listed twice, neologisms first, as in the files the GLM script was originally run on
+            rows = np.concatenate([np.flatnonzero(is_neologism)] * 2 + [np.flatnonzero(~is_neologism)] * 2)
+            with atomic_output(outfile) as fout:
+                vars = ["Word"] + ["DensityAtRadius" + "{0:.3f}".format(r) for r in radius_range] + \
+                       ["SpearmanAtRadius" + "{0:.3f}".format(r) for r in radius_range] + ["IsNeologism"]
+                fout.write(",".join(vars) + "\n")
+
+                for i in rows:
+                    feats = [words[i]] + [format_value(x) for x in density[i]] + \
+                            [format_value(x) for x in growth[i]] + ['1' if is_neologism[i] else '0']
+                    fout.write(",".join(feats) + "\n")
+            counter.add(rows=len(rows))
 
     @staticmethod
-    def plot_neighborhood_stats(mean_neologism_statistic, mean_control_statistic, distance, statistic):
+    def plot_neighborhood_stats(mean_neologism_statistic, mean_control_statistic, distance, statistic, outfile):
         """
-        Visualizing a bar chart of mean neighborhood density or frequency growth rate
+        Saving a bar chart of mean neighborhood density or frequency growth rate to an image file.
+        The chart is drawn with matplotlib's non-interactive Agg renderer, so no display is needed
         :param mean_neologism_statistic: a list of values of the statistic for different neighborhood sizes,
         averaged over all neologisms
         :param mean_control_statistic: a list of values of the statistic for different neighborhood sizes,
         averaged over all control words
         :param distance: distance metric to use ('cosine' or 'euclidean')
         :param statistic: type of the statistic provided ('density' or 'growth')
+        :param outfile: path to the image file (the format is given by the extension, e.g. '.png')
         :return:
         """
+        # Imported here so that matplotlib is only loaded when plotting
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
 
         assert distance == "cosine" or distance == "euclidean"
         assert statistic == "density" or statistic == "growth"
@@ -117,7 +203,9 @@ class Utils:
             width = 0.5 / 3
             radius_range = EUCLIDEAN_RADIUS_RANGE
 
-        fig, ax = plt.subplots()
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
         p_neologism = ax.bar(radius_range, mean_neologism_statistic, width, color='b')
         p_control = ax.bar(radius_range + width, mean_control_statistic, width, color='r')
         ax.legend((p_neologism[0], p_control[0]), ("Neigborhoods of neologisms", "Neighborhoods of control words"))
@@ -125,4 +213,6 @@ class Utils:
             ax.set_title("Average number of neighbor words in radius")
         else:
             ax.set_title("Average frequency growth rate of the neighbor words")
-        plt.show()
+        # The format is given explicitly, since the chart is saved to a temporary file
+        with atomic_output(outfile, 'wb') as fout:
+            fig.savefig(fout, format=outfile.rsplit(".", 1)[-1])